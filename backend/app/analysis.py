@@ -0,0 +1,211 @@
+import re
+from app.image_analysis import detect_blur, validate_image
+from app.image_pipeline import decode_image, prepare_views, TARGET_RESOLUTIONS
+from app.batching import score_image
+from app.executor import OPENCV_EXECUTOR
+from app.llm_gateway import LLM_GATEWAY
+from app.stage_graph import StageGraph, SkipStage
+from app.models_config import CASCADE_BLUR_REJECT, CASCADE_NIMA_REJECT, CASCADE_LIQE_REJECT
+
+NIMA_MODEL = "NIMA (VGG16-AVA)"
+LIQE_MODEL = "LIQE (No-Reference)"
+
+GPT_SOLO_PROMPT = """
+        Tu es un expert en analyse de qualité d'image. 
+        Évalue cette image en mettant une note sur 10 :
+        - **Qualité technique** : netteté, bruit, exposition, couleurs.
+        - **Qualité esthétique** : composition, équilibre, attrait visuel.
+        
+        🔹 **Note sur 100** : 
+        Donne une note finale basée sur ces critères. 
+
+        🔹 **Résumé en une phrase** : 
+        Décris en 1 phrase ce que tu vois dans l'image.
+        """
+
+class InvalidImage(ValueError):
+    """Levée lorsqu'une image reçue n'est pas exploitable."""
+
+def decode_for_analysis(data):
+    """Décode l'image à la résolution OpenCV (avec sa version en niveaux de gris) et la valide."""
+    decoded = decode_image(data, TARGET_RESOLUTIONS["opencv"], grayscale=True)
+    validate_decoded(decoded)
+    return decoded
+
+def validate_decoded(decoded):
+    valid, error_msg = validate_image(decoded.array)
+    if not valid:
+        raise InvalidImage(error_msg)
+
+def decode_views(data, metrics):
+    """Décode l'image une seule fois et retourne une vue validée à la résolution de chaque métrique."""
+    views = prepare_views(data, metrics)
+    for view in views.values():
+        validate_decoded(view)
+    return views
+
+async def ask_gpt4o(system_prompt, prompt, image_url):
+    """Envoie un prompt et une URL d'image à GPT-4o (via la passerelle OpenAI) et retourne sa réponse."""
+    return await LLM_GATEWAY.chat(system_prompt, prompt, image_url)
+
+def parse_gpt_score(gpt_analysis):
+    """Extrait la note "Score final : XX/100" de la réponse GPT, ou None."""
+    score_match = re.search(r"Score final\s*:\s*(\d+)/100", gpt_analysis or "")
+    return int(score_match.group(1)) if score_match else None
+
+def cascade_version():
+    """Seuils de la cascade, intégrés à la clé de cache des résultats obtenus en mode cascade."""
+    return f"cascade-{CASCADE_BLUR_REJECT}-{CASCADE_NIMA_REJECT}-{CASCADE_LIQE_REJECT}"
+
+def metrics_graph(data, cascade=False):
+    """
+    Graphe des métriques : décodage (une vue par métrique), puis OpenCV, NIMA et LIQE en parallèle.
+    En mode cascade, NIMA et LIQE attendent OpenCV et sont sautés si l'image est trop floue.
+    """
+    graph = StageGraph()
+    graph.add("decode", lambda: OPENCV_EXECUTOR.run(decode_views, data, ["opencv", "nima", "liqe"]))
+    graph.add("opencv", lambda decode: OPENCV_EXECUTOR.run(detect_blur, decode["opencv"].gray), ["decode"])
+    if not cascade:
+        graph.add("nima", lambda decode: score_image(NIMA_MODEL, decode["nima"].array), ["decode"])
+        graph.add("liqe", lambda decode: score_image(LIQE_MODEL, decode["liqe"].array), ["decode"])
+        return graph
+
+    async def scored_if_sharp(model_name, view, opencv):
+        if opencv[1] >= CASCADE_BLUR_REJECT:
+            raise SkipStage(f"image trop floue (score de flou {opencv[1]:.2f} ≥ {CASCADE_BLUR_REJECT})")
+        return await score_image(model_name, view.array)
+
+    graph.add("nima", lambda decode, opencv: scored_if_sharp(NIMA_MODEL, decode["nima"], opencv), ["decode", "opencv"])
+    graph.add("liqe", lambda decode, opencv: scored_if_sharp(LIQE_MODEL, decode["liqe"], opencv), ["decode", "opencv"])
+    return graph
+
+def gpt_skip_reason(nima_score, liqe_score):
+    """Raison de ne pas interroger GPT-4o en mode cascade (scores absents ou sous les seuils), ou None."""
+    if nima_score is None or liqe_score is None:
+        return "scores NIMA/LIQE non calculés"
+    if nima_score < CASCADE_NIMA_REJECT:
+        return f"score NIMA {nima_score:.2f} < {CASCADE_NIMA_REJECT}"
+    if liqe_score < CASCADE_LIQE_REJECT:
+        return f"score LIQE {liqe_score:.2f} < {CASCADE_LIQE_REJECT}"
+    return None
+
+def combined_result(blur_result, nima_score, liqe_score):
+    """Met en forme le résultat de l'analyse combinée OpenCV + NIMA + LIQE (None = métrique sautée)."""
+    blur_score = blur_result[1] * 100
+    clarity = "Flou" if blur_score >= 50 else "Net"
+    if nima_score is None:
+        nima_quality = "Non évaluée (image rejetée)"
+    else:
+        nima_quality = "Bonne qualité esthétique 👍" if nima_score >= 5 else "Mauvaise qualité esthétique 👎"
+    if liqe_score is None:
+        liqe_quality = "Non évaluée (image rejetée)"
+    else:
+        liqe_quality = "Bonne qualité technique 👍" if liqe_score >= 5 else "Mauvaise qualité technique 👎"
+
+    return {
+        "method": "Combined Analysis",
+        "scores": {
+            "opencv_blur": f"{blur_score:.2f}%",
+            "nima_esthetic": f"{nima_score:.2f}" if nima_score is not None else None,
+            "liqe_technical": f"{liqe_score:.2f}" if liqe_score is not None else None
+        },
+        "evaluation": {
+            "clarity": f"L'image est {clarity}",
+            "esthetic_quality": nima_quality,
+            "technical_quality": liqe_quality
+        },
+    }
+
+def gpt_combined_analysis(blur_result, nima_score, liqe_score):
+    """Met en forme les scores OpenCV, NIMA et LIQE transmis à GPT-4o."""
+    clarity, blur_raw_score = blur_result
+    blur_score = (1 - blur_raw_score) * 100 
+
+    if nima_score >= 6:
+        nima_quality = "Excellente qualité esthétique ⭐⭐⭐"
+    elif 5 <= nima_score < 6:
+        nima_quality = "Bonne qualité esthétique 👍"
+    elif 3 <= nima_score < 5:
+        nima_quality = "Qualité esthétique moyenne 🤔"
+    else:
+        nima_quality = "Mauvaise qualité esthétique 👎"
+
+    liqe_quality = "Bonne qualité technique 👍" if liqe_score >= 5 else "Mauvaise qualité technique 👎"
+
+    return {
+        "method": "Combined Analysis",
+        "scores": {
+            "opencv_blur": f"{blur_score:.2f}%", 
+            "nima_esthetic": f"{nima_score:.2f}",
+            "liqe_technical": f"{liqe_score:.2f}"
+        },
+        "evaluation": {
+            "clarity": f"L'image est {clarity}",
+            "esthetic_quality": nima_quality,
+            "technical_quality": liqe_quality
+        },
+    }
+
+def gpt_combined_prompt(combined_analysis):
+    """Construit le prompt GPT-4o à partir de l'analyse combinée."""
+    return f"""
+        Tu es un expert en analyse d'image.
+        Voici l'évaluation technique et esthétique d'une image :
+
+        - **Netteté détectée (OpenCV)** : {combined_analysis['scores']['opencv_blur']}
+        - **Score esthétique (NIMA)** : {combined_analysis['scores']['nima_esthetic']}
+        - **Score technique (LIQE)** : {combined_analysis['scores']['liqe_technical']}
+        - **Clarté** : {combined_analysis['evaluation']['clarity']}
+        - **Qualité esthétique** : {combined_analysis['evaluation']['esthetic_quality']}
+        - **Qualité technique** : {combined_analysis['evaluation']['technical_quality']}
+
+        🔍 **Analyse finale** :
+        Donne ton analyse sur l'image et donne lui une note.
+        **Note l’image sur 100** en prenant en compte tous ces critères et donne la note sous la forme "Score final : XX/100".
+        """
+
+async def analyze_combined_image(data, cascade=False):
+    """Analyse OpenCV + NIMA + LIQE ; retourne le résultat et la durée de chaque étape (ms)."""
+    graph = metrics_graph(data, cascade)
+    results = await graph.run()
+    result = combined_result(results["opencv"], results["nima"], results["liqe"])
+    return {**result, "cascade": cascade, **graph.report()}, graph.timings
+
+async def analyze_combined_with_gpt(data, image_url, cascade=False):
+    """Analyse OpenCV + NIMA + LIQE puis GPT-4o ; retourne le résultat et la durée de chaque étape (ms)."""
+    graph = metrics_graph(data, cascade)
+
+    async def gpt(opencv, nima, liqe):
+        reason = gpt_skip_reason(nima, liqe) if cascade else None
+        if reason:
+            raise SkipStage(reason)
+        combined_analysis = gpt_combined_analysis(opencv, nima, liqe)
+        gpt_analysis = await ask_gpt4o(
+            "Tu es un expert en analyse d'images et en qualité visuelle.",
+            gpt_combined_prompt(combined_analysis),
+            image_url
+        )
+        return combined_analysis, gpt_analysis
+
+    graph.add("gpt", gpt, ["opencv", "nima", "liqe"])
+    results = await graph.run()
+    if results["gpt"] is None:
+        # GPT-4o sauté par la cascade : on renvoie l'analyse combinée locale.
+        result = {
+            "method": "GPT-4o Image Analysis",
+            "gpt_analysis": None,
+            "combined_scores": combined_result(results["opencv"], results["nima"], results["liqe"]),
+            "gpt_final_score": f"Non évalué ({graph.skipped['gpt']})",
+        }
+        return {**result, "cascade": cascade, **graph.report()}, graph.timings
+
+    combined_analysis, gpt_analysis = results["gpt"]
+    gpt_final_score = parse_gpt_score(gpt_analysis)
+
+    result = {
+        "method": "GPT-4o Image Analysis",
+        "gpt_analysis": gpt_analysis,
+        "combined_scores": combined_analysis,
+        "gpt_final_score": gpt_final_score if gpt_final_score is not None else "Score non détecté"
+    }
+    return {**result, "cascade": cascade, **graph.report()}, graph.timings
@@ -0,0 +1,85 @@
+import asyncio
+import json
+import os
+from app.models_config import IMAGE_DIR, BATCH_CONCURRENCY
+from app.image_analysis import detect_blur, validate_image
+from app.image_pipeline import prepare_views
+from app.ingestion import check_upload_size
+from app.batching import score_image
+from app.executor import OPENCV_EXECUTOR
+from app.analysis import NIMA_MODEL, LIQE_MODEL
+
+PYIQA_METRICS = {
+    "nima": NIMA_MODEL,
+    "liqe": LIQE_MODEL
+}
+BATCH_METRICS = ["opencv", *PYIQA_METRICS]
+
+def parse_metrics(metrics):
+    """Valide la liste de métriques demandées (séparées par des virgules)."""
+    selected = [metric.strip().lower() for metric in metrics.split(",") if metric.strip()]
+    unknown = [metric for metric in selected if metric not in BATCH_METRICS]
+    if unknown or not selected:
+        raise ValueError(f"Métriques invalides : {', '.join(unknown) or metrics}. Disponibles : {', '.join(BATCH_METRICS)}")
+    return list(dict.fromkeys(selected))
+
+def resolve_image_path(relative_path):
+    """Résout un chemin relatif au dossier d'images, en refusant de sortir de ce dossier."""
+    base = os.path.realpath(IMAGE_DIR)
+    path = os.path.realpath(os.path.join(base, relative_path))
+    if os.path.commonpath([base, path]) != base:
+        raise ValueError(f"Chemin invalide : {relative_path}")
+    return path
+
+def read_file(path):
+    """Lit une image du dossier, avec la même limite de taille que les images téléversées."""
+    check_upload_size(os.path.basename(path), os.path.getsize(path))
+    with open(path, "rb") as f:
+        return f.read()
+
+def opencv_scores(decoded):
+    """Calcule la netteté OpenCV sur la vue à la résolution OpenCV."""
+    valid, error_msg = validate_image(decoded.array)
+    if not valid:
+        raise ValueError(error_msg)
+    clarity, blur_score = detect_blur(decoded.gray)
+    return {"clarity": clarity, "blur_score": blur_score}
+
+async def analyze_item(name, source, metrics):
+    """Analyse une image (octets ou chemin relatif) avec les métriques demandées."""
+    try:
+        if isinstance(source, bytes):
+            data = source
+        else:
+            data = await OPENCV_EXECUTOR.run(read_file, resolve_image_path(source))
+        views = await OPENCV_EXECUTOR.run(prepare_views, data, metrics)
+
+        # Les images d'un même lot arrivent ensemble dans les schedulers NIMA/LIQE,
+        # qui les regroupent en batchs pour l'inférence.
+        tasks = {}
+        if "opencv" in metrics:
+            tasks["opencv"] = OPENCV_EXECUTOR.run(opencv_scores, views["opencv"])
+        for metric, model_name in PYIQA_METRICS.items():
+            if metric in metrics:
+                tasks[metric] = score_image(model_name, views[metric].array)
+
+        values = await asyncio.gather(*tasks.values())
+        return {"image": name, **dict(zip(tasks, values))}
+    except Exception as e:
+        return {"image": name, "error": str(e)}
+
+async def stream_batch(items, metrics):
+    """Analyse un lot d'images et produit une ligne JSON par image, dans l'ordre de fin de traitement."""
+    semaphore = asyncio.Semaphore(max(1, BATCH_CONCURRENCY))
+
+    async def run(name, source):
+        async with semaphore:
+            return await analyze_item(name, source, metrics)
+
+    tasks = [asyncio.ensure_future(run(name, source)) for name, source in items]
+    try:
+        for next_done in asyncio.as_completed(tasks):
+            yield json.dumps(await next_done, ensure_ascii=False) + "\n"
+    finally:
+        for task in tasks:
+            task.cancel()
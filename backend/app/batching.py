@@ -0,0 +1,156 @@
+import asyncio
+import time
+import numpy as np
+import torch
+from app.models_config import BATCH_MAX_SIZE, BATCH_MAX_WAIT_MS, EXECUTOR_MAX_QUEUE, TORCH_WORKERS
+from app.model_registry import PYIQA_MODELS, get_pyiqa_model, get_device
+from app.executor import BoundedExecutor, ExecutorSaturated
+from app.telemetry import MODEL_DURATION, MODEL_BATCH_SIZE, Gauge, register
+
+def image_to_tensor(image):
+    """Convertit une image PIL RGB en tenseur (3, H, W) normalisé entre 0 et 1."""
+    array = np.asarray(image, dtype=np.float32) / 255.0
+    return torch.from_numpy(array).permute(2, 0, 1)
+
+def _forward(model, model_name, tensors):
+    """Passe avant d'un groupe de tenseurs de même taille ; retourne leurs scores."""
+    batch = torch.stack(tensors).to(get_device())
+    start = time.perf_counter()
+    output = model(batch).flatten().tolist()
+    MODEL_DURATION.observe(time.perf_counter() - start, model_name)
+    MODEL_BATCH_SIZE.observe(len(tensors), model_name)
+    return [float(score) for score in output]
+
+def score_batch_isolated(model_name, images):
+    """
+    Évalue une liste d'images en regroupant celles de même taille dans une seule passe avant.
+    Si un groupe échoue (ex. compilation impossible pour une nouvelle taille H×W), ses images sont
+    réévaluées une à une : seules les images fautives sont en erreur.
+    Retourne une liste de (score, exception ou None).
+    """
+    model = get_pyiqa_model(model_name)
+    tensors = [image_to_tensor(image) for image in images]
+    groups = {}
+    for index, tensor in enumerate(tensors):
+        groups.setdefault(tuple(tensor.shape), []).append(index)
+
+    results = [(0.0, None)] * len(tensors)
+    # Chaque backend choisit son propre mode d'inférence (inference_mode, TorchScript, ONNX...).
+    with torch.no_grad():
+        for indices in groups.values():
+            try:
+                for i, score in zip(indices, _forward(model, model_name, [tensors[i] for i in indices])):
+                    results[i] = (score, None)
+                continue
+            except Exception as e:
+                if len(indices) == 1:
+                    results[indices[0]] = (None, e)
+                    continue
+            for i in indices:
+                try:
+                    results[i] = (_forward(model, model_name, [tensors[i]])[0], None)
+                except Exception as e:
+                    results[i] = (None, e)
+    return results
+
+def score_batch(model_name, images):
+    """Évalue une liste d'images (voir score_batch_isolated) ; lève l'erreur de la première image en échec."""
+    results = score_batch_isolated(model_name, images)
+    for _, error in results:
+        if error is not None:
+            raise error
+    return [score for score, _ in results]
+
+class BatchScheduler:
+    """Regroupe les requêtes arrivant dans une même fenêtre de temps en un seul batch."""
+
+    def __init__(self, model_name, max_batch_size=BATCH_MAX_SIZE, max_wait_ms=BATCH_MAX_WAIT_MS,
+                 max_queue=EXECUTOR_MAX_QUEUE):
+        self.model_name = model_name
+        self.max_batch_size = max(1, max_batch_size)
+        self.max_wait = max_wait_ms / 1000
+        self.max_queue = max(1, max_queue)
+        # Un pool par modèle : NIMA et LIQE peuvent s'exécuter en parallèle.
+        self.executor = BoundedExecutor(f"torch-{PYIQA_MODELS[model_name]}", TORCH_WORKERS)
+        self._queue = None
+        self._worker = None
+        self._in_flight = set()
+
+    @property
+    def queue_depth(self):
+        """Nombre d'images en attente d'un batch."""
+        return self._queue.qsize() if self._queue is not None else 0
+
+    async def submit(self, image):
+        """Ajoute une image à la file et attend son score, ou lève ExecutorSaturated si la file est pleine."""
+        loop = asyncio.get_running_loop()
+        if self._worker is None or self._worker.done():
+            self._queue = asyncio.Queue(maxsize=self.max_queue)
+            self._worker = loop.create_task(self._run())
+
+        future = loop.create_future()
+        try:
+            self._queue.put_nowait((image, future))
+        except asyncio.QueueFull:
+            raise ExecutorSaturated(f"Serveur saturé ({self.model_name}), réessayez plus tard")
+        return await future
+
+    async def _collect(self):
+        """Attend une première requête puis collecte les suivantes jusqu'à la taille ou au délai maximal."""
+        loop = asyncio.get_running_loop()
+        items = [await self._queue.get()]
+        deadline = loop.time() + self.max_wait
+        while len(items) < self.max_batch_size:
+            timeout = deadline - loop.time()
+            if timeout <= 0:
+                break
+            try:
+                items.append(await asyncio.wait_for(self._queue.get(), timeout))
+            except asyncio.TimeoutError:
+                break
+        return items
+
+    async def _run(self):
+        # Jusqu'à TORCH_WORKERS batchs en parallèle par modèle ; le suivant se remplit pendant ce temps.
+        # La taille du pool est lue ici, après un éventuel redimensionnement dans le worker forké.
+        slots = asyncio.Semaphore(self.executor.max_workers)
+        while True:
+            await slots.acquire()
+            try:
+                items = await self._collect()
+            except BaseException:
+                slots.release()
+                raise
+            task = asyncio.get_running_loop().create_task(self._process(items))
+            self._in_flight.add(task)
+            task.add_done_callback(lambda done: (self._in_flight.discard(done), slots.release()))
+
+    async def _process(self, items):
+        images = [image for image, _ in items]
+        try:
+            results = await self.executor.run(score_batch_isolated, self.model_name, images)
+        except Exception as e:
+            for _, future in items:
+                if not future.done():
+                    future.set_exception(e)
+            return
+
+        # Une image en erreur n'affecte pas les autres requêtes du batch.
+        for (_, future), (score, error) in zip(items, results):
+            if future.done():
+                continue
+            if error is not None:
+                future.set_exception(error)
+            else:
+                future.set_result(score)
+
+SCHEDULERS = {name: BatchScheduler(name) for name in PYIQA_MODELS}
+
+register(Gauge(
+    "photo_batch_queue_depth", "Images en attente d'un batch d'inférence par modèle", ("model",),
+    lambda: {(name,): scheduler.queue_depth for name, scheduler in SCHEDULERS.items()}
+))
+
+async def score_image(model_name, image):
+    """Retourne le score PyIQA d'une image en passant par le scheduler de batch du modèle."""
+    return await SCHEDULERS[model_name].submit(image)
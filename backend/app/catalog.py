@@ -0,0 +1,276 @@
+import logging
+import os
+import threading
+import time
+from PIL import Image
+from app.models_config import (
+    IMAGE_DIR, SCORE_INDEX_DB, CATALOG_SCAN_INTERVAL_S, CATALOG_MAX_PAGE_SIZE, CATALOG_PHASH
+)
+from app.scoring_job import IMAGE_EXTENSIONS, open_index
+from app.perceptual_hash import image_hash, hash_to_hex
+from app.telemetry import Gauge, register
+
+logger = logging.getLogger(__name__)
+
+SCORE_COLUMNS = ("opencv", "nima", "liqe")
+# Le scan valide ses écritures par lots : la première indexation d'une grande bibliothèque
+# ne garde pas toutes les lignes en mémoire et reste reprenable si elle est interrompue.
+SCAN_COMMIT_EVERY = 500
+SCAN_FIELDS = ("images", "changed", "removed", "duration_s", "finished_at")
+
+def open_catalog(db_path=SCORE_INDEX_DB):
+    """Ouvre (et crée si besoin) le catalogue des images, dans la même base que l'index des scores."""
+    db = open_index(db_path)
+    # WAL : les lectures de l'API ne sont pas bloquées par le scan ou le job de scoring.
+    db.execute("PRAGMA journal_mode=WAL")
+    db.execute(
+        "CREATE TABLE IF NOT EXISTS catalog ("
+        "path TEXT PRIMARY KEY, folder TEXT, size INTEGER, mtime REAL, width INTEGER, height INTEGER)"
+    )
+    db.execute("CREATE INDEX IF NOT EXISTS catalog_folder ON catalog (folder, path)")
+    columns = [row[1] for row in db.execute("PRAGMA table_info(catalog)")]
+    if "phash" not in columns:
+        db.execute("ALTER TABLE catalog ADD COLUMN phash TEXT")
+    if "unreadable" not in columns:
+        # Image illisible : elle n'est relue que si sa taille ou sa date de modification change.
+        db.execute("ALTER TABLE catalog ADD COLUMN unreadable INTEGER NOT NULL DEFAULT 0")
+    # Résumé du dernier scan, partagé par tous les workers (un seul d'entre eux scanne).
+    db.execute(
+        "CREATE TABLE IF NOT EXISTS catalog_scan ("
+        "id INTEGER PRIMARY KEY CHECK (id = 1), images INTEGER, changed INTEGER, removed INTEGER, "
+        "duration_s REAL, finished_at REAL)"
+    )
+    db.commit()
+    return db
+
+def image_dimensions(path):
+    """Lit les dimensions dans l'en-tête du fichier, sans décoder les pixels."""
+    try:
+        with Image.open(path) as image:
+            return image.size
+    except Exception:
+        return None, None
+
+def file_phash(path):
+    """Hash perceptuel (hexadécimal) d'un fichier image, ou None s'il n'est pas lisible."""
+    try:
+        with open(path, "rb") as f:
+            return hash_to_hex(image_hash(f.read()))
+    except Exception:
+        return None
+
+def walk_images(image_dir):
+    """Parcourt la bibliothèque avec os.scandir : (chemin relatif, stat) de chaque image."""
+    stack = [image_dir]
+    while stack:
+        directory = stack.pop()
+        try:
+            entries = list(os.scandir(directory))
+        except OSError:
+            continue
+        for entry in entries:
+            if entry.is_dir(follow_symlinks=False):
+                stack.append(entry.path)
+            elif entry.name.lower().endswith(IMAGE_EXTENSIONS):
+                yield os.path.relpath(entry.path, image_dir).replace(os.sep, "/"), entry.stat()
+
+def folder_filter(folder):
+    """Condition SQL sur un dossier et ses sous-dossiers (comparaisons de bornes, compatibles avec l'index)."""
+    folder = folder.strip("/")
+    if not folder:
+        return "", ()
+    # "0" suit immédiatement "/" : l'intervalle couvre exactement les chemins "folder/...".
+    return "(c.folder = ? OR (c.folder > ? AND c.folder < ?))", (folder, folder + "/", folder + "0")
+
+class ImageCatalog:
+    """Catalogue persistant de la bibliothèque, tenu à jour par un scan incrémental périodique."""
+
+    def __init__(self, image_dir=IMAGE_DIR, db_path=SCORE_INDEX_DB, scan_interval=CATALOG_SCAN_INTERVAL_S):
+        self.image_dir = image_dir
+        self.db_path = db_path
+        self.scan_interval = scan_interval
+        self._db = None
+        self._lock = threading.Lock()
+        self._scan_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def _connection(self):
+        """Connexion de lecture partagée, ouverte à la première utilisation."""
+        if self._db is None:
+            self._db = open_catalog(self.db_path)
+        return self._db
+
+    @property
+    def count(self):
+        """Nombre d'images du catalogue, lu dans la base (à jour dans tous les workers)."""
+        with self._lock:
+            return self._connection().execute("SELECT COUNT(*) FROM catalog").fetchone()[0]
+
+    @property
+    def last_scan(self):
+        """Résumé du dernier scan terminé, quel que soit le worker qui l'a fait (None avant le premier)."""
+        with self._lock:
+            row = self._connection().execute(
+                f"SELECT {', '.join(SCAN_FIELDS)} FROM catalog_scan WHERE id = 1"
+            ).fetchone()
+        return dict(zip(SCAN_FIELDS, row)) if row else None
+
+    def status(self):
+        """Nombre d'images et résumé du dernier scan, lus dans la base."""
+        return {"total": self.count, "last_scan": self.last_scan}
+
+    @staticmethod
+    def _write(db, changed):
+        db.executemany(
+            "INSERT OR REPLACE INTO catalog (path, folder, size, mtime, width, height, phash, unreadable) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?)", changed
+        )
+        db.commit()
+
+    def scan(self):
+        """
+        Met à jour le catalogue : seules les images nouvelles ou modifiées (taille/mtime) sont relues,
+        et les images supprimées sont retirées. Retourne le résumé du scan.
+        """
+        with self._scan_lock:
+            start = time.perf_counter()
+            db = open_catalog(self.db_path)
+            try:
+                # Une image sans hash perceptuel est relue si le calcul des hashs est activé,
+                # sauf si elle est illisible (elle ne l'est alors qu'après modification).
+                known = {
+                    path: (size, mtime, phash is not None or bool(unreadable) or not CATALOG_PHASH)
+                    for path, size, mtime, phash, unreadable
+                    in db.execute("SELECT path, size, mtime, phash, unreadable FROM catalog")
+                }
+                seen, changed, changed_count = set(), [], 0
+                if os.path.isdir(self.image_dir):
+                    for relative_path, stat in walk_images(self.image_dir):
+                        seen.add(relative_path)
+                        if known.get(relative_path) == (stat.st_size, stat.st_mtime, True):
+                            continue
+                        path = os.path.join(self.image_dir, relative_path)
+                        width, height = image_dimensions(path)
+                        phash = file_phash(path) if CATALOG_PHASH else None
+                        unreadable = int(width is None or (CATALOG_PHASH and phash is None))
+                        folder = os.path.dirname(relative_path)
+                        changed.append((
+                            relative_path, folder, stat.st_size, stat.st_mtime, width, height, phash, unreadable
+                        ))
+                        if len(changed) >= SCAN_COMMIT_EVERY:
+                            self._write(db, changed)
+                            changed_count += len(changed)
+                            changed = []
+                self._write(db, changed)
+                changed_count += len(changed)
+                removed = [(path,) for path in known.keys() - seen]
+
+                summary = {
+                    "images": len(seen),
+                    "changed": changed_count,
+                    "removed": len(removed),
+                    "duration_s": round(time.perf_counter() - start, 3),
+                    "finished_at": time.time(),
+                }
+                db.executemany("DELETE FROM catalog WHERE path = ?", removed)
+                db.execute(
+                    f"INSERT OR REPLACE INTO catalog_scan (id, {', '.join(SCAN_FIELDS)}) "
+                    f"VALUES (1, {', '.join('?' * len(SCAN_FIELDS))})",
+                    [summary[field] for field in SCAN_FIELDS]
+                )
+                db.commit()
+            finally:
+                db.close()
+            return summary
+
+    def _run(self):
+        while True:
+            try:
+                self.scan()
+            except Exception:
+                logger.exception("Échec du scan du catalogue d'images")
+            if self._stop.wait(self.scan_interval):
+                return
+
+    def start(self):
+        """Lance le scan périodique en arrière-plan (un seul scan au démarrage si l'intervalle est nul)."""
+        if self._thread is None:
+            if self.scan_interval > 0:
+                target = self._run
+            else:
+                target = self.scan
+            self._thread = threading.Thread(target=target, name="catalog-scan", daemon=True)
+            self._thread.start()
+        return self
+
+    def scan_in_background(self):
+        """Lance un scan immédiat dans un thread ; retourne False si un scan est déjà en cours."""
+        if self._scan_lock.locked():
+            return False
+        threading.Thread(target=self.scan, name="catalog-scan-now", daemon=True).start()
+        return True
+
+    def stop(self):
+        self._stop.set()
+
+    def hashes(self, folder=""):
+        """Retourne [(chemin, hash perceptuel)] des images du catalogue (d'un dossier et de ses sous-dossiers)."""
+        conditions, params = ["c.phash IS NOT NULL"], []  # les images illisibles n'ont pas de hash
+        condition, folder_params = folder_filter(folder)
+        if condition:
+            conditions.append(condition)
+            params.extend(folder_params)
+        with self._lock:
+            rows = self._connection().execute(
+                f"SELECT c.path, c.phash FROM catalog c WHERE {' AND '.join(conditions)}", params
+            ).fetchall()
+        return [(path, int(phash, 16)) for path, phash in rows]
+
+    def query(self, folder="", metric=None, min_score=None, max_score=None, cursor="", limit=100):
+        """
+        Page du catalogue, triée par chemin, avec les scores connus de chaque image.
+        La pagination se fait par curseur (dernier chemin renvoyé) : le coût d'une page
+        ne dépend pas de la taille de la bibliothèque.
+        """
+        if metric is not None and metric not in SCORE_COLUMNS:
+            raise ValueError(f"Métrique inconnue : {metric} (attendu : {', '.join(SCORE_COLUMNS)})")
+        if metric is None and (min_score is not None or max_score is not None):
+            raise ValueError("Le filtre de score nécessite une métrique")
+        limit = max(1, min(limit, CATALOG_MAX_PAGE_SIZE))
+
+        conditions, params = ["c.path > ?"], [cursor]
+        condition, folder_params = folder_filter(folder)
+        if condition:
+            conditions.append(condition)
+            params.extend(folder_params)
+        if min_score is not None:
+            conditions.append(f"s.{metric} >= ?")
+            params.append(min_score)
+        if max_score is not None:
+            conditions.append(f"s.{metric} <= ?")
+            params.append(max_score)
+
+        sql = (
+            "SELECT c.path, c.folder, c.size, c.mtime, c.width, c.height, "
+            f"{', '.join('s.' + column for column in SCORE_COLUMNS)} "
+            "FROM catalog c LEFT JOIN scores s ON s.path = c.path "
+            f"WHERE {' AND '.join(conditions)} ORDER BY c.path LIMIT ?"
+        )
+        with self._lock:
+            rows = self._connection().execute(sql, (*params, limit + 1)).fetchall()
+
+        items = [
+            {
+                "path": path, "folder": folder_name, "size": size, "mtime": mtime,
+                "width": width, "height": height,
+                "scores": dict(zip(SCORE_COLUMNS, scores)),
+            }
+            for path, folder_name, size, mtime, width, height, *scores in rows[:limit]
+        ]
+        next_cursor = items[-1]["path"] if len(rows) > limit else None
+        return {"items": items, "next_cursor": next_cursor}
+
+CATALOG = ImageCatalog()
+
+register(Gauge("photo_catalog_images", "Nombre d'images dans le catalogue", (), lambda: {(): CATALOG.count}))
@@ -0,0 +1,98 @@
+import asyncio
+import contextvars
+import functools
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import torch
+from app.models_config import OPENCV_WORKERS, TORCH_INTRA_OP_THREADS, EXECUTOR_MAX_QUEUE
+from app.telemetry import Gauge, register
+
+class ExecutorSaturated(Exception):
+    """Levée lorsqu'un pool d'exécution a atteint sa capacité maximale."""
+
+EXECUTORS = []
+
+class BoundedExecutor:
+    """Pool de threads avec une file d'attente bornée, utilisable depuis la boucle asyncio."""
+
+    def __init__(self, name, max_workers, max_queue=EXECUTOR_MAX_QUEUE):
+        self.name = name
+        self.max_workers = max(1, max_workers)
+        self.max_pending = self.max_workers + max(0, max_queue)
+        self._pending = 0
+        self._lock = threading.Lock()
+        self._slot_freed = threading.Condition(self._lock)
+        self._pool = None
+        EXECUTORS.append(self)
+
+    @property
+    def pending(self):
+        """Nombre de tâches en cours ou en attente."""
+        return self._pending
+
+    def resize(self, max_workers):
+        """Change la taille du pool ; possible uniquement avant sa création (ex. dans un worker après fork)."""
+        if self._pool is not None:
+            raise RuntimeError(f"Pool {self.name} déjà démarré")
+        queue = self.max_pending - self.max_workers
+        self.max_workers = max(1, max_workers)
+        self.max_pending = self.max_workers + queue
+
+    def _get_pool(self):
+        if self._pool is None:
+            self._pool = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix=self.name)
+        return self._pool
+
+    def _release(self, _future):
+        with self._slot_freed:
+            self._pending -= 1
+            self._slot_freed.notify()
+
+    def _submit(self, func, args, kwargs):
+        try:
+            # Le contexte est propagé au thread : les étapes chronométrées restent rattachées à la requête.
+            context = contextvars.copy_context()
+            future = self._get_pool().submit(context.run, functools.partial(func, *args, **kwargs))
+        except Exception:
+            self._release(None)
+            raise
+        future.add_done_callback(self._release)
+        return future
+
+    async def run(self, func, *args, **kwargs):
+        """Exécute une fonction bloquante dans le pool, ou lève ExecutorSaturated si la file est pleine."""
+        with self._lock:
+            if self._pending >= self.max_pending:
+                raise ExecutorSaturated(f"Serveur saturé ({self.name}), réessayez plus tard")
+            self._pending += 1
+        return await asyncio.wrap_future(self._submit(func, args, kwargs))
+
+    def call(self, func, *args, **kwargs):
+        """
+        Exécute une fonction dans le pool depuis un thread hors de la boucle asyncio (job d'arrière-plan)
+        et attend son résultat ; si la file est pleine, attend qu'une place se libère au lieu de lever une erreur.
+        """
+        with self._slot_freed:
+            while self._pending >= self.max_pending:
+                self._slot_freed.wait()
+            self._pending += 1
+        return self._submit(func, args, kwargs).result()
+
+OPENCV_EXECUTOR = BoundedExecutor("opencv", OPENCV_WORKERS)
+
+register(Gauge(
+    "photo_executor_pending", "Tâches en cours ou en attente par pool d'exécution", ("pool",),
+    lambda: {(executor.name,): executor.pending for executor in EXECUTORS}
+))
+
+_torch_threads = TORCH_INTRA_OP_THREADS
+
+def set_thread_budget(torch_threads, opencv_threads):
+    """Budget de threads d'un processus worker : threads intra-op PyTorch et taille du pool OpenCV."""
+    global _torch_threads
+    _torch_threads = torch_threads
+    OPENCV_EXECUTOR.resize(opencv_threads)
+
+def configure_torch_threads():
+    """Fixe explicitement le nombre de threads intra-op utilisés par PyTorch."""
+    torch.set_num_threads(max(1, _torch_threads))
@@ -1,32 +1,44 @@
 import cv2
 import numpy as np
 
-def detect_blur(image_path):
+def load_grayscale(image):
+    """Retourne l'image en niveaux de gris, depuis un chemin ou un tableau NumPy (RGB ou gris)."""
+    if isinstance(image, np.ndarray):
+        return image if image.ndim == 2 else cv2.cvtColor(image, cv2.COLOR_RGB2GRAY)
+    return cv2.imread(image, cv2.IMREAD_GRAYSCALE)
+
+def blur_from_laplacian_var(laplacian_var):
+    """Convertit une variance du Laplacien en (clarté, score de flou)."""
+    blur_score = min(float(laplacian_var / 500), 1.0) 
+    clarity = "Net" if blur_score >= 0.5 else "Flou"
+
+    return clarity, (1 - blur_score) 
+
+def noise_from_pixel_var(noise):
+    """Convertit une variance des pixels en (niveau de bruit, score)."""
+    score = float(min(1.0, 100 / (noise + 1)))
+    return ("Beaucoup de bruit", score) if noise > 100 else ("Faible bruit", score)
+
+def detect_blur(image):
     """Détecte si une image est floue avec la variance du Laplacien."""
-    image = cv2.imread(image_path, cv2.IMREAD_GRAYSCALE)
+    image = load_grayscale(image)
     if image is None:
         return "Erreur: Image non chargée", 0.0
 
     laplacian_var = cv2.Laplacian(image, cv2.CV_64F).var()
+    return blur_from_laplacian_var(laplacian_var)
 
-    blur_score = min(float(laplacian_var / 500), 1.0) 
-    clarity = "Net" if blur_score >= 0.5 else "Flou"
-
-    return clarity, (1 - blur_score) 
-
-def detect_noise(image_path):
+def detect_noise(image):
     """Détecte le bruit numérique dans l'image en mesurant la variance des pixels."""
-    image = cv2.imread(image_path, cv2.IMREAD_GRAYSCALE)
+    image = load_grayscale(image)
     if image is None:
         return "Erreur: Image non chargée", 0.0
-    noise = np.var(image)
-    score = float(min(1.0, 100 / (noise + 1)))
-    return ("Beaucoup de bruit", score) if noise > 100 else ("Faible bruit", score)
+    return noise_from_pixel_var(np.var(image))
 
-def validate_image(image_path):
+def validate_image(image):
     """Vérifie si une image est bien chargée et exploitable."""
-    img = cv2.imread(image_path)
-    if img is None:
+    img = image if isinstance(image, np.ndarray) else cv2.imread(image)
+    if img is None or img.size == 0:
         return False, "Image corrompue ou format non supporté"
     return True, "Image valide"
 
@@ -34,11 +46,12 @@ def compute_quality_score(scores):
     """Calcule un score de qualité global en pourcentage."""
     return round(float(np.mean(scores) * 100), 2) if scores else 0.0
 
-def analyze_image_quality(image_path):
+def analyze_image_quality(image):
     """Effectue l'analyse complète de l'image et retourne un score global."""
+    gray = load_grayscale(image)
     metrics = {
-        "blur": detect_blur(image_path),
-        "noise": detect_noise(image_path),
+        "blur": detect_blur(gray),
+        "noise": detect_noise(gray),
     }
     
     scores = [float(metric[1]) for metric in metrics.values() if isinstance(metric, tuple) and isinstance(metric[1], (int, float))]
@@ -0,0 +1,161 @@
+import io
+import weakref
+import cv2
+import numpy as np
+from PIL import Image
+from app.models_config import (
+    TARGET_SIZE_OPENCV, TARGET_SIZE_NIMA, TARGET_SIZE_LIQE, MODEL_MIN_SIDE, MAX_IMAGE_PIXELS
+)
+from app.telemetry import stage, track_memory
+
+# La limite de PIL (avertissement puis erreur, sur la taille d'origine) est remplacée par check_pixels,
+# qui porte sur les pixels réellement décodés (après réduction DCT des JPEG).
+Image.MAX_IMAGE_PIXELS = None
+
+TARGET_RESOLUTIONS = {
+    "opencv": TARGET_SIZE_OPENCV,
+    "nima": TARGET_SIZE_NIMA,
+    "liqe": TARGET_SIZE_LIQE,
+}
+# Métriques dimensionnées par leur petit côté (modèles PyIQA), les autres par leur plus grand côté.
+SHORT_SIDE_METRICS = ("nima", "liqe")
+
+def preprocessing_version(metric):
+    """Identifiant du prétraitement d'une métrique, utilisé pour versionner les scores en cache."""
+    if metric in SHORT_SIDE_METRICS:
+        return f"short{TARGET_RESOLUTIONS[metric]}min{MODEL_MIN_SIDE}"
+    return f"max{TARGET_RESOLUTIONS[metric]}"
+
+def fitted_size(size, max_side):
+    """Taille (largeur, hauteur) tenant dans max_side en gardant les proportions, sans agrandissement."""
+    width, height = size
+    if not max_side or max(width, height) <= max_side:
+        return size
+    scale = max_side / max(width, height)
+    return max(1, round(width * scale)), max(1, round(height * scale))
+
+def short_side_size(size, short_side, min_side=MODEL_MIN_SIDE):
+    """
+    Taille (largeur, hauteur) dont le petit côté vaut short_side (sans agrandissement, 0 = taille d'origine),
+    mais jamais moins de min_side : les petites images sont alors agrandies, en gardant les proportions.
+    """
+    width, height = size
+    short = min(width, height)
+    target = max(min_side, min(short, short_side) if short_side else short)
+    if target == short:
+        return size
+    scale = target / short
+    if width <= height:
+        return target, max(1, round(height * scale))
+    return max(1, round(width * scale)), target
+
+def view_size(size, metric):
+    """Taille de la vue d'une métrique pour une image de taille `size`."""
+    if metric in SHORT_SIDE_METRICS:
+        return short_side_size(size, TARGET_RESOLUTIONS[metric])
+    return fitted_size(size, TARGET_RESOLUTIONS[metric])
+
+class ImageTooLarge(ValueError):
+    """Image dont le décodage dépasserait MAX_IMAGE_PIXELS (bombe de décompression)."""
+
+def check_pixels(image, max_pixels=MAX_IMAGE_PIXELS):
+    """Refuse une image ouverte (en-tête lu, pixels pas encore décodés) trop grande pour être décodée."""
+    width, height = image.size
+    if max_pixels and width * height > max_pixels:
+        raise ImageTooLarge(
+            f"Image trop grande : {width}x{height} pixels (maximum {max_pixels / 1e6:.0f} mégapixels)"
+        )
+
+class DecodedImage:
+    """Image décodée une seule fois en mémoire, partagée entre toutes les métriques."""
+
+    def __init__(self, image, grayscale=False):
+        self.image = image
+        self.array = np.asarray(image)
+        self.gray = None
+        # Bitmap PIL et copie numpy, comptés dans la mémoire de la requête tant que l'image est en vie.
+        self._track(self.array.nbytes * 2)
+        if grayscale:
+            self.ensure_grayscale()
+
+    def _track(self, nbytes):
+        account = track_memory(nbytes)
+        if account is not None:
+            weakref.finalize(self, account.release, nbytes)
+
+    @property
+    def size(self):
+        return self.image.size
+
+    def ensure_grayscale(self):
+        """Calcule (une seule fois) la version en niveaux de gris pour OpenCV."""
+        if self.gray is None:
+            with stage("grayscale"):
+                self.gray = cv2.cvtColor(self.array, cv2.COLOR_RGB2GRAY)
+            self._track(self.gray.nbytes)
+        return self
+
+    def resize_to(self, size, grayscale=False):
+        """Retourne l'image à la taille (largeur, hauteur) donnée, sans nouveau décodage."""
+        if tuple(size) == self.size:
+            return self.ensure_grayscale() if grayscale else self
+        with stage("resize"):
+            image = self.image.resize(size, Image.Resampling.BILINEAR, reducing_gap=2.0)
+        return DecodedImage(image, grayscale=grayscale)
+
+    def fit(self, max_side, grayscale=False):
+        """Retourne l'image réduite à max_side (proportions conservées), sans nouveau décodage."""
+        return self.resize_to(fitted_size(self.size, max_side), grayscale=grayscale)
+
+def decode_to(data, target, grayscale=False):
+    """
+    Décode les octets reçus en image RGB, sans passer par le disque ni copier les octets
+    (BytesIO partage le buffer de `data`). Lève ImageTooLarge avant décodage si l'image dépasse MAX_IMAGE_PIXELS.
+    - `target` : fonction (taille d'origine) -> taille voulue ; les JPEG sont décodés directement
+      à une échelle réduite (1/2, 1/4, 1/8) puis ajustés à cette taille.
+    - `grayscale` : calcule aussi la version en niveaux de gris pour OpenCV.
+    """
+    with stage("decode"):
+        image = Image.open(io.BytesIO(data))
+        size = tuple(target(image.size))
+        if size[0] < image.size[0]:
+            # draft() choisit la plus forte réduction DCT qui reste au moins aussi grande que la cible.
+            image.draft("RGB", size)
+        check_pixels(image)
+        image = image.convert("RGB")
+    return DecodedImage(image).resize_to(size, grayscale=grayscale)
+
+def decode_image(data, max_side=None, grayscale=False):
+    """Décode l'image, réduite à `max_side` pixels sur son plus grand côté (voir decode_to)."""
+    return decode_to(data, lambda size: fitted_size(size, max_side), grayscale)
+
+def decode_for_metric(data, metric, grayscale=False):
+    """Décode l'image à la taille de la vue d'une métrique (voir view_size)."""
+    return decode_to(data, lambda size: view_size(size, metric), grayscale)
+
+def prepare_views(data, metrics):
+    """
+    Décode l'image une seule fois, à la plus grande résolution requise par les métriques demandées,
+    puis retourne une vue à la bonne résolution pour chaque métrique (partagée si identique).
+    """
+    sizes = {}
+
+    def base_size(size):
+        sizes.update((metric, view_size(size, metric)) for metric in metrics)
+        # Toutes les vues gardent les proportions de l'image : la plus large est aussi la plus haute.
+        # La base n'est jamais agrandie : seules les vues des modèles le sont, à partir des pixels d'origine,
+        # et la vue OpenCV d'une petite image reste identique à celle de decode_image.
+        largest = max(sizes.values(), default=size)
+        return size if largest[0] > size[0] else largest
+
+    base = decode_to(data, base_size)
+
+    views_by_size = {}
+    views = {}
+    for metric, size in sizes.items():
+        if size not in views_by_size:
+            views_by_size[size] = base.resize_to(size)
+        views[metric] = views_by_size[size]
+    if "opencv" in views:
+        views["opencv"].ensure_grayscale()
+    return views
@@ -0,0 +1,218 @@
+import hashlib
+import io
+import os
+import threading
+from collections import OrderedDict
+from email.utils import formatdate, parsedate_to_datetime
+from PIL import Image
+from app.models_config import THUMBNAIL_SIZES, THUMBNAIL_DIR, THUMBNAIL_CACHE_MAX_MB, THUMBNAIL_QUALITY
+from app.image_pipeline import check_pixels
+from app.telemetry import CACHE_HITS, CACHE_MISSES, Gauge, register, stage
+
+CHUNK_SIZE = 64 * 1024
+# Au-delà de la limite, le cache des miniatures est ramené à cette fraction de max_bytes :
+# l'éviction ne se déclenche pas à chaque nouvelle miniature.
+THUMBNAIL_LOW_WATER = 0.9
+
+class RangeNotSatisfiable(ValueError):
+    """En-tête Range hors des limites du fichier."""
+
+def file_etag(stat, variant=""):
+    """ETag dérivé de la taille et de la date de modification du fichier (et de la variante servie)."""
+    signature = f"{stat.st_size}-{stat.st_mtime_ns}-{variant}"
+    return f'"{hashlib.md5(signature.encode()).hexdigest()}"'
+
+def last_modified(stat):
+    return formatdate(stat.st_mtime, usegmt=True)
+
+def validator_headers(stat, etag):
+    return {"ETag": etag, "Last-Modified": last_modified(stat)}
+
+def is_not_modified(headers, stat, etag):
+    """Vrai si le client possède déjà cette version (If-None-Match prioritaire sur If-Modified-Since)."""
+    if_none_match = headers.get("if-none-match")
+    if if_none_match is not None:
+        tags = [tag.strip().removeprefix("W/") for tag in if_none_match.split(",")]
+        return "*" in tags or etag in tags
+    if_modified_since = headers.get("if-modified-since")
+    if if_modified_since:
+        try:
+            return int(stat.st_mtime) <= parsedate_to_datetime(if_modified_since).timestamp()
+        except (TypeError, ValueError):
+            return False
+    return False
+
+def parse_range(headers, size, etag):
+    """
+    Retourne (début, fin) inclusifs pour un en-tête `Range: bytes=...` à intervalle unique, ou None
+    pour servir le fichier entier (pas de Range, plusieurs intervalles, intervalle mal formé
+    comme `bytes=5-3`, ou If-Range périmé). Lève RangeNotSatisfiable si l'intervalle commence après la fin.
+    """
+    header = headers.get("range")
+    if not header or not header.startswith("bytes=") or "," in header:
+        return None
+    if_range = headers.get("if-range")
+    if if_range and if_range != etag:
+        return None
+
+    start, _, end = header[len("bytes="):].strip().partition("-")
+    try:
+        if start:
+            start = int(start)
+            if end and int(end) < start:
+                # Intervalle syntaxiquement invalide : l'en-tête est ignoré (RFC 9110, 14.1.1).
+                return None
+            end = min(int(end), size - 1) if end else size - 1
+        else:
+            # "bytes=-N" : les N derniers octets.
+            start, end = max(0, size - int(end)), size - 1
+    except ValueError:
+        return None
+    if start >= size or start > end:
+        raise RangeNotSatisfiable(f"Intervalle invalide pour un fichier de {size} octets : {header}")
+    return start, end
+
+def iter_file(path, start, end):
+    """Lit les octets [start, end] d'un fichier, par blocs."""
+    with open(path, "rb") as f:
+        f.seek(start)
+        remaining = end - start + 1
+        while remaining > 0:
+            chunk = f.read(min(CHUNK_SIZE, remaining))
+            if not chunk:
+                break
+            remaining -= len(chunk)
+            yield chunk
+
+class ThumbnailCache:
+    """
+    Miniatures JPEG générées à la demande et stockées sur disque, les moins récemment servies évincées
+    au-delà de max_bytes. Les tailles sont suivies en mémoire (ordre LRU) : le disque n'est parcouru qu'une fois.
+    """
+
+    def __init__(self, directory=THUMBNAIL_DIR, max_bytes=THUMBNAIL_CACHE_MAX_MB * 1024 ** 2,
+                 quality=THUMBNAIL_QUALITY, low_water=THUMBNAIL_LOW_WATER):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.quality = quality
+        self.low_water = low_water
+        self._lock = threading.Lock()
+        self._entries_by_path = None
+        self._total_bytes = 0
+
+    def path_for(self, source_path, stat, size):
+        """Chemin de la miniature : la clé change avec le fichier source, ce qui invalide les anciennes versions."""
+        key = hashlib.sha256(f"{source_path}:{stat.st_size}:{stat.st_mtime_ns}:{size}".encode()).hexdigest()
+        return os.path.join(self.directory, key[:2], f"{key}.jpg")
+
+    def _entries(self):
+        for root, _, files in os.walk(self.directory):
+            for file in files:
+                path = os.path.join(root, file)
+                try:
+                    yield path, os.stat(path)
+                except OSError:
+                    continue
+
+    def _index(self):
+        """Index chemin → taille, du moins au plus récemment servi, construit au premier appel (sous le verrou)."""
+        if self._entries_by_path is None:
+            entries = sorted(self._entries(), key=lambda entry: entry[1].st_mtime)
+            self._entries_by_path = OrderedDict((path, stat.st_size) for path, stat in entries)
+            self._total_bytes = sum(self._entries_by_path.values())
+        return self._entries_by_path
+
+    def total_bytes(self):
+        with self._lock:
+            self._index()
+            return self._total_bytes
+
+    def _record(self, path, size):
+        """Enregistre une miniature servie ou créée comme la plus récente (sous le verrou)."""
+        index = self._index()
+        self._total_bytes += size - index.pop(path, 0)
+        index[path] = size
+
+    def _evict(self):
+        """Supprime les miniatures les moins récemment servies jusqu'à repasser sous low_water × max_bytes."""
+        index = self._index()
+        target = self.max_bytes * self.low_water
+        # La miniature qui vient d'être servie (la plus récente) n'est jamais évincée.
+        while self._total_bytes > target and len(index) > 1:
+            path, size = index.popitem(last=False)
+            self._total_bytes -= size
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+
+    def _generate(self, source_path, target, size):
+        """Génère la miniature, l'écrit sur disque et retourne ses octets."""
+        with stage("thumbnail"):
+            with Image.open(source_path) as image:
+                # Décodage JPEG directement à l'échelle réduite la plus proche de la miniature.
+                image.draft("RGB", (size, size))
+                check_pixels(image)
+                image = image.convert("RGB")
+                image.thumbnail((size, size), Image.Resampling.LANCZOS)
+                buffer = io.BytesIO()
+                image.save(buffer, "JPEG", quality=self.quality, optimize=True)
+        data = buffer.getvalue()
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        temporary = f"{target}.{threading.get_ident()}.tmp"
+        with open(temporary, "wb") as f:
+            f.write(data)
+        os.replace(temporary, target)
+        return data
+
+    def _read(self, target):
+        """Octets d'une miniature en cache, ou None si elle est absente (ou évincée entre-temps)."""
+        try:
+            with open(target, "rb") as f:
+                data = f.read()
+        except FileNotFoundError:
+            return None
+        # La date de modification sert d'horodatage d'accès pour reconstruire l'ordre LRU au redémarrage.
+        try:
+            os.utime(target)
+        except OSError:
+            pass
+        return data
+
+    def get(self, source_path, stat, size):
+        """
+        Retourne les octets JPEG de la miniature de `size` pixels (plus grand côté), générée si besoin.
+        Les octets sont lus avant de rendre la main : une éviction concurrente ne peut pas
+        supprimer le fichier pendant qu'il est envoyé au client.
+        """
+        target = self.path_for(source_path, stat, size)
+        data = self._read(target)
+        if data is not None:
+            CACHE_HITS.inc("thumbnail")
+            with self._lock:
+                self._record(target, len(data))
+            return data
+
+        CACHE_MISSES.inc("thumbnail")
+        # L'index est construit avant d'écrire la miniature, pour ne pas la compter deux fois.
+        self.total_bytes()
+        data = self._generate(source_path, target, size)
+        with self._lock:
+            self._record(target, len(data))
+            if self._total_bytes > self.max_bytes:
+                self._evict()
+        return data
+
+def thumbnail_size(size):
+    """Valide une taille de miniature demandée."""
+    if size not in THUMBNAIL_SIZES:
+        available = ", ".join(map(str, THUMBNAIL_SIZES))
+        raise ValueError(f"Taille de miniature non disponible : {size} (tailles : {available})")
+    return size
+
+THUMBNAILS = ThumbnailCache()
+
+register(Gauge(
+    "photo_thumbnail_cache_bytes", "Taille du cache disque des miniatures", (),
+    lambda: {(): THUMBNAILS.total_bytes()}
+))
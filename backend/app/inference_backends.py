@@ -0,0 +1,334 @@
+import argparse
+import copy
+import io
+import json
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager, nullcontext
+import numpy as np
+import torch
+import torchvision.transforms as T
+from app.models_config import ONNX_DIR, COMPILED_SHAPES_MAX, COMPILED_SHAPE_MIN_USES
+
+logger = logging.getLogger(__name__)
+
+INFERENCE_BACKENDS = ("eager", "torchscript", "onnx", "quantized")
+
+def module_memory_bytes(module):
+    """Estime la mémoire occupée par les poids et buffers d'un module PyTorch."""
+    tensors = list(module.parameters()) + list(module.buffers())
+    return sum(t.numel() * t.element_size() for t in tensors)
+
+def fixed_input_size(net):
+    """
+    Taille d'entrée d'un réseau qui redimensionne et recadre lui-même ses images (NIMA : 224),
+    ou None si le réseau traite l'image à sa taille (LIQE échantillonne des patchs selon la taille).
+    """
+    config = getattr(getattr(net, "base_model", None), "default_cfg", None) or {}
+    if not all(hasattr(net, name) for name in ("preprocess", "default_mean", "default_std")):
+        return None
+    return int(config["input_size"][-1]) if "input_size" in config else None
+
+def resize_and_crop(batch, size):
+    """Même redimensionnement (petit côté) et recadrage central que le prétraitement du réseau."""
+    return T.functional.center_crop(T.functional.resize(batch, size), size)
+
+@contextmanager
+def normalize_only(net):
+    """
+    Pendant une trace ou un export, le prétraitement d'un réseau à entrée fixe se limite à la normalisation :
+    les images sont déjà redimensionnées et recadrées (resize_and_crop), et ces opérations ne se tracent pas.
+    """
+    net.preprocess = lambda x: (x - net.default_mean.to(x)) / net.default_std.to(x)
+    try:
+        yield net
+    finally:
+        del net.preprocess
+
+def export_context(net):
+    return normalize_only(net) if fixed_input_size(net) else nullcontext(net)
+
+class CompiledShapes:
+    """
+    Versions compilées d'un réseau (trace TorchScript, session ONNX) par taille d'entrée H×W, le batch
+    restant dynamique. Une taille n'est compilée qu'à sa `min_uses`-ième utilisation : les tailles rares
+    restent en mode eager au lieu de payer une compilation sur le chemin de la requête.
+    """
+
+    def __init__(self, compile, max_entries=COMPILED_SHAPES_MAX, min_uses=COMPILED_SHAPE_MIN_USES):
+        self.compile = compile
+        self.max_entries = max(1, max_entries)
+        self.min_uses = max(1, min_uses)
+        self._compiled = OrderedDict()
+        self._uses = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, batch):
+        """Retourne la version compilée pour la taille du batch, ou None (mode eager)."""
+        key = tuple(batch.shape[-2:])
+        with self._lock:
+            compiled = self._compiled.get(key)
+            if compiled is not None:
+                self._compiled.move_to_end(key)
+                return compiled
+            uses = self._uses.pop(key, 0) + 1
+            if uses < self.min_uses:
+                self._uses[key] = uses
+                while len(self._uses) > 64 * self.max_entries:
+                    self._uses.popitem(last=False)
+                return None
+            compiled = self.compile(batch[:1])
+            self._compiled[key] = compiled
+            while len(self._compiled) > self.max_entries:
+                self._compiled.popitem(last=False)
+        return compiled
+
+    def __len__(self):
+        return len(self._compiled)
+
+class EagerBackend:
+    """Exécution PyTorch standard du modèle PyIQA (référence pour les scores)."""
+    name = "eager"
+
+    def __init__(self, metric):
+        self.metric = metric
+
+    def __call__(self, batch):
+        with torch.inference_mode():
+            return self.metric(batch)
+
+    def memory_bytes(self):
+        return module_memory_bytes(self.metric)
+
+class TorchScriptBackend:
+    """
+    Réseau tracé en TorchScript, figé et optimisé pour l'inférence.
+    Un réseau à entrée fixe (NIMA) reçoit des images déjà redimensionnées et recadrées comme il le ferait :
+    une seule trace sert toutes les images. Les autres ont une trace par taille fréquente (CompiledShapes).
+    """
+    name = "torchscript"
+
+    def __init__(self, metric):
+        self.net = metric.net.eval()
+        self.input_size = fixed_input_size(self.net)
+        self.traces = CompiledShapes(self._trace, min_uses=1 if self.input_size else COMPILED_SHAPE_MIN_USES)
+
+    def _trace(self, example):
+        with torch.no_grad(), export_context(self.net):
+            traced = torch.jit.trace(self.net, example, check_trace=False)
+            return torch.jit.optimize_for_inference(torch.jit.freeze(traced))
+
+    def __call__(self, batch):
+        if self.input_size:
+            batch = resize_and_crop(batch, self.input_size)
+        traced = self.traces.get(batch)
+        if traced is None:
+            with torch.inference_mode():
+                return self.net(batch)
+        with torch.no_grad():
+            return traced(batch)
+
+    def memory_bytes(self):
+        return module_memory_bytes(self.net)
+
+class QuantizedBackend:
+    """Quantification dynamique int8 des couches linéaires (gain surtout sur les transformers, ex. CLIP de LIQE)."""
+    name = "quantized"
+
+    def __init__(self, metric):
+        self.net = torch.ao.quantization.quantize_dynamic(
+            copy.deepcopy(metric.net).cpu().eval(), {torch.nn.Linear}, dtype=torch.qint8
+        )
+
+    def __call__(self, batch):
+        with torch.inference_mode():
+            return self.net(batch)
+
+    def memory_bytes(self):
+        # Les poids int8 sont emballés hors de parameters() : on mesure l'état sérialisé du module quantifié.
+        buffer = io.BytesIO()
+        torch.save(self.net.state_dict(), buffer)
+        return buffer.tell()
+
+def onnx_path(metric_id, height, width, onnx_dir=ONNX_DIR):
+    return os.path.join(onnx_dir, f"{metric_id}-{height}x{width}.onnx")
+
+def export_onnx(net, metric_id, height, width, onnx_dir=ONNX_DIR):
+    """Exporte un réseau PyIQA en ONNX pour une taille d'entrée H×W (batch dynamique)."""
+    os.makedirs(onnx_dir, exist_ok=True)
+    path = onnx_path(metric_id, height, width, onnx_dir)
+    with torch.no_grad(), export_context(net.cpu().eval()):
+        torch.onnx.export(
+            net,
+            torch.rand(1, 3, height, width),
+            path,
+            input_names=["input"],
+            output_names=["score"],
+            dynamic_axes={"input": {0: "batch"}, "score": {0: "batch"}},
+            opset_version=17,
+            dynamo=False
+        )
+    return path
+
+class OnnxBackend:
+    """
+    Inférence avec ONNX Runtime, sans déformer les images : un réseau à entrée fixe (NIMA) est exporté une fois
+    et reçoit les images redimensionnées et recadrées comme il le ferait ; les autres (LIQE, dont l'échantillonnage
+    des patchs dépend de la taille) sont exportés par taille fréquente, en mode eager en attendant.
+    """
+    name = "onnx"
+
+    def __init__(self, metric, metric_id):
+        # Échoue dès la construction si ONNX Runtime est absent : build_backend revient au mode eager.
+        import onnxruntime  # noqa: F401
+
+        self.net = metric.net.cpu().eval()
+        self.metric_id = metric_id
+        self.input_size = fixed_input_size(self.net)
+        self._sessions = None
+        self._pid = None
+        self._lock = threading.Lock()
+        if self.input_size:
+            self._export(self.input_size, self.input_size)
+
+    def _export(self, height, width):
+        path = onnx_path(self.metric_id, height, width)
+        return path if os.path.exists(path) else export_onnx(self.net, self.metric_id, height, width)
+
+    def _session(self, example):
+        import onnxruntime as ort
+
+        options = ort.SessionOptions()
+        options.intra_op_num_threads = max(1, torch.get_num_threads())
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        path = self._export(*example.shape[-2:])
+        return ort.InferenceSession(path, options, providers=["CPUExecutionProvider"])
+
+    @property
+    def sessions(self):
+        """
+        Sessions ONNX Runtime du processus courant, créées à la première inférence : leur pool de threads
+        ne survit pas à un fork, chaque worker crée donc les siennes (les exports sur disque sont partagés).
+        """
+        with self._lock:
+            if self._sessions is None or self._pid != os.getpid():
+                min_uses = 1 if self.input_size else COMPILED_SHAPE_MIN_USES
+                self._sessions = CompiledShapes(self._session, min_uses=min_uses)
+                self._pid = os.getpid()
+            return self._sessions
+
+    def __call__(self, batch):
+        if self.input_size:
+            batch = resize_and_crop(batch, self.input_size)
+        session = self.sessions.get(batch)
+        if session is None:
+            with torch.inference_mode():
+                return self.net(batch)
+        scores = session.run(None, {"input": batch.detach().cpu().numpy().astype(np.float32)})[0]
+        return torch.from_numpy(scores)
+
+    def memory_bytes(self):
+        return module_memory_bytes(self.net)
+
+def build_backend(kind, metric, metric_id, device):
+    """Construit le backend d'inférence demandé, ou le mode eager si indisponible."""
+    if kind not in INFERENCE_BACKENDS:
+        logger.warning("Backend d'inférence inconnu %s pour %s, utilisation du mode eager", kind, metric_id)
+        kind = "eager"
+    if kind != "eager" and device.type != "cpu":
+        logger.warning("Backend %s réservé au CPU, utilisation du mode eager pour %s", kind, metric_id)
+        kind = "eager"
+
+    try:
+        if kind == "torchscript":
+            return TorchScriptBackend(metric)
+        if kind == "quantized":
+            return QuantizedBackend(metric)
+        if kind == "onnx":
+            return OnnxBackend(metric, metric_id)
+    except Exception as e:
+        logger.warning("Backend %s indisponible pour %s (%s), utilisation du mode eager", kind, metric_id, e)
+    return EagerBackend(metric)
+
+def _spearman(a, b):
+    ranks_a = np.argsort(np.argsort(a))
+    ranks_b = np.argsort(np.argsort(b))
+    return float(np.corrcoef(ranks_a, ranks_b)[0, 1])
+
+def drift_report(model_name, kind, image_paths):
+    """Compare les scores et la latence d'un backend optimisé avec ceux du mode eager."""
+    import pyiqa
+    from app.batching import image_to_tensor
+    from app.image_pipeline import decode_for_metric
+    from app.model_registry import PYIQA_MODELS
+
+    metric_id = PYIQA_MODELS[model_name]
+    metric_key = "nima" if metric_id.startswith("nima") else "liqe"
+    metric = pyiqa.create_metric(metric_id, device=torch.device("cpu"))
+    backends = {"eager": EagerBackend(metric), kind: build_backend(kind, metric, metric_id, torch.device("cpu"))}
+
+    scores = {name: [] for name in backends}
+    latencies = {name: [] for name in backends}
+    for path in image_paths:
+        with open(path, "rb") as f:
+            batch = image_to_tensor(decode_for_metric(f.read(), metric_key).array).unsqueeze(0)
+        for name, backend in backends.items():
+            start = time.perf_counter()
+            scores[name].append(float(backend(batch).flatten()[0]))
+            latencies[name].append((time.perf_counter() - start) * 1000)
+
+    eager, optimized = np.array(scores["eager"]), np.array(scores[kind])
+    delta = np.abs(optimized - eager)
+    return {
+        "model": model_name,
+        "backend": backends[kind].name,
+        "images": len(image_paths),
+        "mean_abs_delta": float(delta.mean()) if len(delta) else 0.0,
+        "max_abs_delta": float(delta.max()) if len(delta) else 0.0,
+        "spearman": _spearman(eager, optimized) if len(delta) > 1 else None,
+        "latency_ms": {name: round(float(np.median(values)), 2) for name, values in latencies.items() if values},
+    }
+
+def main():
+    from app.model_registry import PYIQA_MODELS
+    from app.scoring_job import list_library
+    from app.models_config import IMAGE_DIR
+
+    parser = argparse.ArgumentParser(description="Export et comparaison des backends d'inférence PyIQA.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    export = subparsers.add_parser("export", help="Exporte un modèle en ONNX")
+    export.add_argument("--model", choices=list(PYIQA_MODELS), required=True)
+    export.add_argument("--height", type=int, help="Hauteur d'entrée (modèles sans taille d'entrée fixe)")
+    export.add_argument("--width", type=int, help="Largeur d'entrée (modèles sans taille d'entrée fixe)")
+
+    drift = subparsers.add_parser("drift", help="Écart de score et latence d'un backend par rapport au mode eager")
+    drift.add_argument("--model", choices=list(PYIQA_MODELS), required=True)
+    drift.add_argument("--backend", choices=INFERENCE_BACKENDS[1:], required=True)
+    drift.add_argument("--image-dir", default=IMAGE_DIR)
+    drift.add_argument("--limit", type=int, default=50)
+    drift.add_argument("--output", help="Fichier JSON où écrire le rapport")
+
+    args = parser.parse_args()
+    if args.command == "export":
+        import pyiqa
+        metric_id = PYIQA_MODELS[args.model]
+        metric = pyiqa.create_metric(metric_id, device=torch.device("cpu"))
+        size = fixed_input_size(metric.net)
+        if size is None and not (args.height and args.width):
+            parser.error(f"{args.model} n'a pas de taille d'entrée fixe : préciser --height et --width")
+        print(export_onnx(metric.net, metric_id, args.height or size, args.width or size))
+        return
+
+    paths = [os.path.join(args.image_dir, path) for path in list_library(args.image_dir)[:args.limit]]
+    report = drift_report(args.model, args.backend, paths)
+    print(json.dumps(report, indent=2, ensure_ascii=False))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2, ensure_ascii=False)
+
+if __name__ == "__main__":
+    main()
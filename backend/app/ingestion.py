@@ -0,0 +1,89 @@
+import json
+import os
+from app.models_config import UPLOAD_MAX_MB, REQUEST_MAX_MB
+from app.telemetry import track_memory
+
+UPLOAD_MAX_BYTES = int(UPLOAD_MAX_MB * 1024 ** 2)
+REQUEST_MAX_BYTES = int(REQUEST_MAX_MB * 1024 ** 2)
+
+class UploadTooLarge(ValueError):
+    """Fichier téléversé plus grand que UPLOAD_MAX_MB."""
+
+def check_upload_size(name, size, max_bytes=UPLOAD_MAX_BYTES):
+    if max_bytes and size > max_bytes:
+        raise UploadTooLarge(
+            f"Fichier trop volumineux : {name or 'image'} ({size / 1024 ** 2:.1f} Mo, maximum {max_bytes / 1024 ** 2:.0f} Mo)"
+        )
+
+async def read_upload(file, max_bytes=UPLOAD_MAX_BYTES):
+    """
+    Lit un fichier téléversé après avoir vérifié sa taille sur le fichier temporaire où Starlette
+    l'a reçu par blocs : un fichier trop gros est refusé sans être chargé en mémoire.
+    Les octets sont lus en une seule fois (une seule copie) ; le décodage les partage ensuite sans copie.
+    """
+    spooled = file.file
+    spooled.seek(0, os.SEEK_END)
+    size = spooled.tell()
+    spooled.seek(0)
+    check_upload_size(file.filename, size, max_bytes)
+    data = await file.read()
+    track_memory(len(data))
+    return data
+
+class RequestSizeLimit:
+    """
+    Middleware ASGI : compte les octets du corps au fil de leur réception et répond 413 dès que
+    max_bytes est dépassé (ou d'emblée si Content-Length l'annonce), sans attendre la fin de l'upload.
+    """
+
+    def __init__(self, app, max_bytes=REQUEST_MAX_BYTES):
+        self.app = app
+        self.max_bytes = max_bytes
+
+    async def reject(self, send):
+        body = json.dumps({"error": f"Requête trop volumineuse (maximum {self.max_bytes / 1024 ** 2:.0f} Mo)"}).encode()
+        await send({
+            "type": "http.response.start", "status": 413,
+            "headers": [(b"content-type", b"application/json"), (b"content-length", str(len(body)).encode()),
+                        (b"connection", b"close")]
+        })
+        await send({"type": "http.response.body", "body": body})
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not self.max_bytes:
+            await self.app(scope, receive, send)
+            return
+
+        length = dict(scope["headers"]).get(b"content-length", b"")
+        if length.isdigit() and int(length) > self.max_bytes:
+            await self.reject(send)
+            return
+
+        state = {"received": 0, "started": False, "rejected": False}
+
+        async def limited_receive():
+            if state["rejected"]:
+                return {"type": "http.disconnect"}
+            message = await receive()
+            if message["type"] == "http.request":
+                state["received"] += len(message.get("body", b""))
+                if state["received"] > self.max_bytes and not state["started"]:
+                    # On répond tout de suite ; l'application voit une déconnexion et abandonne le parsing.
+                    state["rejected"] = True
+                    await self.reject(send)
+                    return {"type": "http.disconnect"}
+            return message
+
+        async def guarded_send(message):
+            if state["rejected"]:
+                return
+            if message["type"] == "http.response.start":
+                state["started"] = True
+            await send(message)
+
+        try:
+            await self.app(scope, limited_receive, guarded_send)
+        except Exception:
+            # Erreur consécutive à la déconnexion simulée : la réponse 413 est déjà partie.
+            if not state["rejected"]:
+                raise
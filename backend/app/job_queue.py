@@ -0,0 +1,269 @@
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from app.models_config import (
+    QUEUE_DB, QUEUE_WORKERS, QUEUE_MAX_PENDING, QUEUE_RETENTION_S, QUEUE_POLL_S, QUEUE_STALE_S
+)
+from app.executor import BoundedExecutor, ExecutorSaturated
+from app.telemetry import Counter, Gauge, register
+
+logger = logging.getLogger(__name__)
+
+PUBLIC_COLUMNS = "id, kind, priority, status, params, result, error, created, started, finished"
+
+QUEUE_JOBS = register(Counter(
+    "photo_queue_jobs_total", "Jobs de la file d'analyse par type et issue", ("kind", "outcome")
+))
+
+def dedup_key(kind, data, params):
+    """Deux soumissions identiques (même type, mêmes octets, mêmes paramètres) partagent le même job."""
+    digest = hashlib.sha256()
+    digest.update(kind.encode())
+    digest.update(hashlib.sha256(data).digest())
+    digest.update(json.dumps(params, sort_keys=True).encode())
+    return digest.hexdigest()
+
+def open_queue(db_path=QUEUE_DB):
+    """Ouvre (et crée si besoin) la file persistante des jobs d'analyse."""
+    os.makedirs(os.path.dirname(db_path) or ".", exist_ok=True)
+    db = sqlite3.connect(db_path, check_same_thread=False, timeout=30)
+    db.execute("PRAGMA journal_mode=WAL")
+    db.execute(
+        "CREATE TABLE IF NOT EXISTS queue_jobs ("
+        "id TEXT PRIMARY KEY, kind TEXT, priority INTEGER, status TEXT, dedup_key TEXT, data BLOB, "
+        "params TEXT, result TEXT, error TEXT, owner TEXT, heartbeat REAL, "
+        "created REAL, started REAL, finished REAL)"
+    )
+    db.execute("CREATE INDEX IF NOT EXISTS queue_jobs_next ON queue_jobs (status, priority DESC, created)")
+    db.execute("CREATE INDEX IF NOT EXISTS queue_jobs_dedup ON queue_jobs (dedup_key)")
+    db.commit()
+    return db
+
+class JobQueue:
+    """
+    File persistante (SQLite) des analyses longues : les clients soumettent un job puis suivent son état.
+    Plusieurs workers asynchrones par processus exécutent les jobs par priorité décroissante puis ordre d'arrivée.
+    """
+
+    def __init__(self, db_path=QUEUE_DB, workers=QUEUE_WORKERS, max_pending=QUEUE_MAX_PENDING,
+                 retention=QUEUE_RETENTION_S, poll_interval=QUEUE_POLL_S, stale_after=QUEUE_STALE_S):
+        self.db_path = db_path
+        self.workers = max(1, workers)
+        self.max_pending = max_pending
+        self.retention = retention
+        self.poll_interval = poll_interval
+        self.stale_after = stale_after
+        self.handlers = {}
+        # Les accès SQLite sont bloquants : ils passent par un pool dédié, hors de la boucle d'événements.
+        self.executor = BoundedExecutor("queue", 1)
+        # Les lectures (état, SSE, statistiques) ont leur propre pool : le suivi ne sature pas les soumissions.
+        self.watch_executor = BoundedExecutor("queue-watch", 1)
+        self.owner = None
+        self._db = None
+        self._pid = None
+        self._lock = threading.Lock()
+        self._wakeup = None
+        self._tasks = []
+
+    def register(self, kind, handler):
+        """Associe un type de job à sa fonction async `handler(data, params) -> résultat JSON`."""
+        self.handlers[kind] = handler
+
+    def _connection(self):
+        # Une connexion par processus : les workers forkés ouvrent la leur.
+        if self._db is None or self._pid != os.getpid():
+            self._db = open_queue(self.db_path)
+            self._pid = os.getpid()
+        return self._db
+
+    def _row_to_job(self, row):
+        job = dict(zip([column.strip() for column in PUBLIC_COLUMNS.split(",")], row))
+        job["params"] = json.loads(job["params"]) if job["params"] else {}
+        job["result"] = json.loads(job["result"]) if job["result"] else None
+        return job
+
+    def _submit(self, kind, data, params, priority):
+        key = dedup_key(kind, data, params)
+        with self._lock:
+            db = self._connection()
+            row = db.execute(
+                "SELECT id FROM queue_jobs WHERE dedup_key = ? AND status IN ('queued', 'running', 'done') "
+                "ORDER BY created DESC LIMIT 1", (key,)
+            ).fetchone()
+            if row is not None:
+                # Une soumission plus prioritaire remonte le job déjà en file.
+                db.execute(
+                    "UPDATE queue_jobs SET priority = MAX(priority, ?) WHERE id = ? AND status = 'queued'",
+                    (priority, row[0])
+                )
+                db.commit()
+                return row[0], True
+
+            pending = db.execute("SELECT COUNT(*) FROM queue_jobs WHERE status = 'queued'").fetchone()[0]
+            if pending >= self.max_pending:
+                raise ExecutorSaturated("File d'analyse pleine, réessayez plus tard")
+            job_id = uuid.uuid4().hex
+            db.execute(
+                "INSERT INTO queue_jobs (id, kind, priority, status, dedup_key, data, params, created) "
+                "VALUES (?, ?, ?, 'queued', ?, ?, ?, ?)",
+                (job_id, kind, priority, key, data, json.dumps(params), time.time())
+            )
+            db.commit()
+            return job_id, False
+
+    async def submit(self, kind, data=b"", params=None, priority=0):
+        """Ajoute un job à la file ; retourne (id, dédupliqué). Lève ExecutorSaturated si la file est pleine."""
+        if kind not in self.handlers:
+            raise ValueError(f"Type de job inconnu : {kind}")
+        job_id, deduplicated = await self.executor.run(self._submit, kind, data, params or {}, priority)
+        QUEUE_JOBS.inc(kind, "deduplicated" if deduplicated else "submitted")
+        if self._wakeup is not None:
+            self._wakeup.set()
+        return job_id, deduplicated
+
+    def _claim(self):
+        """Réserve le prochain job en file (les réservations concurrentes d'autres processus sont exclues)."""
+        with self._lock:
+            db = self._connection()
+            while True:
+                row = db.execute(
+                    "SELECT id FROM queue_jobs WHERE status = 'queued' ORDER BY priority DESC, created LIMIT 1"
+                ).fetchone()
+                if row is None:
+                    return None
+                now = time.time()
+                cursor = db.execute(
+                    "UPDATE queue_jobs SET status = 'running', owner = ?, started = ?, heartbeat = ? "
+                    "WHERE id = ? AND status = 'queued'",
+                    (self.owner, now, now, row[0])
+                )
+                db.commit()
+                if cursor.rowcount == 1:
+                    return db.execute(
+                        "SELECT id, kind, data, params FROM queue_jobs WHERE id = ?", (row[0],)
+                    ).fetchone()
+
+    def _finish(self, job_id, result=None, error=None):
+        with self._lock:
+            db = self._connection()
+            # Les octets de l'image ne sont plus utiles une fois le job terminé.
+            db.execute(
+                "UPDATE queue_jobs SET status = ?, result = ?, error = ?, finished = ?, data = NULL "
+                "WHERE id = ? AND status = 'running'",
+                ("failed" if error else "done", json.dumps(result) if result is not None else None,
+                 error, time.time(), job_id)
+            )
+            db.commit()
+
+    def _maintenance(self):
+        """Signale les jobs en cours de ce processus, relance les jobs orphelins et purge les jobs expirés."""
+        now = time.time()
+        with self._lock:
+            db = self._connection()
+            db.execute("UPDATE queue_jobs SET heartbeat = ? WHERE owner = ? AND status = 'running'", (now, self.owner))
+            requeued = db.execute(
+                "UPDATE queue_jobs SET status = 'queued', owner = NULL WHERE status = 'running' AND heartbeat < ?",
+                (now - self.stale_after,)
+            ).rowcount
+            purged = 0
+            if self.retention > 0:
+                purged = db.execute(
+                    "DELETE FROM queue_jobs WHERE status IN ('done', 'failed', 'cancelled') AND finished < ?",
+                    (now - self.retention,)
+                ).rowcount
+            db.commit()
+        if requeued or purged:
+            logger.info("File d'analyse : %d job(s) orphelin(s) relancé(s), %d job(s) expiré(s) supprimé(s)",
+                        requeued, purged)
+
+    def get(self, job_id):
+        """Retourne l'état (et le résultat) d'un job, ou None."""
+        with self._lock:
+            row = self._connection().execute(
+                f"SELECT {PUBLIC_COLUMNS} FROM queue_jobs WHERE id = ?", (job_id,)
+            ).fetchone()
+        return self._row_to_job(row) if row else None
+
+    def cancel(self, job_id):
+        """Annule un job encore en file ; retourne False s'il a déjà démarré ou n'existe pas."""
+        with self._lock:
+            db = self._connection()
+            cursor = db.execute(
+                "UPDATE queue_jobs SET status = 'cancelled', finished = ?, data = NULL "
+                "WHERE id = ? AND status = 'queued'", (time.time(), job_id)
+            )
+            db.commit()
+        return cursor.rowcount == 1
+
+    def stats(self):
+        """Nombre de jobs par état."""
+        with self._lock:
+            rows = self._connection().execute("SELECT status, COUNT(*) FROM queue_jobs GROUP BY status").fetchall()
+        return dict(rows)
+
+    async def _execute(self, job_id, kind, data, params):
+        try:
+            result = await self.handlers[kind](data, json.loads(params))
+        except Exception as e:
+            QUEUE_JOBS.inc(kind, "failed")
+            await self.executor.run(self._finish, job_id, error=str(e) or type(e).__name__)
+            return
+        QUEUE_JOBS.inc(kind, "done")
+        await self.executor.run(self._finish, job_id, result=result)
+
+    async def _maintenance_loop(self):
+        # Tâche séparée : le heartbeat continue pendant que tous les workers attendent une réponse GPT.
+        while True:
+            try:
+                await self.executor.run(self._maintenance)
+            except Exception:
+                logger.exception("Erreur de maintenance de la file d'analyse")
+            await asyncio.sleep(self.poll_interval)
+
+    async def _worker(self):
+        while True:
+            try:
+                job = await self.executor.run(self._claim)
+            except Exception:
+                logger.exception("Erreur d'accès à la file d'analyse")
+                job = None
+
+            if job is None:
+                self._wakeup.clear()
+                # asyncio.wait plutôt que wait_for : l'arrêt du worker n'est pas perdu si un job arrive au même moment.
+                waiter = asyncio.ensure_future(self._wakeup.wait())
+                try:
+                    await asyncio.wait([waiter], timeout=self.poll_interval)
+                finally:
+                    waiter.cancel()
+                continue
+            await self._execute(*job)
+
+    def start(self):
+        """Démarre les workers de la file dans la boucle d'événements courante."""
+        if not self._tasks:
+            self.owner = f"{os.getpid()}-{uuid.uuid4().hex[:8]}"
+            self._wakeup = asyncio.Event()
+            loop = asyncio.get_running_loop()
+            self._tasks = [loop.create_task(self._worker()) for _ in range(self.workers)]
+            self._tasks.append(loop.create_task(self._maintenance_loop()))
+        return self
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+JOB_QUEUE = JobQueue()
+
+register(Gauge(
+    "photo_queue_jobs", "Jobs de la file d'analyse par état", ("status",),
+    lambda: {(status,): count for status, count in JOB_QUEUE.stats().items()} if JOB_QUEUE.owner else {}
+))
@@ -0,0 +1,123 @@
+import asyncio
+import hashlib
+import random
+import time
+import httpx
+import openai
+from app.models_config import (
+    OPENAI_API_KEY, OPENAI_BASE_URL, LLM_MAX_CONCURRENCY, LLM_MAX_PENDING, LLM_RATE_PER_S, LLM_BURST,
+    LLM_TIMEOUT_S, LLM_MAX_RETRIES, LLM_BACKOFF_S, LLM_CACHE_MAX_ENTRIES, LLM_CACHE_TTL_S
+)
+from app.executor import ExecutorSaturated
+from app.result_cache import ResultCache, cache_key
+from app.telemetry import CACHE_HITS, CACHE_MISSES, stage
+
+RETRYABLE_ERRORS = (
+    openai.APITimeoutError,
+    openai.APIConnectionError,
+    openai.RateLimitError,
+    openai.InternalServerError,
+)
+
+class TokenBucket:
+    """Limiteur de débit : `rate` requêtes par seconde en moyenne, avec des rafales jusqu'à `capacity`."""
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = max(1, capacity)
+        self._tokens = float(self.capacity)
+        self._updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    async def acquire(self):
+        if self.rate <= 0:
+            return
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+
+class LLMGateway:
+    """Client OpenAI asynchrone mutualisé : concurrence bornée, débit limité, timeouts, retries et cache."""
+
+    def __init__(self, model="gpt-4o", max_tokens=400):
+        self.model = model
+        self.max_tokens = max_tokens
+        self.cache = ResultCache(LLM_CACHE_MAX_ENTRIES, LLM_CACHE_TTL_S, db_path="")
+        self._bucket = TokenBucket(LLM_RATE_PER_S, LLM_BURST)
+        self._semaphore = asyncio.Semaphore(max(1, LLM_MAX_CONCURRENCY))
+        self._pending = 0
+        self._client = None
+
+    @property
+    def client(self):
+        if self._client is None:
+            self._client = openai.AsyncOpenAI(
+                api_key=OPENAI_API_KEY or ("stub" if OPENAI_BASE_URL else None),
+                base_url=OPENAI_BASE_URL or None,
+                timeout=LLM_TIMEOUT_S,
+                # Les retries sont gérés ici, avec backoff et limitation de débit.
+                max_retries=0,
+                http_client=openai.DefaultAsyncHttpxClient(
+                    limits=httpx.Limits(
+                        max_connections=max(1, LLM_MAX_CONCURRENCY),
+                        max_keepalive_connections=max(1, LLM_MAX_CONCURRENCY)
+                    )
+                ),
+            )
+        return self._client
+
+    async def _complete(self, system_prompt, prompt, image_url):
+        response = await self.client.chat.completions.create(
+            model=self.model,
+            messages=[
+                {"role": "system", "content": system_prompt},
+                {"role": "user", "content": [
+                    {"type": "text", "text": prompt},
+                    {"type": "image_url", "image_url": {"url": image_url}}
+                ]}
+            ],
+            max_tokens=self.max_tokens
+        )
+        return response.choices[0].message.content or ""
+
+    async def chat(self, system_prompt, prompt, image_url):
+        """Envoie un prompt et une URL d'image au modèle ; la réponse est mise en cache (URL + prompt)."""
+        url_digest = hashlib.sha256(image_url.encode()).hexdigest()
+        key = cache_key(url_digest, "llm", self.model, system_prompt + prompt)
+        cached = self.cache.get(key)
+        if cached is not None:
+            CACHE_HITS.inc("llm")
+            return cached
+        CACHE_MISSES.inc("llm")
+
+        if self._pending >= max(1, LLM_MAX_CONCURRENCY) + LLM_MAX_PENDING:
+            raise ExecutorSaturated("Serveur saturé (OpenAI), réessayez plus tard")
+        self._pending += 1
+        try:
+            for attempt in range(LLM_MAX_RETRIES + 1):
+                await self._bucket.acquire()
+                try:
+                    async with self._semaphore:
+                        with stage("llm_request"):
+                            content = await self._complete(system_prompt, prompt, image_url)
+                    break
+                except RETRYABLE_ERRORS:
+                    if attempt == LLM_MAX_RETRIES:
+                        raise
+                await asyncio.sleep(LLM_BACKOFF_S * 2 ** attempt + random.uniform(0, LLM_BACKOFF_S))
+        finally:
+            self._pending -= 1
+
+        self.cache.set(key, content)
+        return content
+
+    def stats(self):
+        return {"pending": self._pending, "cache": self.cache.stats()}
+
+LLM_GATEWAY = LLMGateway()
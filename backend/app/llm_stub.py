@@ -0,0 +1,33 @@
+import asyncio
+import hashlib
+import time
+from fastapi import FastAPI, Request
+from app.models_config import LLM_STUB_LATENCY_MS
+
+app = FastAPI()
+
+@app.post("/v1/chat/completions")
+async def chat_completions(request: Request):
+    """
+    Imite l'API OpenAI Chat Completions pour tester les endpoints GPT hors ligne.
+    Lancer avec `uvicorn app.llm_stub:app --port 8001` puis définir OPENAI_BASE_URL=http://localhost:8001/v1.
+    """
+    body = await request.json()
+    await asyncio.sleep(LLM_STUB_LATENCY_MS / 1000)
+
+    # Note déterministe, dérivée du contenu de la requête.
+    score = 40 + int(hashlib.sha256(str(body.get("messages")).encode()).hexdigest(), 16) % 60
+    content = f"Analyse simulée (serveur de test local).\nScore final : {score}/100"
+
+    return {
+        "id": f"chatcmpl-stub-{int(time.time() * 1000)}",
+        "object": "chat.completion",
+        "created": int(time.time()),
+        "model": body.get("model", "gpt-4o"),
+        "choices": [{
+            "index": 0,
+            "message": {"role": "assistant", "content": content},
+            "finish_reason": "stop"
+        }],
+        "usage": {"prompt_tokens": 0, "completion_tokens": 0, "total_tokens": 0}
+    }
@@ -1,28 +1,148 @@
-import pyiqa
-import torch
-import openai
+import asyncio
+import json
+import mimetypes
 import os
-import io
-import re
-from fastapi import FastAPI, UploadFile, File, Form
-from fastapi.responses import JSONResponse, FileResponse
-from PIL import Image
+import time
+from typing import List, Optional
+from fastapi import FastAPI, UploadFile, File, Form, Request
+from fastapi.responses import JSONResponse, FileResponse, StreamingResponse, PlainTextResponse, Response
 import uvicorn
-from app.image_analysis import detect_blur, validate_image, compute_quality_score
-from app.models_config import PYIQA_INSTANCES, OPENAI_API_KEY, PYIQA_MODELS
+from app.image_analysis import detect_blur, compute_quality_score
+from app.models_config import (
+    PYIQA_PRELOAD, SERVER_TIMING, CATALOG_PAGE_SIZE, IMAGE_CACHE_MAX_AGE_S, CASCADE_MODE, NEAR_DUPLICATE_REUSE,
+    NEAR_DUPLICATE_DISTANCE
+)
+from app.model_registry import PYIQA_MODELS, preload_models, get_model_stats, get_model_version
+from app.batching import score_image
+from app.executor import OPENCV_EXECUTOR, ExecutorSaturated, configure_torch_threads
 from app.encode_image import encode_image_base64
-
-openai_client = openai.OpenAI(api_key=OPENAI_API_KEY)
-IMAGE_DIR = "data/img/"
-
-def load_pyiqa_model(model_name):
-    """Charge un modèle PyIQA donné."""
-    device = torch.device("cuda") if torch.cuda.is_available() else torch.device("cpu")
-    return pyiqa.create_metric(model_name, device=device)
-   
-PYIQA_INSTANCES = {name: load_pyiqa_model(model) for name, model in PYIQA_MODELS.items()}
+from app.image_pipeline import ImageTooLarge, decode_for_metric, preprocessing_version
+from app.ingestion import REQUEST_MAX_BYTES, RequestSizeLimit, UploadTooLarge, read_upload
+from app.result_cache import RESULT_CACHE, image_digest, cache_key
+from app.batch_analysis import parse_metrics, stream_batch, resolve_image_path
+from app.scoring_job import start_job, get_job, list_jobs, cancel_job
+from app.catalog import CATALOG
+from app.job_queue import JOB_QUEUE
+from app.perceptual_hash import NEAR_DUPLICATES, image_hash, group_near_duplicates
+from app.image_serving import (
+    THUMBNAILS, RangeNotSatisfiable, file_etag, validator_headers, is_not_modified, parse_range,
+    iter_file, thumbnail_size
+)
+from app.llm_gateway import LLM_GATEWAY
+from app.telemetry import (
+    REQUESTS, ERRORS, REQUEST_DURATION, REQUEST_MEMORY, CACHE_HITS, CACHE_MISSES,
+    render_metrics, start_request_timings, start_request_memory, mark_received, server_timing_header, stage
+)
+from app.analysis import (
+    NIMA_MODEL, LIQE_MODEL, GPT_SOLO_PROMPT, InvalidImage, decode_for_analysis, ask_gpt4o,
+    analyze_combined_image, analyze_combined_with_gpt, cascade_version
+)
 
 app = FastAPI()
+# Limite du corps des requêtes, appliquée pendant la réception (middleware interne à instrument_requests,
+# qui compte donc aussi les 413).
+app.add_middleware(RequestSizeLimit, max_bytes=REQUEST_MAX_BYTES)
+
+CACHE_VERSIONS = {
+    "opencv": f"laplacian@{preprocessing_version('opencv')}",
+    "nima": f"{get_model_version(NIMA_MODEL)}@{preprocessing_version('nima')}",
+    "liqe": f"{get_model_version(LIQE_MODEL)}@{preprocessing_version('liqe')}",
+}
+CACHE_VERSIONS["3-combined"] = "+".join(CACHE_VERSIONS[m] for m in ("opencv", "nima", "liqe"))
+CACHE_VERSIONS["4-combined"] = CACHE_VERSIONS["3-combined"] + "+gpt-4o"
+CACHE_VERSIONS["3-combined-cascade"] = f"{CACHE_VERSIONS['3-combined']}+{cascade_version()}"
+CACHE_VERSIONS["4-combined-cascade"] = f"{CACHE_VERSIONS['4-combined']}+{cascade_version()}"
+
+async def lookup_cache(data, metric, extra=""):
+    """Retourne le hash de l'image, la clé de cache et le résultat en cache (ou None)."""
+    mark_received()
+    with stage("hash"):
+        digest = await OPENCV_EXECUTOR.run(image_digest, data)
+    key = cache_key(digest, metric, CACHE_VERSIONS[metric], extra)
+    cached = await RESULT_CACHE.aget(key)
+    (CACHE_MISSES if cached is None else CACHE_HITS).inc(metric)
+    return digest, key, cached
+
+def with_cache_info(result, hit, digest):
+    """Ajoute au résultat le statut du cache (hit/miss) et le hash de l'image."""
+    return {**result, "cache": "hit" if hit else "miss", "image_hash": digest}
+
+async def lookup_near_duplicate(data, metric, digest, key):
+    """
+    Calcule le hash perceptuel de l'image et cherche une image quasi identique déjà analysée.
+    Retourne (hash perceptuel, réponse approximative ou None) ; la réponse approximative est mise en cache.
+    Réservé au score esthétique (NIMA) : le hash ignore le flou et le bruit, une copie floue d'une image nette
+    a le même hash, les métriques techniques (OpenCV, LIQE, analyses combinées) sont donc toujours recalculées.
+    """
+    if not NEAR_DUPLICATE_REUSE:
+        return None, None
+    try:
+        value = await OPENCV_EXECUTOR.run(image_hash, data)
+    except ExecutorSaturated:
+        raise
+    except Exception:
+        # Image illisible : l'analyse complète renverra l'erreur détaillée.
+        return None, None
+
+    match = NEAR_DUPLICATES.lookup(value, metric, CACHE_VERSIONS[metric])
+    if match is None:
+        return value, None
+    result, source_digest, distance = match
+    result = {**result, "approximate": True, "near_duplicate": {"image_hash": source_digest, "distance": distance}}
+    await RESULT_CACHE.aset(key, result)
+    return value, {**result, "cache": "near_duplicate", "image_hash": digest}
+
+def remember_near_duplicate(value, metric, result, digest):
+    """Ajoute le résultat d'une analyse complète à l'index des quasi-doublons."""
+    if value is not None:
+        NEAR_DUPLICATES.add(value, metric, CACHE_VERSIONS[metric], result, digest)
+
+@app.middleware("http")
+async def instrument_requests(request: Request, call_next):
+    """
+    Mesure chaque requête (compteurs, latence, pic de mémoire estimé) et ajoute les en-têtes Server-Timing
+    (détail des étapes) et X-Request-Peak-Memory (octets reçus et images décodées simultanément en mémoire).
+    """
+    timings = start_request_timings()
+    memory = start_request_memory()
+    start = time.perf_counter()
+    response = await call_next(request)
+    duration = time.perf_counter() - start
+
+    route = getattr(request.scope.get("route"), "path", "unmatched")
+    REQUESTS.inc(route, response.status_code)
+    REQUEST_DURATION.observe(duration, route)
+    REQUEST_MEMORY.observe(memory.peak, route)
+    if response.status_code >= 500:
+        ERRORS.inc(route)
+    if SERVER_TIMING:
+        response.headers["Server-Timing"] = server_timing_header(timings + [("total", duration)])
+        response.headers["X-Request-Peak-Memory"] = str(memory.peak)
+    return response
+
+@app.get("/metrics")
+def metrics():
+    """Exporte les métriques du backend au format Prometheus."""
+    return PlainTextResponse(render_metrics(), media_type="text/plain; version=0.0.4")
+
+@app.on_event("startup")
+def load_models():
+    """Configure les threads PyTorch, précharge les modèles PyIQA si le démarrage à chaud est activé
+    et lance le scan du catalogue d'images (dans le premier worker seulement en mode multi-processus)."""
+    configure_torch_threads()
+    if PYIQA_PRELOAD:
+        preload_models()
+    if os.getenv("WORKER_INDEX", "0") == "0":
+        CATALOG.start()
+
+@app.on_event("startup")
+async def start_job_queue():
+    """Démarre les workers de la file des analyses longues (GPT-4o)."""
+    JOB_QUEUE.start()
+
+@app.on_event("shutdown")
+async def stop_job_queue():
+    await JOB_QUEUE.stop()
 
 @app.get("/")
 def read_root():
@@ -35,28 +155,40 @@ async def get_models():
         "pyiqa_models": list(PYIQA_MODELS.keys())
     }
 
+@app.get("/cache/stats/")
+async def get_cache_stats():
+    """Récupère l'état du cache des résultats d'analyse et de la passerelle OpenAI."""
+    return {**RESULT_CACHE.stats(), "llm": LLM_GATEWAY.stats(), "near_duplicates": NEAR_DUPLICATES.stats()}
+
+@app.delete("/cache/")
+async def invalidate_cache(image_hash: str = None):
+    """Invalide les résultats en cache d'une image (par hash), ou tout le cache."""
+    return {"removed": await RESULT_CACHE.ainvalidate(image_hash)}
+
+@app.get("/models/stats/")
+async def get_models_stats():
+    """Récupère l'état de chargement, le temps de chargement et la mémoire de chaque modèle."""
+    return get_model_stats()
+
 @app.post("/analyze/opencv/")
 async def analyze_opencv(file: UploadFile = File(...)):
     """Analyse une image avec OpenCV pour détecter le flou."""
     try:
-        image = Image.open(io.BytesIO(await file.read())).convert("RGB")
-        temp_path = "temp.jpg"
-        image = image.resize((1024, 1024))
-        image.save(temp_path)
+        data = await read_upload(file)
+        digest, key, cached = await lookup_cache(data, "opencv")
+        if cached is not None:
+            return with_cache_info(cached, True, digest)
 
-        valid, error_msg = validate_image(temp_path)
-        if not valid:
-            return JSONResponse(content={"error": error_msg}, status_code=400)
+        decoded = await OPENCV_EXECUTOR.run(decode_for_analysis, data)
 
-        clarity, blur_score = detect_blur(temp_path)
+        with stage("opencv"):
+            clarity, blur_score = await OPENCV_EXECUTOR.run(detect_blur, decoded.gray)
         blur_score = blur_score 
 
         scores = [blur_score]
         quality_score = compute_quality_score(scores)
 
-        os.remove(temp_path)
-
-        return {
+        result = {
             "method": "OpenCV",
             "results": [
                 {"label": "Netteté", "score": blur_score},
@@ -64,27 +196,50 @@ async def analyze_opencv(file: UploadFile = File(...)):
             ],
             "quality_score": f"{quality_score:.2f}%"
         }
-
+        await RESULT_CACHE.aset(key, result)
+        return with_cache_info(result, False, digest)
+
+    except InvalidImage as e:
+        return JSONResponse(content={"error": str(e)}, status_code=400)
+    except (UploadTooLarge, ImageTooLarge) as e:
+        return JSONResponse(content={"error": str(e)}, status_code=413)
+    except ExecutorSaturated as e:
+        return JSONResponse(content={"error": str(e)}, status_code=503)
     except Exception as e:
         return JSONResponse(content={"error": str(e)}, status_code=500)
 @app.post("/analyze/nima/")
 async def analyze_nima(file: UploadFile = File(...)):
     """Analyse la qualité esthétique d'une image avec NIMA (via PyIQA)."""
     try:
-        image = Image.open(io.BytesIO(await file.read())).convert("RGB")
+        data = await read_upload(file)
+        digest, key, cached = await lookup_cache(data, "nima")
+        if cached is not None:
+            return with_cache_info(cached, True, digest)
+        phash, approximate = await lookup_near_duplicate(data, "nima", digest, key)
+        if approximate is not None:
+            return approximate
+
+        decoded = await OPENCV_EXECUTOR.run(decode_for_metric, data, "nima")
 
-        nima_model = PYIQA_INSTANCES["NIMA (VGG16-AVA)"]
-        score = nima_model(image).item() 
+        with stage("nima"):
+            score = await score_image(NIMA_MODEL, decoded.array)
 
         quality_assessment = "Bonne qualité esthétique 👍" if score >= 5 else "Mauvaise qualité esthétique 👎"
 
-        return {
+        result = {
             "method": "nima",
             "model": "NIMA (VGG16-AVA)",
             "raw_score": score,  
             "quality_score": f"{score:.2f}",
             "evaluation": quality_assessment
         }
+        await RESULT_CACHE.aset(key, result)
+        remember_near_duplicate(phash, "nima", result, digest)
+        return with_cache_info(result, False, digest)
+    except (UploadTooLarge, ImageTooLarge) as e:
+        return JSONResponse(content={"error": str(e)}, status_code=413)
+    except ExecutorSaturated as e:
+        return JSONResponse(content={"error": str(e)}, status_code=503)
     except Exception as e:
         return JSONResponse(content={"error": str(e)}, status_code=500)
 
@@ -92,24 +247,47 @@ async def analyze_nima(file: UploadFile = File(...)):
 async def analyze_liqe(file: UploadFile = File(...)):
     """Analyse la qualité technique d'une image avec LIQE (via PyIQA)."""
     try:
-        image = Image.open(io.BytesIO(await file.read())).convert("RGB")
+        data = await read_upload(file)
+        digest, key, cached = await lookup_cache(data, "liqe")
+        if cached is not None:
+            return with_cache_info(cached, True, digest)
+        decoded = await OPENCV_EXECUTOR.run(decode_for_metric, data, "liqe")
 
-        liqe_model = PYIQA_INSTANCES["LIQE (No-Reference)"]
-        score = liqe_model(image).item() 
+        with stage("liqe"):
+            score = await score_image(LIQE_MODEL, decoded.array)
 
         quality_assessment = "Bonne qualité technique 👍" if score >= 5 else "Mauvaise qualité technique 👎"
 
-        return {
+        result = {
             "method": "liqe",
             "model": "LIQE (Qualité Technique)",
             "raw_score": score,
             "quality_score": f"{score:.2f}",
             "evaluation": quality_assessment
         }
+        await RESULT_CACHE.aset(key, result)
+        return with_cache_info(result, False, digest)
+    except (UploadTooLarge, ImageTooLarge) as e:
+        return JSONResponse(content={"error": str(e)}, status_code=413)
+    except ExecutorSaturated as e:
+        return JSONResponse(content={"error": str(e)}, status_code=503)
     except Exception as e:
         return JSONResponse(content={"error": str(e)}, status_code=500)
 
     
+INVALID_URL_ERROR = "L'URL de l'image est invalide. Fournissez un lien valide."
+
+def valid_image_url(image_url):
+    return bool(image_url) and image_url.startswith(("http://", "https://"))
+
+async def gpt_solo_analysis(image_url):
+    """Analyse GPT-4o d'une image à partir de son URL."""
+    gpt_analysis = await ask_gpt4o("Tu es un expert en analyse d'images.", GPT_SOLO_PROMPT, image_url)
+    return {
+        "method": "gpt-4o",
+        "final_analysis": gpt_analysis
+    }
+
 @app.post("/analyze/openia-solo/")
 async def analyze_gpt4o(image_url: str = Form(...)):
     """
@@ -118,207 +296,367 @@ async def analyze_gpt4o(image_url: str = Form(...)):
     - Utilise `Form(...)` pour la validation.
     """
     try:
-        if not image_url or not image_url.startswith(("http://", "https://")):
-            return JSONResponse(content={"error": "L'URL de l'image est invalide. Fournissez un lien valide."}, status_code=400)
-
-        prompt = """
-        Tu es un expert en analyse de qualité d'image. 
-        Évalue cette image en mettant une note sur 10 :
-        - **Qualité technique** : netteté, bruit, exposition, couleurs.
-        - **Qualité esthétique** : composition, équilibre, attrait visuel.
-        
-        🔹 **Note sur 100** : 
-        Donne une note finale basée sur ces critères. 
-
-        🔹 **Résumé en une phrase** : 
-        Décris en 1 phrase ce que tu vois dans l'image.
-        """
-
-        response = openai_client.chat.completions.create(
-            model="gpt-4o",
-            messages=[
-                {"role": "system", "content": "Tu es un expert en analyse d'images."},
-                {"role": "user", "content": [
-                    {"type": "text", "text": prompt},
-                    {"type": "image_url", "image_url": {"url": image_url}} 
-                ]}
-            ],
-            max_tokens=400
-        )
+        if not valid_image_url(image_url):
+            return JSONResponse(content={"error": INVALID_URL_ERROR}, status_code=400)
+        return await gpt_solo_analysis(image_url)
 
-        gpt_analysis = response.choices[0].message.content
+    except ExecutorSaturated as e:
+        return JSONResponse(content={"error": str(e)}, status_code=503)
+    except Exception as e:
+        return JSONResponse(content={"error": str(e)}, status_code=500)
 
-        return {
-            "method": "gpt-4o",
-            "final_analysis": gpt_analysis
-        }
+@app.post("/analyze/batch/")
+async def analyze_batch(
+    files: List[UploadFile] = File(None),
+    paths: List[str] = Form(None),
+    metrics: str = Form("opencv,nima,liqe")
+):
+    """
+    Analyse un lot d'images et renvoie un résultat JSON par ligne (NDJSON) dès qu'une image est terminée.
+    - `files` : images téléversées, et/ou `paths` : chemins relatifs au dossier d'images.
+    - `metrics` : métriques à calculer, séparées par des virgules (opencv, nima, liqe).
+    """
+    try:
+        selected_metrics = parse_metrics(metrics)
+    except ValueError as e:
+        return JSONResponse(content={"error": str(e)}, status_code=400)
 
+    # Les fichiers téléversés sont fermés dès le retour du handler : on les lit avant de streamer.
+    try:
+        items = [(file.filename, await read_upload(file)) for file in files or []]
+    except UploadTooLarge as e:
+        return JSONResponse(content={"error": str(e)}, status_code=413)
+    items += [(path, path) for path in paths or []]
+    if not items:
+        return JSONResponse(content={"error": "Aucune image fournie"}, status_code=400)
+
+    return StreamingResponse(stream_batch(items, selected_metrics), media_type="application/x-ndjson")
+
+@app.post("/jobs/")
+async def create_scoring_job():
+    """Lance le scoring incrémental de la bibliothèque d'images (seules les images nouvelles ou modifiées)."""
+    try:
+        job = await OPENCV_EXECUTOR.run(start_job)
+        return job.progress()
+    except RuntimeError as e:
+        return JSONResponse(content={"error": str(e)}, status_code=409)
+    except ExecutorSaturated as e:
+        return JSONResponse(content={"error": str(e)}, status_code=503)
     except Exception as e:
         return JSONResponse(content={"error": str(e)}, status_code=500)
 
-@app.get("/list-images/")
-async def list_images():
-    """Récupère la liste des images disponibles."""
+@app.get("/jobs/")
+async def list_scoring_jobs():
+    """Récupère l'avancement des derniers jobs de scoring (tous workers confondus)."""
     try:
-        if os.path.exists(IMAGE_DIR):
-            images = []
-            for root, _, files in os.walk(IMAGE_DIR):
-                for file in files:
-                    if file.endswith((".jpg", ".jpeg", ".png")):
-                        images.append(os.path.relpath(os.path.join(root, file), IMAGE_DIR))
-            return {"images": images}
-        return {"images": []}
+        return {"jobs": await OPENCV_EXECUTOR.run(list_jobs)}
+    except ExecutorSaturated as e:
+        return JSONResponse(content={"error": str(e)}, status_code=503)
     except Exception as e:
         return JSONResponse(content={"error": str(e)}, status_code=500)
 
-@app.get("/get-image/{image_path:path}")
-async def get_image(image_path: str):
-    """Récupère une image stockée dans le dossier backend."""
+@app.get("/jobs/{job_id}")
+async def get_scoring_job(job_id: str):
+    """Récupère l'avancement et le débit d'un job de scoring."""
     try:
-        file_path = os.path.join(IMAGE_DIR, image_path)
-        if os.path.exists(file_path):
-            return FileResponse(file_path)
-        return JSONResponse(content={"error": "Image non trouvée"}, status_code=404)
+        job = await OPENCV_EXECUTOR.run(get_job, job_id)
+    except ExecutorSaturated as e:
+        return JSONResponse(content={"error": str(e)}, status_code=503)
     except Exception as e:
         return JSONResponse(content={"error": str(e)}, status_code=500)
+    if job is None:
+        return JSONResponse(content={"error": "Job non trouvé"}, status_code=404)
+    return job
 
-@app.post("/analyze/3-combined/")
-async def analyze_combined(file: UploadFile = File(...)):
+@app.delete("/jobs/{job_id}")
+async def cancel_scoring_job(job_id: str):
+    """Interrompt un job de scoring ; il reprendra où il s'est arrêté au prochain lancement."""
+    try:
+        job = await OPENCV_EXECUTOR.run(cancel_job, job_id)
+    except ExecutorSaturated as e:
+        return JSONResponse(content={"error": str(e)}, status_code=503)
+    except Exception as e:
+        return JSONResponse(content={"error": str(e)}, status_code=500)
+    if job is None:
+        return JSONResponse(content={"error": "Job non trouvé"}, status_code=404)
+    return job
+
+@app.get("/list-images/")
+async def list_images(
+    folder: str = "",
+    metric: Optional[str] = None,
+    min_score: Optional[float] = None,
+    max_score: Optional[float] = None,
+    cursor: str = "",
+    limit: int = CATALOG_PAGE_SIZE,
+):
     """
-    Analyse une image avec OpenCV (flou), NIMA (qualité esthétique) et LIQE (qualité technique).
+    Récupère une page du catalogue des images, filtrable par dossier et par plage de score.
+    Passer `next_cursor` comme `cursor` pour obtenir la page suivante.
     """
     try:
-        image = Image.open(io.BytesIO(await file.read())).convert("RGB")
-        temp_path = "temp.jpg"
-        image = image.resize((1024, 1024))
-        image.save(temp_path)
-
-        valid, error_msg = validate_image(temp_path)
-        if not valid:
-            return JSONResponse(content={"error": error_msg}, status_code=400)
-
-        blur_result = detect_blur(temp_path)
-        blur_score = blur_result[1] * 100
-        clarity = "Flou" if blur_score >= 50 else "Net"
-
-        nima_model = PYIQA_INSTANCES["NIMA (VGG16-AVA)"]
-        nima_score = nima_model(image).item()
-        nima_quality = "Bonne qualité esthétique 👍" if nima_score >= 5 else "Mauvaise qualité esthétique 👎"
+        with stage("catalog"):
+            page = await OPENCV_EXECUTOR.run(CATALOG.query, folder, metric, min_score, max_score, cursor, limit)
+            status = await OPENCV_EXECUTOR.run(CATALOG.status)
+        return {
+            "images": [item["path"] for item in page["items"]],
+            **page,
+            **status,
+        }
+    except ValueError as e:
+        return JSONResponse(content={"error": str(e)}, status_code=400)
+    except ExecutorSaturated as e:
+        return JSONResponse(content={"error": str(e)}, status_code=503)
+    except Exception as e:
+        return JSONResponse(content={"error": str(e)}, status_code=500)
 
-        liqe_model = PYIQA_INSTANCES["LIQE (No-Reference)"]
-        liqe_score = liqe_model(image).item()
-        liqe_quality = "Bonne qualité technique 👍" if liqe_score >= 5 else "Mauvaise qualité technique 👎"
+@app.get("/list-images/duplicates/")
+async def list_duplicate_images(folder: str = "", max_distance: int = NEAR_DUPLICATE_DISTANCE):
+    """
+    Regroupe les images quasi identiques du catalogue (hash perceptuel à une distance de Hamming
+    inférieure ou égale à `max_distance`), des plus grands groupes aux plus petits.
+    """
+    try:
+        hashes = await OPENCV_EXECUTOR.run(CATALOG.hashes, folder)
+        with stage("duplicates"):
+            groups = await OPENCV_EXECUTOR.run(group_near_duplicates, hashes, max(0, max_distance))
+        return {"groups": groups, "images": len(hashes), "max_distance": max_distance}
+    except ExecutorSaturated as e:
+        return JSONResponse(content={"error": str(e)}, status_code=503)
+    except Exception as e:
+        return JSONResponse(content={"error": str(e)}, status_code=500)
 
-        os.remove(temp_path)
+@app.post("/list-images/scan/")
+async def scan_catalog():
+    """Lance un scan incrémental du catalogue (images ajoutées, modifiées ou supprimées)."""
+    if not CATALOG.scan_in_background():
+        return JSONResponse(content={"error": "Un scan du catalogue est déjà en cours"}, status_code=409)
+    try:
+        last_scan = (await OPENCV_EXECUTOR.run(CATALOG.status))["last_scan"]
+    except Exception:
+        last_scan = None
+    return JSONResponse(content={"status": "started", "last_scan": last_scan}, status_code=202)
 
-        return {
-            "method": "Combined Analysis",
-            "scores": {
-                "opencv_blur": f"{blur_score:.2f}%",
-                "nima_esthetic": f"{nima_score:.2f}",
-                "liqe_technical": f"{liqe_score:.2f}"
-            },
-            "evaluation": {
-                "clarity": f"L'image est {clarity}",
-                "esthetic_quality": nima_quality,
-                "technical_quality": liqe_quality
-            },
-        }
+@app.get("/get-image/{image_path:path}")
+async def get_image(image_path: str, request: Request, size: Optional[int] = None):
+    """
+    Récupère une image stockée dans le dossier backend, ou sa miniature (`size` = plus grand côté).
+    Réponses conditionnelles (ETag / Last-Modified → 304) et requêtes partielles (Range) sur les originaux.
+    """
+    try:
+        if size is not None:
+            thumbnail_size(size)
+        file_path = resolve_image_path(image_path)
+        if not os.path.isfile(file_path):
+            return JSONResponse(content={"error": "Image non trouvée"}, status_code=404)
+
+        stat = os.stat(file_path)
+        etag = file_etag(stat, f"thumbnail-{size}" if size else "")
+        headers = {**validator_headers(stat, etag), "Cache-Control": f"public, max-age={IMAGE_CACHE_MAX_AGE_S}"}
+        if is_not_modified(request.headers, stat, etag):
+            return Response(status_code=304, headers=headers)
+
+        if size is not None:
+            thumbnail = await OPENCV_EXECUTOR.run(THUMBNAILS.get, file_path, stat, size)
+            return Response(content=thumbnail, media_type="image/jpeg", headers=headers)
+
+        headers["Accept-Ranges"] = "bytes"
+        byte_range = parse_range(request.headers, stat.st_size, etag)
+        if byte_range is None:
+            return FileResponse(file_path, headers=headers, stat_result=stat)
+        start, end = byte_range
+        headers["Content-Range"] = f"bytes {start}-{end}/{stat.st_size}"
+        headers["Content-Length"] = str(end - start + 1)
+        media_type = mimetypes.guess_type(file_path)[0] or "application/octet-stream"
+        return StreamingResponse(iter_file(file_path, start, end), status_code=206, media_type=media_type,
+                                 headers=headers)
+    except RangeNotSatisfiable as e:
+        return JSONResponse(content={"error": str(e)}, status_code=416,
+                            headers={"Content-Range": f"bytes */{stat.st_size}"})
+    except ValueError as e:
+        return JSONResponse(content={"error": str(e)}, status_code=400)
+    except ExecutorSaturated as e:
+        return JSONResponse(content={"error": str(e)}, status_code=503)
+    except Exception as e:
+        return JSONResponse(content={"error": str(e)}, status_code=500)
 
+@app.post("/analyze/3-combined/")
+async def analyze_combined(file: UploadFile = File(...), cascade: Optional[bool] = Form(None)):
+    """
+    Analyse une image avec OpenCV (flou), NIMA (qualité esthétique) et LIQE (qualité technique).
+    Les trois métriques sont calculées en parallèle ; `timings_ms` détaille la durée de chaque étape.
+    En mode `cascade` (CASCADE_MODE par défaut), NIMA et LIQE sont sautés pour une image trop floue ;
+    `stages` indique les étapes exécutées.
+    """
+    try:
+        cascade = CASCADE_MODE if cascade is None else cascade
+        metric = "3-combined-cascade" if cascade else "3-combined"
+        data = await read_upload(file)
+        digest, key, cached = await lookup_cache(data, metric)
+        if cached is not None:
+            return with_cache_info(cached, True, digest)
+        result, timings = await analyze_combined_image(data, cascade)
+        await RESULT_CACHE.aset(key, result)
+        return {**with_cache_info(result, False, digest), "timings_ms": timings}
+
+    except InvalidImage as e:
+        return JSONResponse(content={"error": str(e)}, status_code=400)
+    except (UploadTooLarge, ImageTooLarge) as e:
+        return JSONResponse(content={"error": str(e)}, status_code=413)
+    except ExecutorSaturated as e:
+        return JSONResponse(content={"error": str(e)}, status_code=503)
     except Exception as e:
         return JSONResponse(content={"error": str(e)}, status_code=500)
 
+async def combined_gpt_analysis(data, image_url, cascade):
+    """Analyse OpenCV + NIMA + LIQE puis GPT-4o, avec le cache des résultats."""
+    digest, key, cached = await lookup_cache(data, "4-combined-cascade" if cascade else "4-combined", image_url)
+    if cached is not None:
+        return with_cache_info(cached, True, digest)
+
+    result, timings = await analyze_combined_with_gpt(data, image_url, cascade)
+    await RESULT_CACHE.aset(key, result)
+    return {**with_cache_info(result, False, digest), "timings_ms": timings}
+
 @app.post("/analyze/4-combined/")
-async def analyze_with_gpt(file: UploadFile = File(...), image_url: str = Form(...)):
+async def analyze_with_gpt(
+    file: UploadFile = File(...), image_url: str = Form(...), cascade: Optional[bool] = Form(None)
+):
     """
     Analyse une image avec OpenCV, NIMA et LIQE puis envoie l'analyse combinée à GPT-4o.
+    Les trois métriques sont calculées en parallèle ; `timings_ms` détaille la durée de chaque étape.
+    En mode `cascade`, GPT-4o n'est appelé que si l'image passe les seuils de flou, NIMA et LIQE.
     """
 
     try:
-        image = Image.open(io.BytesIO(await file.read())).convert("RGB")
-        temp_path = "temp.jpg"
-        image = image.resize((1024, 1024))
-        image.save(temp_path)
-
-        clarity, blur_raw_score = detect_blur(temp_path)
-        blur_score = (1 - blur_raw_score) * 100 
-
-        nima_model = PYIQA_INSTANCES["NIMA (VGG16-AVA)"]
-        nima_score = nima_model(image).item()
-
-        if nima_score >= 6:
-            nima_quality = "Excellente qualité esthétique ⭐⭐⭐"
-        elif 5 <= nima_score < 6:
-            nima_quality = "Bonne qualité esthétique 👍"
-        elif 3 <= nima_score < 5:
-            nima_quality = "Qualité esthétique moyenne 🤔"
-        else:
-            nima_quality = "Mauvaise qualité esthétique 👎"
-
-        liqe_model = PYIQA_INSTANCES["LIQE (No-Reference)"]
-        liqe_score = liqe_model(image).item()
-        liqe_quality = "Bonne qualité technique 👍" if liqe_score >= 5 else "Mauvaise qualité technique 👎"
-
-        quality_score = compute_quality_score([blur_score, nima_score, liqe_score])
-
-        combined_analysis = {
-            "method": "Combined Analysis",
-            "scores": {
-                "opencv_blur": f"{blur_score:.2f}%", 
-                "nima_esthetic": f"{nima_score:.2f}",
-                "liqe_technical": f"{liqe_score:.2f}"
-            },
-            "evaluation": {
-                "clarity": f"L'image est {clarity}",
-                "esthetic_quality": nima_quality,
-                "technical_quality": liqe_quality
-            },
-        }
+        cascade = CASCADE_MODE if cascade is None else cascade
+        return await combined_gpt_analysis(await read_upload(file), image_url, cascade)
+
+    except InvalidImage as e:
+        return JSONResponse(content={"error": str(e)}, status_code=400)
+    except (UploadTooLarge, ImageTooLarge) as e:
+        return JSONResponse(content={"error": str(e)}, status_code=413)
+    except ExecutorSaturated as e:
+        return JSONResponse(content={"error": str(e)}, status_code=503)
+    except Exception as e:
+        return JSONResponse(content={"error": str(e)}, status_code=500)
 
-        prompt = f"""
-        Tu es un expert en analyse d'image.
-        Voici l'évaluation technique et esthétique d'une image :
-
-        - **Netteté détectée (OpenCV)** : {combined_analysis['scores']['opencv_blur']}
-        - **Score esthétique (NIMA)** : {combined_analysis['scores']['nima_esthetic']}
-        - **Score technique (LIQE)** : {combined_analysis['scores']['liqe_technical']}
-        - **Clarté** : {combined_analysis['evaluation']['clarity']}
-        - **Qualité esthétique** : {combined_analysis['evaluation']['esthetic_quality']}
-        - **Qualité technique** : {combined_analysis['evaluation']['technical_quality']}
-
-        🔍 **Analyse finale** :
-        Donne ton analyse sur l'image et donne lui une note.
-        **Note l’image sur 100** en prenant en compte tous ces critères et donne la note sous la forme "Score final : XX/100".
-        """
-
-        response = openai_client.chat.completions.create(
-            model="gpt-4o",
-            messages=[
-                {"role": "system", "content": "Tu es un expert en analyse d'images et en qualité visuelle."},
-                {"role": "user", "content": [
-                    {"type": "text", "text": prompt},
-                    {"type": "image_url", "image_url": {"url": image_url}}
-                ]}
-            ],
-            max_tokens=400
-        )
+# ===================================================
+# File des analyses longues : soumission puis suivi (polling ou SSE)
+# ===================================================
+async def run_combined_job(data, params):
+    return await combined_gpt_analysis(data, params["image_url"], params["cascade"])
 
-        gpt_analysis = response.choices[0].message.content
+async def run_solo_job(_data, params):
+    return await gpt_solo_analysis(params["image_url"])
 
-        score_match = re.search(r"Score final\s*:\s*(\d+)/100", gpt_analysis)
-        gpt_final_score = int(score_match.group(1)) if score_match else None
+JOB_QUEUE.register("4-combined", run_combined_job)
+JOB_QUEUE.register("openia-solo", run_solo_job)
 
-        os.remove(temp_path)
+async def submit_job(kind, data, params, priority):
+    """Soumet un job et retourne 202 avec son identifiant (ou celui du job identique déjà soumis)."""
+    try:
+        job_id, deduplicated = await JOB_QUEUE.submit(kind, data, params, priority)
+    except ExecutorSaturated as e:
+        return JSONResponse(content={"error": str(e)}, status_code=503)
+    except Exception as e:
+        return JSONResponse(content={"error": str(e)}, status_code=500)
+    return JSONResponse(
+        content={"id": job_id, "deduplicated": deduplicated, "status_url": f"/queue/{job_id}"},
+        status_code=202
+    )
+
+@app.post("/queue/4-combined/")
+async def queue_combined_with_gpt(
+    file: UploadFile = File(...), image_url: str = Form(...), cascade: Optional[bool] = Form(None),
+    priority: int = Form(0)
+):
+    """Soumet une analyse OpenCV + NIMA + LIQE + GPT-4o ; le résultat est disponible sur /queue/{id}."""
+    if not valid_image_url(image_url):
+        return JSONResponse(content={"error": INVALID_URL_ERROR}, status_code=400)
+    params = {"image_url": image_url, "cascade": CASCADE_MODE if cascade is None else cascade}
+    try:
+        data = await read_upload(file)
+    except UploadTooLarge as e:
+        return JSONResponse(content={"error": str(e)}, status_code=413)
+    return await submit_job("4-combined", data, params, priority)
+
+@app.post("/queue/openia-solo/")
+async def queue_gpt4o(image_url: str = Form(...), priority: int = Form(0)):
+    """Soumet une analyse GPT-4o à partir d'une URL d'image ; le résultat est disponible sur /queue/{id}."""
+    if not valid_image_url(image_url):
+        return JSONResponse(content={"error": INVALID_URL_ERROR}, status_code=400)
+    return await submit_job("openia-solo", b"", {"image_url": image_url}, priority)
+
+@app.get("/queue/")
+async def queue_stats():
+    """Nombre de jobs de la file par état."""
+    try:
+        # Lecture seule : pool de suivi, sans concurrencer les soumissions et la réservation des jobs.
+        return {"jobs": await JOB_QUEUE.watch_executor.run(JOB_QUEUE.stats)}
+    except ExecutorSaturated as e:
+        return JSONResponse(content={"error": str(e)}, status_code=503)
+    except Exception as e:
+        return JSONResponse(content={"error": str(e)}, status_code=500)
 
-        return {
-            "method": "GPT-4o Image Analysis",
-            "gpt_analysis": gpt_analysis,
-            "combined_scores": combined_analysis,
-            "gpt_final_score": gpt_final_score if gpt_final_score is not None else "Score non détecté"
-        }
+@app.get("/queue/{job_id}")
+async def get_queued_job(job_id: str):
+    """Récupère l'état d'un job de la file, et son résultat une fois terminé."""
+    try:
+        job = await JOB_QUEUE.watch_executor.run(JOB_QUEUE.get, job_id)
+    except ExecutorSaturated as e:
+        return JSONResponse(content={"error": str(e)}, status_code=503)
+    except Exception as e:
+        return JSONResponse(content={"error": str(e)}, status_code=500)
+    if job is None:
+        return JSONResponse(content={"error": "Job non trouvé"}, status_code=404)
+    return job
 
+@app.get("/queue/{job_id}/events")
+async def stream_queued_job(job_id: str):
+    """
+    Suit un job en Server-Sent Events : un événement à chaque changement d'état, jusqu'au résultat.
+    Si le job est purgé pendant le suivi (rétention dépassée), un dernier événement `gone` clôt le flux.
+    """
+    try:
+        job = await JOB_QUEUE.watch_executor.run(JOB_QUEUE.get, job_id)
+    except ExecutorSaturated as e:
+        return JSONResponse(content={"error": str(e)}, status_code=503)
+    if job is None:
+        return JSONResponse(content={"error": "Job non trouvé"}, status_code=404)
+
+    async def events(job):
+        status = None
+        while True:
+            if job is None:
+                yield f"event: gone\ndata: {json.dumps({'id': job_id, 'status': 'gone'})}\n\n"
+                return
+            if job["status"] != status:
+                status = job["status"]
+                yield f"event: {status}\ndata: {json.dumps(job)}\n\n"
+            if status in ("done", "failed", "cancelled"):
+                return
+            await asyncio.sleep(JOB_QUEUE.poll_interval / 2)
+            try:
+                job = await JOB_QUEUE.watch_executor.run(JOB_QUEUE.get, job_id)
+            except ExecutorSaturated:
+                # Pool de suivi saturé : on garde le dernier état connu et on réessaie au prochain tour.
+                pass
+
+    return StreamingResponse(events(job), media_type="text/event-stream", headers={"Cache-Control": "no-cache"})
+
+@app.delete("/queue/{job_id}")
+async def cancel_queued_job(job_id: str):
+    """Annule un job encore en file."""
+    try:
+        cancelled = await JOB_QUEUE.executor.run(JOB_QUEUE.cancel, job_id)
+    except ExecutorSaturated as e:
+        return JSONResponse(content={"error": str(e)}, status_code=503)
     except Exception as e:
         return JSONResponse(content={"error": str(e)}, status_code=500)
+    if not cancelled:
+        return JSONResponse(content={"error": "Job non trouvé ou déjà démarré"}, status_code=409)
+    return {"id": job_id, "status": "cancelled"}
 
 
 if __name__ == "__main__":
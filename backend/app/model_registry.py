@@ -0,0 +1,96 @@
+import threading
+import time
+import pyiqa
+import torch
+from app.models_config import PYIQA_DEVICE, PYIQA_WARMUP, PYIQA_BACKEND_NIMA, PYIQA_BACKEND_LIQE
+from app.inference_backends import build_backend
+from app.telemetry import Gauge, register
+
+PYIQA_MODELS = {
+    "NIMA (VGG16-AVA)": "nima-vgg16-ava",
+    "LIQE (No-Reference)": "liqe"
+}
+
+PYIQA_BACKENDS = {
+    "NIMA (VGG16-AVA)": PYIQA_BACKEND_NIMA,
+    "LIQE (No-Reference)": PYIQA_BACKEND_LIQE
+}
+
+WARMUP_SIZE = 256
+
+_instances = {}
+_stats = {}
+_locks = {name: threading.Lock() for name in PYIQA_MODELS}
+
+def get_device():
+    """Retourne le device utilisé pour l'inférence."""
+    if PYIQA_DEVICE:
+        return torch.device(PYIQA_DEVICE)
+    return torch.device("cuda") if torch.cuda.is_available() else torch.device("cpu")
+
+def warmup_model(model):
+    """Exécute une passe avant sur une image factice pour initialiser les noyaux."""
+    dummy = torch.rand(1, 3, WARMUP_SIZE, WARMUP_SIZE, device=get_device())
+    with torch.no_grad():
+        model(dummy)
+
+def load_pyiqa_model(name):
+    """Charge un modèle PyIQA donné dans son backend d'inférence et mesure son coût de chargement."""
+    start = time.perf_counter()
+    metric = pyiqa.create_metric(PYIQA_MODELS[name], device=get_device())
+    model = build_backend(PYIQA_BACKENDS[name], metric, PYIQA_MODELS[name], get_device())
+    load_time = time.perf_counter() - start
+
+    warmup_time = 0.0
+    if PYIQA_WARMUP:
+        start = time.perf_counter()
+        warmup_model(model)
+        warmup_time = time.perf_counter() - start
+
+    _stats[name] = {
+        "metric": PYIQA_MODELS[name],
+        "device": str(get_device()),
+        "backend": model.name,
+        "load_time_s": round(load_time, 3),
+        "warmup_time_s": round(warmup_time, 3),
+        # Mémoire du module réellement utilisé par le backend (ex. version int8 pour `quantized`).
+        "memory_mb": round(model.memory_bytes() / 1024 ** 2, 1),
+    }
+    return model
+
+def get_pyiqa_model(name):
+    """Retourne l'instance d'un modèle PyIQA, chargée une seule fois à la première utilisation."""
+    if name not in PYIQA_MODELS:
+        raise KeyError(f"Modèle PyIQA inconnu : {name}")
+    model = _instances.get(name)
+    if model is None:
+        with _locks[name]:
+            model = _instances.get(name)
+            if model is None:
+                model = load_pyiqa_model(name)
+                _instances[name] = model
+    return model
+
+def preload_models():
+    """Charge (et préchauffe) tous les modèles PyIQA, pour un démarrage à chaud."""
+    for name in PYIQA_MODELS:
+        get_pyiqa_model(name)
+
+def get_model_stats():
+    """Retourne l'état de chargement, le temps de chargement et la mémoire de chaque modèle."""
+    return {
+        name: {"loaded": name in _instances, **_stats.get(name, {})}
+        for name in PYIQA_MODELS
+    }
+
+def get_model_version(name):
+    """Retourne l'identifiant de version d'un modèle, utilisé pour invalider les résultats en cache."""
+    return f"{PYIQA_MODELS[name]}@pyiqa-{pyiqa.__version__}+{PYIQA_BACKENDS[name]}"
+
+register(Gauge(
+    "photo_model_memory_bytes", "Mémoire des poids et buffers de chaque modèle chargé", ("model",),
+    lambda: {
+        (name,): stats["memory_mb"] * 1024 ** 2
+        for name, stats in get_model_stats().items() if stats["loaded"]
+    }
+))
@@ -1,20 +1,136 @@
-import pyiqa
-import torch
 from dotenv import load_dotenv
 import os
 
 load_dotenv()
 
 OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
+IMAGE_DIR = os.getenv("IMAGE_DIR", "data/img/")
 
-PYIQA_MODELS = {
-    "NIMA (VGG16-AVA)": "nima-vgg16-ava",
-    "LIQE (No-Reference)": "liqe"
-}
+# Chargement des modèles PyIQA : "1" pour tout charger au démarrage (warm start),
+# sinon chaque modèle est chargé à sa première utilisation.
+PYIQA_PRELOAD = os.getenv("PYIQA_PRELOAD", "0") == "1"
+PYIQA_WARMUP = os.getenv("PYIQA_WARMUP", "1") == "1"
+PYIQA_DEVICE = os.getenv("PYIQA_DEVICE", "")
 
-def load_pyiqa_model(model_name):
-    """Charge un modèle PyIQA donné."""
-    device = torch.device("cuda") if torch.cuda.is_available() else torch.device("cpu")
-    return pyiqa.create_metric(model_name, device=device)
+# Micro-batching des inférences PyIQA : taille maximale d'un batch et attente maximale (ms)
+# avant d'exécuter un batch incomplet.
+BATCH_MAX_SIZE = int(os.getenv("BATCH_MAX_SIZE", "8"))
+BATCH_MAX_WAIT_MS = float(os.getenv("BATCH_MAX_WAIT_MS", "10"))
 
-PYIQA_INSTANCES = {name: load_pyiqa_model(model) for name, model in PYIQA_MODELS.items()}
\ No newline at end of file
+# Pools d'exécution : les traitements bloquants (OpenCV, PyTorch) sont exécutés
+# hors de la boucle d'événements. Au-delà de EXECUTOR_MAX_QUEUE tâches en attente, le backend répond 503.
+CPU_COUNT = os.cpu_count() or 1
+OPENCV_WORKERS = int(os.getenv("OPENCV_WORKERS", str(CPU_COUNT)))
+TORCH_WORKERS = int(os.getenv("TORCH_WORKERS", "1"))
+TORCH_INTRA_OP_THREADS = int(os.getenv("TORCH_INTRA_OP_THREADS", str(CPU_COUNT)))
+EXECUTOR_MAX_QUEUE = int(os.getenv("EXECUTOR_MAX_QUEUE", "32"))
+
+# Cache des résultats d'analyse, indexé par le hash des octets de l'image, la métrique et la version du modèle.
+# RESULT_CACHE_DB active un second niveau persistant (SQLite) qui survit aux redémarrages, limité à
+# RESULT_CACHE_DB_MAX_ENTRIES résultats (les plus anciens et les expirés sont purgés régulièrement).
+RESULT_CACHE_MAX_ENTRIES = int(os.getenv("RESULT_CACHE_MAX_ENTRIES", "1024"))
+RESULT_CACHE_TTL_S = float(os.getenv("RESULT_CACHE_TTL_S", "86400"))
+RESULT_CACHE_DB = os.getenv("RESULT_CACHE_DB", "")
+RESULT_CACHE_DB_MAX_ENTRIES = int(os.getenv("RESULT_CACHE_DB_MAX_ENTRIES", "100000"))
+
+# Analyse par lot : nombre maximal d'images traitées simultanément par requête /analyze/batch/.
+BATCH_CONCURRENCY = int(os.getenv("BATCH_CONCURRENCY", str(2 * BATCH_MAX_SIZE)))
+
+# Index local des scores de la bibliothèque d'images (scoring incrémental de IMAGE_DIR).
+SCORE_INDEX_DB = os.getenv("SCORE_INDEX_DB", "data/score_index.sqlite")
+# L'état des jobs de scoring est partagé par les workers via SCORE_INDEX_DB ; un job sans nouvelles
+# depuis SCORING_JOB_STALE_S secondes (processus arrêté) est marqué en échec et n'empêche plus d'en lancer un autre.
+SCORING_JOB_STALE_S = float(os.getenv("SCORING_JOB_STALE_S", "600"))
+
+# Passerelle OpenAI : client asynchrone, concurrence et débit limités, timeouts, retries et cache des réponses.
+# OPENAI_BASE_URL permet de pointer vers le serveur de test local (app.llm_stub).
+OPENAI_BASE_URL = os.getenv("OPENAI_BASE_URL", "")
+LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", "8"))
+LLM_MAX_PENDING = int(os.getenv("LLM_MAX_PENDING", "64"))
+LLM_RATE_PER_S = float(os.getenv("LLM_RATE_PER_S", "5"))
+LLM_BURST = int(os.getenv("LLM_BURST", "10"))
+LLM_TIMEOUT_S = float(os.getenv("LLM_TIMEOUT_S", "60"))
+LLM_MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", "3"))
+LLM_BACKOFF_S = float(os.getenv("LLM_BACKOFF_S", "1"))
+LLM_CACHE_MAX_ENTRIES = int(os.getenv("LLM_CACHE_MAX_ENTRIES", "512"))
+LLM_CACHE_TTL_S = float(os.getenv("LLM_CACHE_TTL_S", "3600"))
+LLM_STUB_LATENCY_MS = float(os.getenv("LLM_STUB_LATENCY_MS", "800"))
+
+# Backend d'inférence par modèle PyIQA : eager, torchscript, onnx ou quantized (int8 dynamique).
+# Les backends optimisés ne sont utilisés que sur CPU ; en cas d'échec, retour au mode eager.
+PYIQA_BACKEND_NIMA = os.getenv("PYIQA_BACKEND_NIMA", "eager")
+PYIQA_BACKEND_LIQE = os.getenv("PYIQA_BACKEND_LIQE", "eager")
+# torchscript et onnx compilent une version par taille d'entrée H×W (une seule pour NIMA, qui travaille en 224),
+# à partir de sa COMPILED_SHAPE_MIN_USES-ième utilisation, et en gardent au plus COMPILED_SHAPES_MAX.
+ONNX_DIR = os.getenv("ONNX_DIR", "data/onnx")
+COMPILED_SHAPE_MIN_USES = int(os.getenv("COMPILED_SHAPE_MIN_USES", "3"))
+COMPILED_SHAPES_MAX = int(os.getenv("COMPILED_SHAPES_MAX", "16"))
+
+# Instrumentation : métriques Prometheus sur /metrics et en-tête Server-Timing optionnel sur les réponses.
+SERVER_TIMING = os.getenv("SERVER_TIMING", "1") == "1"
+
+# Résolution cible par métrique, en pixels (0 = résolution d'origine), sans déformation :
+# - OpenCV : plus grand côté, sans agrandissement ;
+# - NIMA et LIQE : petit côté, jamais sous MODEL_MIN_SIDE (NIMA recadre en 224, LIQE découpe des patchs de 224),
+#   quitte à agrandir les petites images ; un panorama garde ainsi un petit côté exploitable.
+# Les images sont décodées directement à la taille utile (réduction DCT des JPEG).
+TARGET_SIZE_OPENCV = int(os.getenv("TARGET_SIZE_OPENCV", "1024"))
+TARGET_SIZE_NIMA = int(os.getenv("TARGET_SIZE_NIMA", "224"))
+TARGET_SIZE_LIQE = int(os.getenv("TARGET_SIZE_LIQE", "384"))
+MODEL_MIN_SIDE = 224
+
+# Catalogue des images de IMAGE_DIR (dans SCORE_INDEX_DB) : intervalle du scan incrémental (0 = scan au démarrage
+# seulement) et taille maximale d'une page de /list-images/.
+CATALOG_SCAN_INTERVAL_S = float(os.getenv("CATALOG_SCAN_INTERVAL_S", "300"))
+CATALOG_PAGE_SIZE = int(os.getenv("CATALOG_PAGE_SIZE", "100"))
+CATALOG_MAX_PAGE_SIZE = int(os.getenv("CATALOG_MAX_PAGE_SIZE", "1000"))
+
+# Service des images de la bibliothèque : tailles de miniatures disponibles (plus grand côté, en pixels),
+# cache disque des miniatures (taille maximale avant éviction) et durée de cache côté client.
+THUMBNAIL_SIZES = tuple(int(size) for size in os.getenv("THUMBNAIL_SIZES", "128,256,512").split(",") if size.strip())
+THUMBNAIL_DIR = os.getenv("THUMBNAIL_DIR", "data/thumbnails")
+THUMBNAIL_CACHE_MAX_MB = float(os.getenv("THUMBNAIL_CACHE_MAX_MB", "256"))
+THUMBNAIL_QUALITY = int(os.getenv("THUMBNAIL_QUALITY", "85"))
+IMAGE_CACHE_MAX_AGE_S = int(os.getenv("IMAGE_CACHE_MAX_AGE_S", "3600"))
+
+# Cascade des analyses combinées : OpenCV d'abord, puis NIMA/LIQE seulement si l'image n'est pas trop floue,
+# puis GPT-4o seulement si NIMA et LIQE dépassent leur seuil. CASCADE_MODE=1 l'active par défaut
+# (chaque requête peut la forcer avec le champ `cascade`).
+CASCADE_MODE = os.getenv("CASCADE_MODE", "0") == "1"
+CASCADE_BLUR_REJECT = float(os.getenv("CASCADE_BLUR_REJECT", "0.95"))
+CASCADE_NIMA_REJECT = float(os.getenv("CASCADE_NIMA_REJECT", "3"))
+CASCADE_LIQE_REJECT = float(os.getenv("CASCADE_LIQE_REJECT", "2"))
+
+# Service multi-processus (python -m app.server) : les modèles sont chargés une fois dans le processus parent
+# puis partagés (copy-on-write) par SERVER_WORKERS workers forkés, qui se répartissent les threads
+# TORCH_INTRA_OP_THREADS et OPENCV_WORKERS.
+SERVER_HOST = os.getenv("SERVER_HOST", "0.0.0.0")
+SERVER_PORT = int(os.getenv("SERVER_PORT", "8000"))
+SERVER_WORKERS = int(os.getenv("SERVER_WORKERS", "1"))
+
+# File persistante des analyses longues (GPT-4o) : base SQLite, workers asynchrones par processus,
+# taille maximale de la file, durée de conservation des résultats, intervalle de scrutation et délai
+# au-delà duquel un job sans heartbeat (processus arrêté) est remis en file.
+QUEUE_DB = os.getenv("QUEUE_DB", "data/queue.sqlite")
+QUEUE_WORKERS = int(os.getenv("QUEUE_WORKERS", "4"))
+QUEUE_MAX_PENDING = int(os.getenv("QUEUE_MAX_PENDING", "256"))
+QUEUE_RETENTION_S = float(os.getenv("QUEUE_RETENTION_S", "86400"))
+QUEUE_POLL_S = float(os.getenv("QUEUE_POLL_S", "1"))
+QUEUE_STALE_S = float(os.getenv("QUEUE_STALE_S", "60"))
+
+# Quasi-doublons : hash perceptuel (phash ou dhash) des images analysées. Avec NEAR_DUPLICATE_REUSE=1, une image
+# à une distance de Hamming <= NEAR_DUPLICATE_DISTANCE (sur 64 bits) d'une image déjà analysée réutilise son score
+# NIMA (marqué approximatif). Désactivé par défaut ; jamais pour les métriques techniques, car le hash ignore le flou.
+# CATALOG_PHASH calcule aussi le hash des images de IMAGE_DIR pour regrouper leurs doublons.
+PHASH_ALGORITHM = os.getenv("PHASH_ALGORITHM", "phash")
+NEAR_DUPLICATE_REUSE = os.getenv("NEAR_DUPLICATE_REUSE", "0") == "1"
+NEAR_DUPLICATE_DISTANCE = int(os.getenv("NEAR_DUPLICATE_DISTANCE", "4"))
+NEAR_DUPLICATE_MAX_ENTRIES = int(os.getenv("NEAR_DUPLICATE_MAX_ENTRIES", "100000"))
+CATALOG_PHASH = os.getenv("CATALOG_PHASH", "1") == "1"
+
+# Limites d'ingestion : taille maximale d'une image envoyée, taille maximale du corps d'une requête
+# (lot multi-fichiers compris, refusé en 413 dès le dépassement) et nombre maximal de pixels décodés
+# (protection contre les bombes de décompression, vérifiée sur l'en-tête avant tout décodage).
+UPLOAD_MAX_MB = float(os.getenv("UPLOAD_MAX_MB", "50"))
+REQUEST_MAX_MB = float(os.getenv("REQUEST_MAX_MB", "200"))
+MAX_IMAGE_PIXELS = int(os.getenv("MAX_IMAGE_PIXELS", "50000000"))
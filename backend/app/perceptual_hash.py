@@ -0,0 +1,150 @@
+import threading
+from collections import OrderedDict
+import cv2
+import numpy as np
+from app.models_config import PHASH_ALGORITHM, NEAR_DUPLICATE_DISTANCE, NEAR_DUPLICATE_MAX_ENTRIES
+from app.image_pipeline import decode_image
+from app.telemetry import CACHE_HITS, CACHE_MISSES, stage
+
+HASH_SIZE = 8
+# Taille de décodage : suffisante pour le redimensionnement 32x32 du pHash, et décodée très vite (réduction DCT).
+HASH_DECODE_SIZE = 64
+
+def bits_to_int(bits):
+    return int.from_bytes(np.packbits(bits.flatten()).tobytes(), "big")
+
+def dhash(gray, hash_size=HASH_SIZE):
+    """Hash par différence : compare chaque pixel à son voisin de droite sur une vignette (hash_size+1) x hash_size."""
+    small = cv2.resize(gray, (hash_size + 1, hash_size), interpolation=cv2.INTER_AREA)
+    return bits_to_int(small[:, 1:] > small[:, :-1])
+
+def phash(gray, hash_size=HASH_SIZE, highfreq_factor=4):
+    """Hash perceptuel : signe des basses fréquences de la DCT par rapport à leur médiane."""
+    size = hash_size * highfreq_factor
+    small = cv2.resize(gray, (size, size), interpolation=cv2.INTER_AREA).astype(np.float32)
+    low_frequencies = cv2.dct(small)[:hash_size, :hash_size]
+    return bits_to_int(low_frequencies > np.median(low_frequencies))
+
+HASH_FUNCTIONS = {"phash": phash, "dhash": dhash}
+
+def image_hash(data, algorithm=PHASH_ALGORITHM):
+    """Hash perceptuel (entier 64 bits) des octets d'une image."""
+    with stage("phash"):
+        decoded = decode_image(data, HASH_DECODE_SIZE, grayscale=True)
+        return HASH_FUNCTIONS[algorithm](decoded.gray)
+
+def hash_to_hex(value):
+    return f"{value:016x}"
+
+def hamming(a, b):
+    return bin(a ^ b).count("1")
+
+class BKTree:
+    """Arbre BK sur la distance de Hamming : recherche des hashs à distance <= r sans parcourir tout l'index."""
+
+    def __init__(self):
+        self.root = None
+        self.size = 0
+
+    def add(self, key, value):
+        self.size += 1
+        if self.root is None:
+            self.root = (key, [value], {})
+            return
+        node = self.root
+        while True:
+            distance = hamming(key, node[0])
+            if distance == 0:
+                node[1].append(value)
+                return
+            child = node[2].get(distance)
+            if child is None:
+                node[2][distance] = (key, [value], {})
+                return
+            node = child
+
+    def search(self, key, radius):
+        """Retourne [(distance, valeur)] pour toutes les entrées à distance <= radius, les plus proches d'abord."""
+        results = []
+        stack = [self.root] if self.root is not None else []
+        while stack:
+            node_key, values, children = stack.pop()
+            distance = hamming(key, node_key)
+            if distance <= radius:
+                results.extend((distance, value) for value in values)
+            # Inégalité triangulaire : seuls les enfants dans [d - r, d + r] peuvent contenir des résultats.
+            for child_distance, child in children.items():
+                if distance - radius <= child_distance <= distance + radius:
+                    stack.append(child)
+        return sorted(results, key=lambda result: result[0])
+
+def group_near_duplicates(items, max_distance):
+    """Regroupe des (identifiant, hash) dont les hashs sont à distance <= max_distance (groupes d'au moins 2)."""
+    tree = BKTree()
+    for index, (_, value) in enumerate(items):
+        tree.add(value, index)
+
+    parents = list(range(len(items)))
+
+    def find(index):
+        while parents[index] != index:
+            parents[index] = parents[parents[index]]
+            index = parents[index]
+        return index
+
+    for index, (_, value) in enumerate(items):
+        for _, other in tree.search(value, max_distance):
+            parents[find(other)] = find(index)
+
+    groups = {}
+    for index, (identifier, _) in enumerate(items):
+        groups.setdefault(find(index), []).append(identifier)
+    return sorted((sorted(group) for group in groups.values() if len(group) > 1), key=len, reverse=True)
+
+class NearDuplicateIndex:
+    """
+    Index des images déjà analysées par hash perceptuel : les résultats d'une image quasi identique
+    (rafale, ré-export, ré-encodage JPEG) sont réutilisés au lieu de relancer les modèles.
+    """
+
+    def __init__(self, max_distance=NEAR_DUPLICATE_DISTANCE, max_entries=NEAR_DUPLICATE_MAX_ENTRIES):
+        self.max_distance = max_distance
+        self.max_entries = max(1, max_entries)
+        self._entries = OrderedDict()
+        self._tree = BKTree()
+        self._lock = threading.Lock()
+
+    def lookup(self, value, metric, version):
+        """Retourne (résultat, hash de l'image d'origine, distance) de l'image la plus proche, ou None."""
+        result_key = f"{metric}:{version}"
+        with self._lock:
+            for distance, key in self._tree.search(value, self.max_distance):
+                entry = self._entries.get(key, {}).get(result_key)
+                if entry is not None:
+                    CACHE_HITS.inc("near_duplicate")
+                    return (*entry, distance)
+        CACHE_MISSES.inc("near_duplicate")
+        return None
+
+    def add(self, value, metric, version, result, digest):
+        """Enregistre le résultat d'une métrique pour une image analysée."""
+        with self._lock:
+            if value not in self._entries:
+                self._tree.add(value, value)
+            self._entries.setdefault(value, {})[f"{metric}:{version}"] = (result, digest)
+            self._entries.move_to_end(value)
+            if len(self._entries) > self.max_entries:
+                self._shrink()
+
+    def _shrink(self):
+        # Un arbre BK ne supporte pas la suppression : on garde la moitié la plus récente et on le reconstruit.
+        for _ in range(len(self._entries) - self.max_entries // 2):
+            self._entries.popitem(last=False)
+        self._tree = BKTree()
+        for value in self._entries:
+            self._tree.add(value, value)
+
+    def stats(self):
+        return {"images": len(self._entries), "max_entries": self.max_entries, "max_distance": self.max_distance}
+
+NEAR_DUPLICATES = NearDuplicateIndex()
@@ -0,0 +1,176 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from app.models_config import (
+    RESULT_CACHE_MAX_ENTRIES, RESULT_CACHE_TTL_S, RESULT_CACHE_DB, RESULT_CACHE_DB_MAX_ENTRIES
+)
+from app.executor import BoundedExecutor, ExecutorSaturated
+
+# Purge du niveau SQLite (expirés, puis plus anciens au-delà de db_max_entries) toutes les N écritures.
+PURGE_EVERY_WRITES = 256
+
+def image_digest(data):
+    """Calcule l'empreinte SHA-256 des octets d'une image."""
+    return hashlib.sha256(data).hexdigest()
+
+def cache_key(digest, metric, version, extra=""):
+    """Construit la clé de cache d'un résultat : hash de l'image, métrique, version du modèle."""
+    key = f"{digest}:{metric}:{version}"
+    return f"{key}:{hashlib.sha256(extra.encode()).hexdigest()[:16]}" if extra else key
+
+class ResultCache:
+    """
+    Cache LRU en mémoire avec expiration, doublé d'un niveau SQLite optionnel.
+    Depuis la boucle d'événements, utiliser aget/aset/ainvalidate : les accès SQLite passent par un pool dédié.
+    """
+
+    def __init__(self, max_entries=RESULT_CACHE_MAX_ENTRIES, ttl=RESULT_CACHE_TTL_S, db_path=RESULT_CACHE_DB,
+                 db_max_entries=RESULT_CACHE_DB_MAX_ENTRIES):
+        self.max_entries = max(1, max_entries)
+        self.db_max_entries = db_max_entries
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.db_path = db_path
+        self._db = None
+        self._writes = 0
+        # Une seule connexion SQLite, protégée par le verrou : un thread suffit.
+        self.executor = BoundedExecutor("cache", 1)
+        if db_path:
+            self._connect()
+            # Une connexion SQLite ne doit pas être partagée entre processus : chaque worker forké rouvre la sienne.
+            os.register_at_fork(after_in_child=self._connect)
+
+    def _connect(self):
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(self.db_path, check_same_thread=False)
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS results ("
+            "key TEXT PRIMARY KEY, digest TEXT, value TEXT, created REAL)"
+        )
+        self._db.execute("CREATE INDEX IF NOT EXISTS results_digest ON results (digest)")
+        self._db.execute("CREATE INDEX IF NOT EXISTS results_created ON results (created)")
+        self._db.commit()
+        with self._lock:
+            self._purge()
+
+    def _purge(self):
+        """Supprime du niveau SQLite les résultats expirés puis les plus anciens au-delà de db_max_entries."""
+        if self.ttl > 0:
+            self._db.execute("DELETE FROM results WHERE created < ?", (time.time() - self.ttl,))
+        if self.db_max_entries > 0:
+            self._db.execute(
+                "DELETE FROM results WHERE key IN "
+                "(SELECT key FROM results ORDER BY created DESC LIMIT -1 OFFSET ?)", (self.db_max_entries,)
+            )
+        self._db.commit()
+
+    def _expired(self, created):
+        return self.ttl > 0 and time.time() - created > self.ttl
+
+    def _remember(self, key, value, created):
+        self._entries[key] = (value, created)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def get(self, key):
+        """Retourne le résultat en cache pour une clé, ou None."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and self._expired(entry[1]):
+                del self._entries[key]
+                entry = None
+
+            if entry is None and self._db is not None:
+                row = self._db.execute("SELECT value, created FROM results WHERE key = ?", (key,)).fetchone()
+                if row is not None and not self._expired(row[1]):
+                    entry = (json.loads(row[0]), row[1])
+                    self._remember(key, *entry)
+
+            if entry is None:
+                self.misses += 1
+                return None
+
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    async def aget(self, key):
+        """Comme get, sans bloquer la boucle d'événements : seule une lecture SQLite passe par le pool."""
+        if self._db is not None:
+            with self._lock:
+                in_memory = key in self._entries
+            if not in_memory:
+                return await self.executor.run(self.get, key)
+        return self.get(key)
+
+    def _persist(self, key, value, created):
+        with self._lock:
+            self._db.execute(
+                "INSERT OR REPLACE INTO results (key, digest, value, created) VALUES (?, ?, ?, ?)",
+                (key, key.split(":", 1)[0], json.dumps(value), created)
+            )
+            self._db.commit()
+            self._writes += 1
+            if self._writes % PURGE_EVERY_WRITES == 0:
+                self._purge()
+
+    def set(self, key, value):
+        """Enregistre un résultat dans le cache."""
+        created = time.time()
+        with self._lock:
+            self._remember(key, value, created)
+        if self._db is not None:
+            self._persist(key, value, created)
+
+    async def aset(self, key, value):
+        """Comme set, sans bloquer la boucle d'événements : l'écriture SQLite passe par le pool."""
+        created = time.time()
+        with self._lock:
+            self._remember(key, value, created)
+        if self._db is not None:
+            try:
+                await self.executor.run(self._persist, key, value, created)
+            except ExecutorSaturated:
+                # Le résultat reste en mémoire ; il ne sera simplement pas persisté.
+                pass
+
+    async def ainvalidate(self, digest=None):
+        return await self.executor.run(self.invalidate, digest)
+
+    def invalidate(self, digest=None):
+        """Supprime les entrées d'une image (par hash), ou tout le cache si aucun hash n'est fourni."""
+        with self._lock:
+            keys = [key for key in self._entries if digest is None or key.startswith(f"{digest}:")]
+            for key in keys:
+                del self._entries[key]
+            removed = len(keys)
+
+            if self._db is not None:
+                if digest is None:
+                    cursor = self._db.execute("DELETE FROM results")
+                else:
+                    cursor = self._db.execute("DELETE FROM results WHERE digest = ?", (digest,))
+                self._db.commit()
+                removed = max(removed, cursor.rowcount)
+        return removed
+
+    def stats(self):
+        """Retourne le nombre d'entrées en mémoire et les compteurs de hits/misses."""
+        return {
+            "entries": len(self._entries),
+            "max_entries": self.max_entries,
+            "ttl_s": self.ttl,
+            "persistent": self._db is not None,
+            "hits": self.hits,
+            "misses": self.misses,
+        }
+
+RESULT_CACHE = ResultCache()
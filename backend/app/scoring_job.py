@@ -0,0 +1,347 @@
+import argparse
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from app.models_config import IMAGE_DIR, SCORE_INDEX_DB, BATCH_MAX_SIZE, SCORING_JOB_STALE_S
+from app.classical_metrics import batch_classical_metrics
+from app.image_pipeline import prepare_views, preprocessing_version
+from app.batching import SCHEDULERS, score_batch
+from app.executor import OPENCV_EXECUTOR, configure_torch_threads
+from app.batch_analysis import PYIQA_METRICS
+from app.model_registry import get_model_version
+
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png")
+# Colonnes de l'état d'un job de scoring, dans l'ordre de la table scoring_jobs.
+JOB_COLUMNS = (
+    "id", "status", "error", "total", "to_score", "scored", "skipped", "failed", "started_at", "finished_at"
+)
+# L'avancement est enregistré (et l'annulation relue) toutes les N images examinées.
+PROGRESS_EVERY_FILES = 200
+
+def index_version():
+    """Version des métriques : un changement de modèle force le recalcul des scores."""
+    versions = [f"opencv:laplacian@{preprocessing_version('opencv')}"]
+    versions += [
+        f"{metric}:{get_model_version(name)}@{preprocessing_version(metric)}"
+        for metric, name in PYIQA_METRICS.items()
+    ]
+    return "+".join(versions)
+
+def open_index(db_path=SCORE_INDEX_DB):
+    """Ouvre (et crée si besoin) l'index SQLite des scores."""
+    os.makedirs(os.path.dirname(db_path) or ".", exist_ok=True)
+    db = sqlite3.connect(db_path, check_same_thread=False)
+    db.execute(
+        "CREATE TABLE IF NOT EXISTS scores ("
+        "path TEXT PRIMARY KEY, size INTEGER, mtime REAL, sha256 TEXT, version TEXT, "
+        "opencv REAL, nima REAL, liqe REAL, scored_at REAL, error TEXT)"
+    )
+    # État des jobs de scoring : visible de tous les workers, et un seul job à la fois pour toute l'instance.
+    db.execute(
+        "CREATE TABLE IF NOT EXISTS scoring_jobs ("
+        "id TEXT PRIMARY KEY, status TEXT, error TEXT, total INTEGER, to_score INTEGER, scored INTEGER, "
+        "skipped INTEGER, failed INTEGER, started_at REAL, finished_at REAL, created REAL, heartbeat REAL, "
+        "cancel_requested INTEGER NOT NULL DEFAULT 0)"
+    )
+    db.commit()
+    return db
+
+def file_sha256(path):
+    """Calcule l'empreinte SHA-256 d'un fichier, par blocs."""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def list_library(image_dir=IMAGE_DIR):
+    """Liste les images de la bibliothèque (chemins relatifs à image_dir)."""
+    images = []
+    for root, _, files in os.walk(image_dir):
+        for file in files:
+            if file.lower().endswith(IMAGE_EXTENSIONS):
+                images.append(os.path.relpath(os.path.join(root, file), image_dir))
+    return sorted(images)
+
+class ScoringJob:
+    """Scoring incrémental de la bibliothèque : seules les images nouvelles ou modifiées sont analysées."""
+
+    def __init__(self, image_dir=IMAGE_DIR, db_path=SCORE_INDEX_DB, batch_size=BATCH_MAX_SIZE):
+        self.id = uuid.uuid4().hex[:12]
+        self.image_dir = image_dir
+        self.db_path = db_path
+        self.batch_size = max(1, batch_size)
+        self.status = "pending"
+        self.error = None
+        self.total = 0
+        self.to_score = 0
+        self.scored = 0
+        self.skipped = 0
+        self.failed = 0
+        self.started_at = None
+        self.finished_at = None
+        self._cancelled = threading.Event()
+        self._thread = None
+
+    def start(self):
+        """Lance le job dans un thread en arrière-plan."""
+        self._thread = threading.Thread(target=self.run, name=f"scoring-{self.id}", daemon=True)
+        self._thread.start()
+        return self
+
+    def cancel(self):
+        self._cancelled.set()
+
+    def wait(self, timeout=None):
+        """Attend la fin du job ; retourne True s'il est terminé."""
+        self._thread.join(timeout)
+        return not self._thread.is_alive()
+
+    def progress(self):
+        """Retourne l'avancement et le débit du job."""
+        return job_progress({column: getattr(self, column) for column in JOB_COLUMNS})
+
+    def _save(self, db):
+        """
+        Enregistre l'avancement du job (qui sert aussi de signe de vie) et relit une éventuelle demande
+        d'annulation faite depuis un autre worker.
+        """
+        db.execute(
+            f"UPDATE scoring_jobs SET {', '.join(f'{column} = ?' for column in JOB_COLUMNS[1:])}, heartbeat = ? "
+            "WHERE id = ?",
+            (*(getattr(self, column) for column in JOB_COLUMNS[1:]), time.time(), self.id)
+        )
+        db.commit()
+        row = db.execute("SELECT cancel_requested FROM scoring_jobs WHERE id = ?", (self.id,)).fetchone()
+        if row and row[0]:
+            self._cancelled.set()
+
+    def _changed_files(self, db, version):
+        """
+        Retourne les images nouvelles ou modifiées (mtime/taille puis hash) depuis le dernier passage,
+        ainsi que celles dont l'analyse précédente a échoué.
+        """
+        changed = []
+        for count, relative_path in enumerate(list_library(self.image_dir), start=1):
+            if count % PROGRESS_EVERY_FILES == 0:
+                self._save(db)
+            if self._cancelled.is_set():
+                break
+            path = os.path.join(self.image_dir, relative_path)
+            stat = os.stat(path)
+            row = db.execute(
+                "SELECT size, mtime, sha256, version, error FROM scores WHERE path = ?", (relative_path,)
+            ).fetchone()
+            if row and row[4] is None and row[3] == version and row[0] == stat.st_size and row[1] == stat.st_mtime:
+                self.skipped += 1
+                continue
+
+            sha256 = file_sha256(path)
+            if row and row[4] is None and row[3] == version and row[2] == sha256:
+                # Fichier touché mais contenu identique : on met seulement à jour la signature.
+                db.execute(
+                    "UPDATE scores SET size = ?, mtime = ? WHERE path = ?",
+                    (stat.st_size, stat.st_mtime, relative_path)
+                )
+                self.skipped += 1
+                continue
+            changed.append((relative_path, stat, sha256))
+        db.commit()
+        return changed
+
+    def _model_scores(self, model_name, arrays):
+        """
+        Scores d'un modèle pour un batch, calculés dans le pool d'inférence du modèle (comme les requêtes).
+        Si le batch échoue, chaque image est réévaluée seule : seule l'image fautive est en erreur.
+        Retourne une liste de (score, erreur).
+        """
+        executor = SCHEDULERS[model_name].executor
+        try:
+            return [(score, None) for score in executor.call(score_batch, model_name, arrays)]
+        except Exception:
+            results = []
+            for array in arrays:
+                try:
+                    results.append((executor.call(score_batch, model_name, [array])[0], None))
+                except Exception as e:
+                    results.append((None, str(e) or type(e).__name__))
+            return results
+
+    def _score_batch(self, db, version, batch):
+        decoded, grays, rows = [], [], []
+        for relative_path, stat, sha256 in batch:
+            try:
+                with open(os.path.join(self.image_dir, relative_path), "rb") as f:
+                    data = f.read()
+                views = OPENCV_EXECUTOR.call(prepare_views, data, ["opencv", *PYIQA_METRICS])
+                decoded.append(views)
+                grays.append(views["opencv"].gray)
+                rows.append([relative_path, stat.st_size, stat.st_mtime, sha256, version, None, None, None, None])
+            except Exception as e:
+                self.failed += 1
+                db.execute(
+                    "INSERT OR REPLACE INTO scores (path, size, mtime, sha256, version, scored_at, error) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                    (relative_path, stat.st_size, stat.st_mtime, sha256, version, time.time(), str(e))
+                )
+
+        if decoded:
+            # Flou du batch : noyaux OpenCV image par image, dans un seul appel au pool OpenCV.
+            for row, metrics in zip(rows, OPENCV_EXECUTOR.call(batch_classical_metrics, grays)):
+                row[5] = metrics["blur_score"]
+
+            for column, (metric, model_name) in enumerate(PYIQA_METRICS.items(), start=6):
+                arrays = [views[metric].array for views in decoded]
+                for row, (score, error) in zip(rows, self._model_scores(model_name, arrays)):
+                    row[column] = score
+                    if error is not None and row[8] is None:
+                        row[8] = f"{metric} : {error}"
+            self.failed += sum(1 for row in rows if row[8] is not None)
+
+        now = time.time()
+        db.executemany(
+            "INSERT OR REPLACE INTO scores "
+            "(path, size, mtime, sha256, version, opencv, nima, liqe, error, scored_at) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            [(*row, now) for row in rows]
+        )
+        # Chaque batch est validé immédiatement : après un arrêt brutal, le job reprend là où il s'était arrêté.
+        db.commit()
+        self.scored += sum(1 for row in rows if row[8] is None)
+
+    def register(self):
+        """
+        Enregistre le job dans l'index, sauf si un autre job (de n'importe quel worker ou de la ligne
+        de commande) est déjà en cours : lève alors RuntimeError. Les jobs sans signe de vie depuis
+        SCORING_JOB_STALE_S secondes sont d'abord marqués en échec.
+        """
+        db = open_index(self.db_path)
+        try:
+            now = time.time()
+            # BEGIN IMMEDIATE : la vérification et l'insertion sont atomiques entre processus.
+            db.execute("BEGIN IMMEDIATE")
+            db.execute(
+                "UPDATE scoring_jobs SET status = 'failed', error = 'Job interrompu (processus arrêté)', "
+                "finished_at = heartbeat WHERE status IN ('pending', 'running') AND heartbeat < ?",
+                (now - SCORING_JOB_STALE_S,)
+            )
+            if db.execute("SELECT 1 FROM scoring_jobs WHERE status IN ('pending', 'running')").fetchone():
+                db.rollback()
+                raise RuntimeError("Un job de scoring est déjà en cours")
+            db.execute(
+                "INSERT INTO scoring_jobs (id, status, total, to_score, scored, skipped, failed, created, heartbeat) "
+                "VALUES (?, 'pending', 0, 0, 0, 0, 0, ?, ?)",
+                (self.id, now, now)
+            )
+            db.commit()
+        finally:
+            db.close()
+        return self
+
+    def run(self):
+        self.status = "running"
+        self.started_at = time.time()
+        db = open_index(self.db_path)
+        try:
+            self._save(db)
+            version = index_version()
+            changed = self._changed_files(db, version)
+            self.total = self.skipped + len(changed)
+            self.to_score = len(changed)
+            for start in range(0, len(changed), self.batch_size):
+                self._save(db)
+                if self._cancelled.is_set():
+                    break
+                self._score_batch(db, version, changed[start:start + self.batch_size])
+            self.status = "cancelled" if self._cancelled.is_set() else "done"
+        except Exception as e:
+            self.status = "failed"
+            self.error = str(e)
+        finally:
+            self.finished_at = time.time()
+            try:
+                self._save(db)
+            finally:
+                db.close()
+
+def job_progress(job):
+    """Avancement et débit d'un job à partir de son état (colonnes JOB_COLUMNS)."""
+    started_at, finished_at = job["started_at"], job["finished_at"]
+    elapsed = ((finished_at or time.time()) - started_at) if started_at else 0.0
+    return {
+        **{column: job[column] for column in JOB_COLUMNS if column not in ("started_at", "finished_at")},
+        "elapsed_s": round(elapsed, 2),
+        "images_per_s": round(job["scored"] / elapsed, 2) if elapsed > 0 else 0.0,
+    }
+
+def start_job(**kwargs):
+    """Lance un job de scoring, sauf si un autre job est déjà en cours (lève RuntimeError)."""
+    return ScoringJob(**kwargs).register().start()
+
+def get_job(job_id, db_path=SCORE_INDEX_DB):
+    """Avancement d'un job de scoring lu dans l'index (quel que soit le worker qui l'exécute), ou None."""
+    db = open_index(db_path)
+    try:
+        row = db.execute(f"SELECT {', '.join(JOB_COLUMNS)} FROM scoring_jobs WHERE id = ?", (job_id,)).fetchone()
+    finally:
+        db.close()
+    return job_progress(dict(zip(JOB_COLUMNS, row))) if row else None
+
+def list_jobs(db_path=SCORE_INDEX_DB, limit=50):
+    """Avancement des derniers jobs de scoring, du plus récent au plus ancien."""
+    db = open_index(db_path)
+    try:
+        rows = db.execute(
+            f"SELECT {', '.join(JOB_COLUMNS)} FROM scoring_jobs ORDER BY created DESC LIMIT ?", (limit,)
+        ).fetchall()
+    finally:
+        db.close()
+    return [job_progress(dict(zip(JOB_COLUMNS, row))) for row in rows]
+
+def cancel_job(job_id, db_path=SCORE_INDEX_DB):
+    """
+    Demande l'interruption d'un job : le worker qui l'exécute la relit avant chaque batch.
+    Retourne l'avancement du job, ou None s'il n'existe pas.
+    """
+    db = open_index(db_path)
+    try:
+        db.execute("UPDATE scoring_jobs SET cancel_requested = 1 WHERE id = ?", (job_id,))
+        db.commit()
+    finally:
+        db.close()
+    return get_job(job_id, db_path)
+
+def print_progress(job):
+    progress = job.progress()
+    print(f"[{progress['status']}] {progress['scored']}/{progress['to_score']} analysées, "
+          f"{progress['skipped']} inchangées, {progress['failed']} erreurs, "
+          f"{progress['images_per_s']} img/s")
+
+def main():
+    parser = argparse.ArgumentParser(description="Scoring incrémental de la bibliothèque d'images.")
+    parser.add_argument("--image-dir", default=IMAGE_DIR)
+    parser.add_argument("--db", default=SCORE_INDEX_DB)
+    parser.add_argument("--batch-size", type=int, default=BATCH_MAX_SIZE)
+    args = parser.parse_args()
+
+    configure_torch_threads()
+    try:
+        job = start_job(image_dir=args.image_dir, db_path=args.db, batch_size=args.batch_size)
+    except RuntimeError as e:
+        print(f"Erreur : {e}")
+        return
+    try:
+        while not job.wait(timeout=2):
+            print_progress(job)
+    except KeyboardInterrupt:
+        job.cancel()
+        job.wait()
+    print_progress(job)
+    if job.error:
+        print(f"Erreur : {job.error}")
+
+if __name__ == "__main__":
+    main()
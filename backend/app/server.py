@@ -0,0 +1,115 @@
+import argparse
+import gc
+import logging
+import os
+import signal
+import time
+import torch
+import uvicorn
+from app.models_config import (
+    SERVER_HOST, SERVER_PORT, SERVER_WORKERS, TORCH_INTRA_OP_THREADS, OPENCV_WORKERS
+)
+from app.model_registry import preload_models, get_device
+from app.executor import set_thread_budget
+
+logger = logging.getLogger(__name__)
+
+RESTART_DELAY_S = 1.0
+
+def thread_budget(workers):
+    """Répartit les threads PyTorch et OpenCV entre les workers (au moins un thread chacun)."""
+    return max(1, TORCH_INTRA_OP_THREADS // workers), max(1, OPENCV_WORKERS // workers)
+
+def run_worker(app, config, sock, index, workers):
+    """Point d'entrée d'un worker forké : applique son budget de threads et sert les requêtes sur la socket partagée."""
+    os.environ["WORKER_INDEX"] = str(index)
+    signal.signal(signal.SIGINT, signal.SIG_DFL)
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    set_thread_budget(*thread_budget(workers))
+    uvicorn.Server(config).run(sockets=[sock])
+
+class Supervisor:
+    """Processus parent : charge les modèles, forke les workers et les relance s'ils s'arrêtent."""
+
+    def __init__(self, app, host=SERVER_HOST, port=SERVER_PORT, workers=SERVER_WORKERS):
+        self.app = app
+        self.workers = max(1, workers)
+        self.config = uvicorn.Config(app, host=host, port=port)
+        self.children = {}
+        self.stopping = False
+
+    def load_shared_models(self):
+        """
+        Charge les modèles avant le fork : leurs poids sont partagés par tous les workers (copy-on-write).
+        Le parent reste mono-thread pour PyTorch, aucun pool de threads n'est donc hérité par les workers.
+        """
+        if get_device().type != "cpu":
+            logger.warning("Device %s : CUDA ne survit pas au fork, chaque worker chargera ses modèles", get_device())
+            return
+        torch.set_num_threads(1)
+        preload_models()
+        # Les objets existants passent dans la génération permanente : le GC des workers ne les parcourt plus,
+        # ce qui évite de dupliquer les pages mémoire qui les contiennent.
+        gc.collect()
+        gc.freeze()
+
+    def spawn(self, sock, index):
+        pid = os.fork()
+        if pid == 0:
+            code = 0
+            try:
+                run_worker(self.app, self.config, sock, index, self.workers)
+            except BaseException:
+                logger.exception("Arrêt du worker %d sur erreur", index)
+                code = 1
+            finally:
+                os._exit(code)
+        self.children[pid] = index
+        logger.info("Worker %d démarré (pid %d)", index, pid)
+
+    def stop(self, signum, _frame):
+        self.stopping = True
+        for pid in self.children:
+            try:
+                os.kill(pid, signum)
+            except ProcessLookupError:
+                pass
+
+    def run(self):
+        self.load_shared_models()
+        sock = self.config.bind_socket()
+        signal.signal(signal.SIGINT, self.stop)
+        signal.signal(signal.SIGTERM, self.stop)
+        for index in range(self.workers):
+            self.spawn(sock, index)
+
+        while self.children:
+            try:
+                pid, status = os.wait()
+            except ChildProcessError:
+                break
+            index = self.children.pop(pid, None)
+            if index is None or self.stopping:
+                continue
+            logger.warning("Worker %d (pid %d) arrêté (statut %d), redémarrage", index, pid, status)
+            time.sleep(RESTART_DELAY_S)
+            self.spawn(sock, index)
+        sock.close()
+
+def main():
+    parser = argparse.ArgumentParser(description="Backend multi-processus avec modèles partagés entre workers.")
+    parser.add_argument("--host", default=SERVER_HOST)
+    parser.add_argument("--port", type=int, default=SERVER_PORT)
+    parser.add_argument("--workers", type=int, default=SERVER_WORKERS)
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+
+    from app.main import app
+
+    if args.workers <= 1:
+        uvicorn.run(app, host=args.host, port=args.port)
+        return
+    Supervisor(app, args.host, args.port, args.workers).run()
+
+if __name__ == "__main__":
+    main()
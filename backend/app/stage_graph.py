@@ -0,0 +1,63 @@
+import asyncio
+import time
+from app.telemetry import STAGE_RUNS, record_stage
+
+class SkipStage(Exception):
+    """Levée par une étape pour indiquer qu'elle n'est pas nécessaire ; ses dépendantes reçoivent None."""
+
+class StageGraph:
+    """Petit graphe de dépendances : chaque étape démarre dès que ses dépendances sont terminées."""
+
+    def __init__(self):
+        self.stages = {}
+        self.timings = {}
+        self.skipped = {}
+
+    def add(self, name, func, deps=()):
+        """
+        Ajoute une étape. `func` est une fonction async qui reçoit en arguments nommés
+        les résultats de ses dépendances, qui doivent avoir été ajoutées avant elle.
+        """
+        missing = [dep for dep in deps if dep not in self.stages]
+        if missing:
+            raise ValueError(f"Dépendances inconnues pour {name} : {', '.join(missing)}")
+        self.stages[name] = (func, tuple(deps))
+        return self
+
+    async def run(self):
+        """Exécute toutes les étapes, en parallèle dès que possible, et retourne leurs résultats."""
+        tasks = {}
+
+        async def run_stage(name):
+            func, deps = self.stages[name]
+            inputs = {dep: await tasks[dep] for dep in deps}
+            start = time.perf_counter()
+            try:
+                return await func(**inputs)
+            except SkipStage as e:
+                self.skipped[name] = str(e)
+                STAGE_RUNS.inc(name, "skipped")
+                return None
+            finally:
+                if name not in self.skipped:
+                    duration = time.perf_counter() - start
+                    self.timings[name] = round(duration * 1000, 2)
+                    record_stage(name, duration)
+                    STAGE_RUNS.inc(name, "ran")
+
+        for name in self.stages:
+            tasks[name] = asyncio.ensure_future(run_stage(name))
+        try:
+            results = await asyncio.gather(*tasks.values())
+        except BaseException:
+            for task in tasks.values():
+                task.cancel()
+            raise
+        return dict(zip(tasks, results))
+
+    def report(self):
+        """Indique pour chaque étape si elle a été exécutée ou sautée (et pourquoi)."""
+        return {
+            "stages": {name: "skipped" if name in self.skipped else "ran" for name in self.stages},
+            "skipped_reasons": dict(self.skipped),
+        }
@@ -0,0 +1,182 @@
+import contextvars
+import resource
+import threading
+import time
+from contextlib import contextmanager
+
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+_request_timings = contextvars.ContextVar("request_timings", default=None)
+_request_start = contextvars.ContextVar("request_start", default=None)
+_request_memory = contextvars.ContextVar("request_memory", default=None)
+
+def _format_labels(names, values):
+    if not names:
+        return ""
+    pairs = ",".join(f'{name}="{str(value).replace(chr(34), chr(39))}"' for name, value in zip(names, values))
+    return "{" + pairs + "}"
+
+class Counter:
+    """Compteur monotone, avec étiquettes optionnelles."""
+    kind = "counter"
+
+    def __init__(self, name, documentation, labels=()):
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *label_values, amount=1):
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0) + amount
+
+    def samples(self):
+        with self._lock:
+            return [(self.name, self.labels, key, value) for key, value in self._values.items()]
+
+class Histogram:
+    """Histogramme cumulatif (format Prometheus), avec étiquettes optionnelles."""
+    kind = "histogram"
+
+    def __init__(self, name, documentation, labels=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        self.buckets = tuple(buckets)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, *label_values):
+        with self._lock:
+            counts, total, count = self._values.get(label_values, ([0] * len(self.buckets), 0.0, 0))
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+            self._values[label_values] = (counts, total + value, count + 1)
+
+    def samples(self):
+        samples = []
+        with self._lock:
+            for key, (counts, total, count) in self._values.items():
+                for bound, bucket_count in zip(self.buckets, counts):
+                    samples.append((f"{self.name}_bucket", self.labels + ("le",), key + (bound,), bucket_count))
+                samples.append((f"{self.name}_bucket", self.labels + ("le",), key + ("+Inf",), count))
+                samples.append((f"{self.name}_sum", self.labels, key, total))
+                samples.append((f"{self.name}_count", self.labels, key, count))
+        return samples
+
+class Gauge:
+    """Jauge dont la valeur est lue au moment de l'export, via une fonction retournant {étiquettes: valeur}."""
+    kind = "gauge"
+
+    def __init__(self, name, documentation, labels=(), callback=None):
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        self.callback = callback
+
+    def samples(self):
+        values = self.callback() if self.callback else {}
+        return [(self.name, self.labels, key, value) for key, value in values.items()]
+
+METRICS = []
+
+def register(metric):
+    METRICS.append(metric)
+    return metric
+
+REQUESTS = register(Counter("photo_requests_total", "Requêtes HTTP traitées", ("route", "status")))
+ERRORS = register(Counter("photo_errors_total", "Requêtes HTTP en erreur (statut >= 500)", ("route",)))
+REQUEST_DURATION = register(Histogram("photo_request_duration_seconds", "Durée des requêtes HTTP", ("route",)))
+STAGE_DURATION = register(Histogram("photo_stage_duration_seconds", "Durée de chaque étape d'analyse", ("stage",)))
+STAGE_RUNS = register(Counter(
+    "photo_stage_runs_total", "Étapes d'analyse exécutées ou sautées (cascade)", ("stage", "outcome")
+))
+MODEL_DURATION = register(Histogram("photo_model_inference_seconds", "Durée d'une passe avant par modèle", ("model",)))
+MODEL_BATCH_SIZE = register(Histogram(
+    "photo_model_batch_size", "Taille des batchs d'inférence par modèle", ("model",), buckets=(1, 2, 4, 8, 16, 32, 64)
+))
+REQUEST_MEMORY = register(Histogram(
+    "photo_request_memory_peak_bytes", "Pic de mémoire estimé par requête (upload et images décodées)", ("route",),
+    buckets=tuple(2 ** power for power in range(20, 32, 2))
+))
+PROCESS_PEAK_RSS = register(Gauge(
+    "photo_process_peak_rss_bytes", "Pic de mémoire résidente du processus", (),
+    lambda: {(): resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024}
+))
+CACHE_HITS = register(Counter("photo_cache_hits_total", "Résultats servis depuis le cache", ("cache",)))
+CACHE_MISSES = register(Counter("photo_cache_misses_total", "Résultats absents du cache", ("cache",)))
+
+def render_metrics():
+    """Exporte toutes les métriques au format texte Prometheus."""
+    lines = []
+    for metric in METRICS:
+        lines.append(f"# HELP {metric.name} {metric.documentation}")
+        lines.append(f"# TYPE {metric.name} {metric.kind}")
+        for name, labels, values, value in metric.samples():
+            lines.append(f"{name}{_format_labels(labels, values)} {value}")
+    return "\n".join(lines) + "\n"
+
+def start_request_timings():
+    """Démarre la collecte des étapes de la requête courante (pour l'en-tête Server-Timing)."""
+    timings = []
+    _request_timings.set(timings)
+    _request_start.set(time.perf_counter())
+    return timings
+
+class MemoryAccount:
+    """Mémoire estimée d'une requête : octets reçus et images décodées encore en vie, avec leur pic."""
+
+    def __init__(self):
+        self.current = 0
+        self.peak = 0
+        self._lock = threading.Lock()
+
+    def allocate(self, nbytes):
+        with self._lock:
+            self.current += nbytes
+            self.peak = max(self.peak, self.current)
+
+    def release(self, nbytes):
+        with self._lock:
+            self.current -= nbytes
+
+def start_request_memory():
+    """Démarre le suivi de la mémoire de la requête courante."""
+    account = MemoryAccount()
+    _request_memory.set(account)
+    return account
+
+def track_memory(nbytes):
+    """Ajoute une allocation à la requête courante ; retourne son compte (None hors requête) pour la libérer."""
+    account = _request_memory.get()
+    if account is not None:
+        account.allocate(nbytes)
+    return account
+
+def mark_received():
+    """Enregistre l'étape "receive" : du début de la requête à la lecture complète de l'upload (multipart)."""
+    start = _request_start.get()
+    if start is not None:
+        record_stage("receive", time.perf_counter() - start)
+
+def record_stage(name, duration):
+    """Enregistre la durée (secondes) d'une étape, dans l'histogramme et dans la requête courante."""
+    STAGE_DURATION.observe(duration, name)
+    timings = _request_timings.get()
+    if timings is not None:
+        timings.append((name, duration))
+
+@contextmanager
+def stage(name):
+    """Chronomètre un bloc de code comme étape d'analyse."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_stage(name, time.perf_counter() - start)
+
+def server_timing_header(timings):
+    """Construit l'en-tête Server-Timing à partir des étapes d'une requête."""
+    return ", ".join(f"{name.replace(' ', '_')};dur={duration * 1000:.2f}" for name, duration in timings)
@@ -0,0 +1,204 @@
+import argparse
+import asyncio
+import io
+import itertools
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+import numpy as np
+import httpx
+from PIL import Image
+
+RESOLUTIONS = [(640, 480), (1920, 1080), (4000, 3000)]
+FORMATS = ["JPEG", "PNG"]
+ENDPOINTS = ["/analyze/opencv/", "/analyze/nima/", "/analyze/liqe/", "/analyze/3-combined/"]
+CONCURRENCY_LEVELS = [1, 4, 16]
+
+def synthetic_image(width, height, image_format="JPEG", seed=0):
+    """Génère une image synthétique (dégradé + texture + bruit) encodée dans le format demandé."""
+    rng = np.random.default_rng(seed)
+    x = np.linspace(0, 1, width, dtype=np.float32)
+    y = np.linspace(0, 1, height, dtype=np.float32)[:, None]
+    base = np.stack([x + 0 * y, y + 0 * x, 0.5 + 0.5 * np.sin(20 * x) * np.cos(20 * y)], axis=-1)
+    pixels = np.clip(base * 255 + rng.normal(0, 12, base.shape), 0, 255).astype(np.uint8)
+
+    buffer = io.BytesIO()
+    Image.fromarray(pixels).save(buffer, format=image_format, quality=90)
+    return buffer.getvalue()
+
+def percentiles(samples_ms):
+    """Résumé d'une série de latences (ms)."""
+    if not samples_ms:
+        return {"count": 0}
+    values = np.array(samples_ms)
+    return {
+        "count": len(values),
+        "mean_ms": round(float(values.mean()), 3),
+        "p50_ms": round(float(np.percentile(values, 50)), 3),
+        "p95_ms": round(float(np.percentile(values, 95)), 3),
+        "p99_ms": round(float(np.percentile(values, 99)), 3),
+    }
+
+def time_call(func, repeat):
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        samples.append((time.perf_counter() - start) * 1000)
+    return percentiles(samples)
+
+def micro_benchmarks(images, repeat):
+    """Micro-benchmarks des fonctions de image_analysis.py (et du décodage) pour chaque image synthétique."""
+    from app.image_analysis import (
+        detect_blur, detect_noise, validate_image, analyze_image_quality, compute_quality_score
+    )
+    from app.image_pipeline import decode_image, prepare_views, TARGET_RESOLUTIONS
+    from app.classical_metrics import batch_classical_metrics
+
+    results = {}
+    for name, data in images.items():
+        decoded = decode_image(data, grayscale=True)
+        resized = decoded.fit(TARGET_RESOLUTIONS["opencv"], grayscale=True)
+        results[name] = {
+            "decode_image": time_call(lambda: decode_image(data), repeat),
+            "decode_image_resized": time_call(lambda: decode_image(data, TARGET_RESOLUTIONS["opencv"], True), repeat),
+            "prepare_views": time_call(lambda: prepare_views(data, ["opencv", "nima", "liqe"]), repeat),
+            "validate_image": time_call(lambda: validate_image(decoded.array), repeat),
+            "detect_blur": time_call(lambda: detect_blur(decoded.gray), repeat),
+            "detect_blur_resized": time_call(lambda: detect_blur(resized.gray), repeat),
+            "detect_noise": time_call(lambda: detect_noise(decoded.gray), repeat),
+            "analyze_image_quality": time_call(lambda: analyze_image_quality(decoded.gray), repeat),
+            "compute_quality_score": time_call(lambda: compute_quality_score([0.2, 0.5, 0.8]), repeat),
+            "batch_classical_metrics_x16": time_call(lambda: batch_classical_metrics([resized.gray] * 16), repeat),
+        }
+    return results
+
+async def run_level(client, endpoint, payloads, concurrency, requests_count, bust_cache):
+    """Envoie requests_count requêtes avec `concurrency` requêtes simultanées ; retourne latences et débit."""
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies, statuses = [], {}
+
+    async def one(index):
+        name, data = payloads[index % len(payloads)]
+        if bust_cache:
+            # Octets ajoutés après la fin de l'image : pixels identiques, hash différent (pas de hit du cache).
+            data = data + os.urandom(16)
+        async with semaphore:
+            start = time.perf_counter()
+            try:
+                response = await client.post(endpoint, files={"file": (name, data)})
+                status = response.status_code
+            except httpx.HTTPError as e:
+                status = type(e).__name__
+            latencies.append((time.perf_counter() - start) * 1000)
+            statuses[str(status)] = statuses.get(str(status), 0) + 1
+
+    start = time.perf_counter()
+    await asyncio.gather(*(one(i) for i in range(requests_count)))
+    wall = time.perf_counter() - start
+    return {
+        "concurrency": concurrency,
+        "latency": percentiles(latencies),
+        "images_per_s": round(requests_count / wall, 3) if wall > 0 else 0.0,
+        "statuses": statuses,
+    }
+
+async def endpoint_benchmarks(client, payloads, endpoints, levels, requests_count, bust_cache):
+    results = {}
+    for endpoint in endpoints:
+        # Démarrage à froid : première requête (chargement paresseux des modèles inclus).
+        name, data = payloads[0]
+        start = time.perf_counter()
+        response = await client.post(endpoint, files={"file": (name, data + os.urandom(16))})
+        results[endpoint] = {
+            "cold_start_ms": round((time.perf_counter() - start) * 1000, 3),
+            "cold_start_status": response.status_code,
+            "levels": [
+                await run_level(client, endpoint, payloads, level, requests_count, bust_cache)
+                for level in levels
+            ],
+        }
+    return results
+
+def make_client(url, timeout):
+    """Client HTTP vers un serveur en cours d'exécution, ou vers l'application chargée dans ce processus."""
+    if url:
+        return httpx.AsyncClient(base_url=url, timeout=timeout), None
+
+    start = time.perf_counter()
+    from app.main import app
+    import_time = time.perf_counter() - start
+    transport = httpx.ASGITransport(app=app)
+    return httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=timeout), import_time
+
+def git_commit():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], text=True).strip()
+    except Exception:
+        return None
+
+async def main_async(args):
+    images = {}
+    for seed, ((width, height), image_format) in enumerate(itertools.product(RESOLUTIONS, FORMATS)):
+        images[f"{width}x{height}.{image_format.lower()}"] = synthetic_image(width, height, image_format, seed)
+    report = {
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "commit": git_commit(),
+        "python": platform.python_version(),
+        "cpu_count": os.cpu_count(),
+        "target": args.url or "in-process",
+        "near_duplicate_reuse": os.environ.get("NEAR_DUPLICATE_REUSE") if not args.url else None,
+    }
+
+    if not args.skip_micro:
+        report["micro"] = micro_benchmarks(images, args.repeat)
+
+    if not args.skip_endpoints:
+        client, import_time = make_client(args.url, args.timeout)
+        report["app_import_s"] = round(import_time, 3) if import_time is not None else None
+        async with client:
+            if import_time is not None:
+                # En mode in-process, les événements de démarrage ne sont pas déclenchés par ASGITransport.
+                from app.main import load_models
+                start = time.perf_counter()
+                load_models()
+                report["startup_s"] = round(time.perf_counter() - start, 3)
+
+            report["endpoints"] = {}
+            for name, data in images.items():
+                if args.resolutions and name.split(".")[0] not in args.resolutions:
+                    continue
+                report["endpoints"][name] = await endpoint_benchmarks(
+                    client, [(name, data)], args.endpoints, args.concurrency, args.requests, not args.allow_cache
+                )
+    return report
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmarks de latence et de débit du backend d'analyse.")
+    parser.add_argument("--url", help="URL d'un backend en cours d'exécution (par défaut : application chargée en local)")
+    parser.add_argument("--endpoints", nargs="+", default=ENDPOINTS)
+    parser.add_argument("--concurrency", nargs="+", type=int, default=CONCURRENCY_LEVELS)
+    parser.add_argument("--requests", type=int, default=32, help="Nombre de requêtes par niveau de concurrence")
+    parser.add_argument("--resolutions", nargs="+", help="Restreint les images synthétiques, ex. 1920x1080")
+    parser.add_argument("--repeat", type=int, default=20, help="Répétitions par micro-benchmark")
+    parser.add_argument("--timeout", type=float, default=300)
+    parser.add_argument("--allow-cache", action="store_true", help="Autorise les hits du cache de résultats")
+    parser.add_argument("--skip-micro", action="store_true")
+    parser.add_argument("--skip-endpoints", action="store_true")
+    parser.add_argument("--output", default="bench_results.json")
+    args = parser.parse_args()
+    if not args.allow_cache:
+        # Les octets aléatoires ajoutés à chaque requête laissent les pixels, donc le hash perceptuel, inchangés :
+        # la réutilisation des quasi-doublons servirait les requêtes "à froid" depuis son index.
+        os.environ["NEAR_DUPLICATE_REUSE"] = "0"
+
+    report = asyncio.run(main_async(args))
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2, ensure_ascii=False)
+    print(f"Résultats écrits dans {args.output}", file=sys.stderr)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,38 @@
+import io
+import pytest
+import numpy as np
+from PIL import Image
+from app.image_pipeline import MODEL_MIN_SIDE, decode_for_metric, decode_image, prepare_views, short_side_size
+from app.models_config import TARGET_SIZE_OPENCV
+
+def encode_jpeg(width, height, textured=False):
+    buffer = io.BytesIO()
+    if textured:
+        pixels = np.random.default_rng(0).integers(0, 256, (height, width, 3), dtype=np.uint8)
+        Image.fromarray(pixels).save(buffer, "JPEG")
+    else:
+        Image.new("RGB", (width, height), (120, 80, 40)).save(buffer, "JPEG")
+    return buffer.getvalue()
+
+@pytest.mark.parametrize("size", [(6000, 1200), (1200, 6000), (275, 183)])
+def test_model_views_keep_short_side_above_floor(size):
+    """Un panorama (ou une petite image) garde un petit côté >= 224 pour NIMA et LIQE."""
+    data = encode_jpeg(*size)
+    views = prepare_views(data, ["opencv", "nima", "liqe"])
+    for metric in ("nima", "liqe"):
+        assert min(views[metric].size) >= MODEL_MIN_SIDE
+        assert min(decode_for_metric(data, metric).size) >= MODEL_MIN_SIDE
+    assert max(views["opencv"].size) <= max(size)
+
+def test_short_side_size_keeps_aspect_ratio():
+    assert short_side_size((6000, 1200), 384) == (1920, 384)
+    assert short_side_size((275, 183), 384) == (337, 224)
+    assert short_side_size((300, 300), 0) == (300, 300)
+
+def test_opencv_view_of_small_image_uses_original_pixels():
+    """Les vues des modèles sont agrandies, mais la vue OpenCV n'est pas dérivée d'une base agrandie."""
+    data = encode_jpeg(275, 183, textured=True)
+    views = prepare_views(data, ["opencv", "nima", "liqe"])
+    expected = decode_image(data, TARGET_SIZE_OPENCV, True)
+    assert views["opencv"].size == (275, 183)
+    assert np.array_equal(views["opencv"].gray, expected.gray)
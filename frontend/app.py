@@ -1,9 +1,165 @@
 import streamlit as st
 import requests
+from requests.adapters import HTTPAdapter
 from PIL import Image, UnidentifiedImageError
+from concurrent.futures import ThreadPoolExecutor, as_completed
 import io
+import json
+import os
+import time
 
 BACKEND_URL = "http://backend:8000"
+JOB_POLL_INTERVAL_S = 1.0
+JOB_TIMEOUT_S = 300
+# Nombre d'images envoyées en parallèle en mode lot (et taille du pool de connexions).
+MAX_CONCURRENT_UPLOADS = 4
+MAX_FOLDER_IMAGES = 200
+JPEG_QUALITY = 95
+# Réduction optionnelle avant envoi. Par défaut, le backend décode au plus 1024 px sur le plus grand côté
+# pour OpenCV, et 224 px (NIMA) / 384 px (LIQE) sur le petit côté, jamais moins de 224 px : la réduction
+# plafonne le plus grand côté mais garde au moins MODEL_SHORT_SIDE px sur le petit côté (panoramas).
+DOWNSCALE_OPTIONS = {"Aucune (fichier d'origine)": None, "1024 px": 1024, "512 px": 512}
+MODEL_SHORT_SIDE = 384
+BATCH_METRICS = ["opencv", "nima", "liqe"]
+
+
+@st.cache_resource
+def http_session():
+    """Session HTTP partagée entre les reruns : les connexions keep-alive vers le backend sont réutilisées."""
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=MAX_CONCURRENT_UPLOADS)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+def upload_size(size, max_side):
+    """
+    Taille d'envoi : plus grand côté ramené à max_side, sans descendre sous MODEL_SHORT_SIDE px
+    sur le petit côté (ni agrandir l'image), pour ne pas dégrader les vues des modèles.
+    """
+    width, height = size
+    scale = min(1.0, max_side / max(width, height))
+    short = min(width, height)
+    if short * scale < MODEL_SHORT_SIDE:
+        scale = min(1.0, MODEL_SHORT_SIDE / short)
+    return max(1, round(width * scale)), max(1, round(height * scale))
+
+def prepare_upload(name, data, mime_type, max_side=None):
+    """
+    Fichier à envoyer au backend : les octets d'origine, sans ré-encodage, ou une version JPEG
+    réduite (voir upload_size) si l'image est plus grande que nécessaire.
+    """
+    if max_side:
+        image = Image.open(io.BytesIO(data))
+        target = upload_size(image.size, max_side)
+        if target[0] < image.size[0]:
+            # Décodage JPEG directement à l'échelle réduite la plus proche, puis réduction finale.
+            image.draft("RGB", target)
+            image = image.convert("RGB").resize(target, Image.Resampling.LANCZOS)
+            buffer = io.BytesIO()
+            image.save(buffer, format="JPEG", quality=JPEG_QUALITY)
+            return f"{os.path.splitext(name)[0]}.jpg", buffer.getvalue(), "image/jpeg"
+    return name, data, mime_type or "application/octet-stream"
+
+def error_message(response):
+    try:
+        return f"{response.status_code} {response.json().get('error', '')}"
+    except ValueError:
+        return str(response.status_code)
+
+def run_queued_job(endpoint, data, files=None):
+    """Soumet une analyse longue à la file du backend puis suit son état jusqu'au résultat."""
+    session = http_session()
+    response = session.post(f"{BACKEND_URL}{endpoint}", data=data, files=files)
+    if response.status_code != 202:
+        return None, error_message(response)
+
+    job_id = response.json()["id"]
+    status = st.empty()
+    deadline = time.monotonic() + JOB_TIMEOUT_S
+    while time.monotonic() < deadline:
+        response = session.get(f"{BACKEND_URL}/queue/{job_id}")
+        if response.status_code == 503:
+            # File momentanément saturée : on réessaie au prochain tour.
+            time.sleep(JOB_POLL_INTERVAL_S)
+            continue
+        if response.status_code != 200:
+            # Job purgé (404, rétention dépassée) ou erreur du backend.
+            status.empty()
+            return None, error_message(response)
+        job = response.json()
+        status.info(f"⏳ Job {job_id[:8]} : {job['status']}")
+        if job["status"] == "done":
+            status.empty()
+            return job["result"], None
+        if job["status"] in ("failed", "cancelled"):
+            status.empty()
+            return None, job.get("error") or job["status"]
+        time.sleep(JOB_POLL_INTERVAL_S)
+    return None, "délai d'attente dépassé"
+
+def analyze_upload(session, name, data, mime_type, metrics, max_side):
+    """Analyse une image téléversée via /analyze/batch/ (appelée en parallèle par le mode lot)."""
+    try:
+        response = session.post(
+            f"{BACKEND_URL}/analyze/batch/", data={"metrics": metrics},
+            files={"files": prepare_upload(name, data, mime_type, max_side)}
+        )
+        if response.status_code != 200:
+            return {"image": name, "error": error_message(response)}
+        return json.loads(response.text.splitlines()[0])
+    except (requests.RequestException, UnidentifiedImageError, ValueError) as e:
+        return {"image": name, "error": str(e)}
+
+def list_folder_images(session, folder, limit):
+    """Chemins des images d'un dossier de data/img, page par page depuis le catalogue du backend."""
+    paths, cursor = [], ""
+    while len(paths) < limit:
+        response = session.get(
+            f"{BACKEND_URL}/list-images/", params={"folder": folder, "cursor": cursor, "limit": limit - len(paths)}
+        )
+        if response.status_code != 200:
+            raise ValueError(error_message(response))
+        page = response.json()
+        paths += page["images"]
+        cursor = page.get("next_cursor")
+        if not cursor:
+            break
+    return paths
+
+def stream_folder_results(session, paths, metrics):
+    """Analyse des images du serveur : le backend renvoie une ligne JSON par image dès qu'elle est terminée."""
+    with session.post(
+        f"{BACKEND_URL}/analyze/batch/", data={"paths": paths, "metrics": metrics}, stream=True
+    ) as response:
+        if response.status_code != 200:
+            raise ValueError(error_message(response))
+        for line in response.iter_lines():
+            if line:
+                yield json.loads(line)
+
+def result_row(result):
+    """Ligne du tableau de résultats du mode lot."""
+    row = {"image": result.get("image")}
+    if "opencv" in result:
+        row["netteté"] = result["opencv"]["blur_score"]
+        row["évaluation"] = result["opencv"]["clarity"]
+    for metric in ("nima", "liqe"):
+        if metric in result:
+            row[metric.upper()] = round(result[metric], 2)
+    row["erreur"] = result.get("error", "")
+    return row
+
+def show_results(results, total):
+    """Affiche les résultats au fur et à mesure de leur arrivée, avec une barre de progression."""
+    progress = st.progress(0.0, text=f"0/{total} images analysées")
+    table = st.empty()
+    rows = []
+    for result in results:
+        rows.append(result_row(result))
+        progress.progress(len(rows) / total, text=f"{len(rows)}/{total} images analysées")
+        table.dataframe(rows, use_container_width=True)
+    return rows
 
 st.set_page_config(
     page_title="Analyse IA des Photos 📸",
@@ -18,8 +174,14 @@ st.sidebar.title("📌 Navigation")
 module = st.sidebar.radio(
     "Sélectionnez un module d'analyse",
     ["Module 1 - OpenCV", "Module 2 - NIMA (esthétique)", "Module 3 - LIQE (Technique)", 
-     "Module 4 - GPT", "Module 5 - Analyse Combinée"]
+     "Module 4 - GPT", "Module 5 - Analyse Combinée", "Module 6 - Analyse par lot"]
+)
+downscale = st.sidebar.selectbox(
+    "📐 Réduction avant envoi", list(DOWNSCALE_OPTIONS),
+    help="Réduit les grandes images avant l'envoi au backend (upload plus léger). "
+         "Les scores peuvent alors différer légèrement de ceux de l'image d'origine."
 )
+max_side = DOWNSCALE_OPTIONS[downscale]
 
 st.markdown(
     """
@@ -49,10 +211,8 @@ if module in ["Module 1 - OpenCV", "Module 2 - NIMA (esthétique)", "Module 3 -
 
     if uploaded_file:
         try:
-            image = Image.open(uploaded_file)
-            img_buffer = io.BytesIO()
-            image.convert("RGB").save(img_buffer, format="JPEG", quality=100)
-            image_bytes = img_buffer.getvalue()
+            image_bytes = uploaded_file.getvalue()
+            image = Image.open(io.BytesIO(image_bytes))
             st.image(image, caption="🖼️ Image téléversée", use_container_width=True)
         except UnidentifiedImageError:
             st.error("❌ Erreur : L'image téléversée est invalide ou corrompue.")
@@ -62,9 +222,9 @@ if module in ["Module 1 - OpenCV", "Module 2 - NIMA (esthétique)", "Module 3 -
             st.error("❌ Aucune image n'a été chargée. Veuillez téléverser une image.")
         else:
             with st.spinner("🔎 Analyse en cours..."):
-                files = {"file": ("image.jpg", image_bytes, "image/jpeg")}
+                files = {"file": prepare_upload(uploaded_file.name, image_bytes, uploaded_file.type, max_side)}
                 endpoint = "/analyze/opencv/" if module == "Module 1 - OpenCV" else "/analyze/nima/" if module == "Module 2 - NIMA (esthétique)" else "/analyze/liqe/"
-                response = requests.post(f"{BACKEND_URL}{endpoint}", files=files)
+                response = http_session().post(f"{BACKEND_URL}{endpoint}", files=files)
 
                 if response.status_code == 200:
                     result = response.json()
@@ -80,7 +240,7 @@ if module in ["Module 1 - OpenCV", "Module 2 - NIMA (esthétique)", "Module 3 -
                             st.markdown("⚠️ **L'image a une mauvaise qualité esthétique (score < 5)** 🔴")
 
                 else:
-                    st.error(f"❌ Erreur lors de l'analyse : {response.status_code}")
+                    st.error(f"❌ Erreur lors de l'analyse : {error_message(response)}")
 
 
 # ====================================================
@@ -104,14 +264,13 @@ elif module == "Module 4 - GPT":
             st.error("❌ Veuillez entrer une URL d'image valide.")
         else:
             with st.spinner("🔎 Analyse en cours..."):
-                response = requests.post(f"{BACKEND_URL}/analyze/openia-solo/", data={"image_url": image_url_4})
+                result, error = run_queued_job("/queue/openia-solo/", {"image_url": image_url_4})
 
-                if response.status_code == 200:
-                    result = response.json()
+                if error is None:
                     st.success("✅ Analyse réussie !")
                     st.write("📊 **Données API reçues :**", result)
                 else:
-                    st.error(f"❌ Erreur lors de l'analyse : {response.status_code}")
+                    st.error(f"❌ Erreur lors de l'analyse : {error}")
 
 # ===================================================
 # 🔵 MODULE 5 - ANALYSE COMBINÉE AVEC URL & UPLOAD
@@ -136,10 +295,8 @@ elif module == "Module 5 - Analyse Combinée":
 
     if uploaded_file_5:
         try:
-            image_5 = Image.open(uploaded_file_5)
-            img_buffer = io.BytesIO()
-            image_5.convert("RGB").save(img_buffer, format="JPEG", quality=100)
-            image_bytes_5 = img_buffer.getvalue()
+            image_bytes_5 = uploaded_file_5.getvalue()
+            image_5 = Image.open(io.BytesIO(image_bytes_5))
         except UnidentifiedImageError:
             st.error("❌ Erreur : L'image téléversée est invalide ou corrompue.")
 
@@ -148,12 +305,56 @@ elif module == "Module 5 - Analyse Combinée":
             st.error("❌ Veuillez téléverser une image et entrer une URL valide.")
         else:
             with st.spinner("🔎 Analyse en cours..."):
-                files = {"file": ("image.jpg", image_bytes_5, "image/jpeg")}
-                response = requests.post(f"{BACKEND_URL}/analyze/4-combined/", data={"image_url": image_url_5}, files=files)
+                files = {"file": prepare_upload(uploaded_file_5.name, image_bytes_5, uploaded_file_5.type, max_side)}
+                result, error = run_queued_job("/queue/4-combined/", {"image_url": image_url_5}, files)
 
-                if response.status_code == 200:
-                    result = response.json()
+                if error is None:
                     st.success("✅ Analyse réussie !")
                     st.write("📊 **Données API reçues :**", result)
                 else:
-                    st.error(f"❌ Erreur lors de l'analyse : {response.status_code}")
+                    st.error(f"❌ Erreur lors de l'analyse : {error}")
+
+# ===================================================
+# 🟣 MODULE 6 - ANALYSE PAR LOT (FICHIERS OU DOSSIER)
+# ===================================================
+elif module == "Module 6 - Analyse par lot":
+    st.markdown("<h2 style='color: #007BFF;'>🗂️ Analyse d'un lot d'images</h2>", unsafe_allow_html=True)
+
+    source = st.radio("Source des images", ["Fichiers téléversés", "Dossier du serveur (data/img)"], horizontal=True)
+    metrics = st.multiselect("Métriques", BATCH_METRICS, default=BATCH_METRICS)
+
+    if source == "Fichiers téléversés":
+        uploaded_files = st.file_uploader(
+            "📤 Téléversez des images :", type=["jpg", "jpeg", "png"], accept_multiple_files=True
+        )
+    else:
+        folder = st.text_input("📁 Dossier (relatif à data/img, vide pour tout le catalogue) :")
+        limit = st.number_input("Nombre maximal d'images", min_value=1, max_value=1000, value=MAX_FOLDER_IMAGES)
+
+    if st.button("🚀 Lancer l'analyse (Module 6)"):
+        session = http_session()
+        if not metrics:
+            st.error("❌ Veuillez choisir au moins une métrique.")
+        elif source == "Fichiers téléversés":
+            if not uploaded_files:
+                st.error("❌ Aucune image n'a été chargée. Veuillez téléverser des images.")
+            else:
+                # Les images sont envoyées en parallèle ; chaque résultat s'affiche dès sa réception.
+                with ThreadPoolExecutor(MAX_CONCURRENT_UPLOADS) as pool:
+                    futures = [
+                        pool.submit(analyze_upload, session, file.name, file.getvalue(), file.type,
+                                    ",".join(metrics), max_side)
+                        for file in uploaded_files
+                    ]
+                    show_results((future.result() for future in as_completed(futures)), len(futures))
+                st.success("✅ Analyse terminée !")
+        else:
+            try:
+                paths = list_folder_images(session, folder, int(limit))
+                if not paths:
+                    st.warning("⚠️ Aucune image dans ce dossier.")
+                else:
+                    show_results(stream_folder_results(session, paths, ",".join(metrics)), len(paths))
+                    st.success("✅ Analyse terminée !")
+            except (requests.RequestException, ValueError) as e:
+                st.error(f"❌ Erreur lors de l'analyse : {e}")